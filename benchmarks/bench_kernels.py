@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Micro-benchmarks of the numeric kernels of
+# generate_monthly_climatology.py on CMG sized grids:
+#
+#   accumulate   SdsAccumulator.add of one daily grid
+#   addGranule   read a daily granule's SDSs (readViirsAux) and add them to
+#                the monthly sums, as buildMonthlySums does for each day
+#   average      SdsAccumulator.average of a month of totals
+#   writeEnvi    writeResultsEnvi of the averages
+#
+# Each kernel is timed over several repeats and the median is reported.
+# The results can be saved as a baseline, and a run compared against a
+# baseline fails (exit status 1) if a kernel is slower than the baseline by
+# more than the threshold:
+#
+#     bench_kernels.py --save_baseline kernels.json
+#     bench_kernels.py --baseline kernels.json --threshold 0.2
+#
+# Baselines are only comparable on the same machine (instance type).
+############################################################################
+
+import sys
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import itertools
+import statistics
+import numpy
+
+from optparse import OptionParser
+
+# the climatology script is in the directory above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import generate_monthly_climatology as climatology
+
+from make_granules import makeGranule, CMG_ROWS, CMG_COLS, FILL_FRACTION
+
+# a month of daily grids
+DAYS = 31
+
+# allowed slowdown against the baseline before a kernel fails
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.2))
+
+ERROR = 1
+SUCCESS = 0
+
+
+def makeDailyGrid(rows, cols, seed):
+    """
+    Description: returns a synthetic daily ozone grid with fill pixels.
+    """
+    rng = numpy.random.default_rng(seed)
+    grid = rng.integers(1, 256, (rows, cols), dtype=numpy.uint8)
+    grid[rng.random((rows, cols)) < FILL_FRACTION] = 0
+    return grid
+
+
+def timeKernel(kernel, repeats):
+    """
+    Description: times a kernel.
+
+    Args:
+      kernel: function to time
+      repeats: number of timed calls
+
+    Returns: dict of the median, minimum and maximum seconds
+    """
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        kernel()
+        times.append(time.perf_counter() - start)
+
+    return {'median_s': statistics.median(times), 'min_s': min(times),
+            'max_s': max(times), 'repeats': repeats}
+
+
+def runKernels(rows, cols, repeats, workdir):
+    """
+    Description: runs the kernel benchmarks.
+
+    Returns: dict of kernel name to its timings
+    """
+    grids = [makeDailyGrid(rows, cols, seed) for seed in range(4)]
+    results = {}
+
+    # accumulate one daily grid into running totals
+    accumulator = climatology.SdsAccumulator()
+    accumulator.add(grids[0])
+    days = itertools.count()
+    results['accumulate'] = timeKernel(
+        lambda: accumulator.add(grids[next(days) % len(grids)]), repeats)
+
+    # read a daily granule from disk and add it to the monthly sums
+    granule = os.path.join(workdir, 'daily.h5')
+    makeGranule(granule, rows, cols, seed=0)
+    sums = climatology.MonthlySums()
+    doys = itertools.count(1)
+    results['addGranule'] = timeKernel(
+        lambda: sums.addGranule(next(doys),
+                                os.path.basename(granule),
+                                climatology.readViirsAux(granule)),
+        repeats)
+
+    # average a month of totals
+    month = climatology.SdsAccumulator()
+    for day in range(DAYS):
+        month.add(grids[day % len(grids)])
+    results['average'] = timeKernel(month.average, repeats)
+
+    # write the averages
+    average = month.average()
+    out_name = os.path.join(workdir, 'monthly_avg.img')
+    results['writeEnvi'] = timeKernel(
+        lambda: climatology.writeResultsEnvi(
+            average, out_name, climatology.gdal.GDT_Byte, 'monthly_avg'),
+        repeats)
+
+    return results
+
+
+def compareBaseline(results, baseline, threshold):
+    """
+    Description: compares the kernel timings against the baseline.
+
+    Args:
+      results: dict of kernel name to its timings
+      baseline: dict of kernel name to its baseline timings
+      threshold: allowed fractional slowdown of the median
+
+    Returns: list of the kernels which regressed
+    """
+    logger = logging.getLogger(__name__)
+
+    regressed = []
+    for (kernel, result) in results.items():
+        if kernel not in baseline:
+            continue
+        base = baseline[kernel]['median_s']
+        change = (result['median_s'] - base) / base if base > 0 else 0.0
+        result['baseline_median_s'] = base
+        result['change'] = round(change, 4)
+        if change > threshold:
+            logger.error('{} regressed: {:.4f}s vs {:.4f}s baseline ({:+.1f}%, '
+                         'threshold {:.0f}%)'
+                         .format(kernel, result['median_s'], base,
+                                 100.0 * change, 100.0 * threshold))
+            regressed.append(kernel)
+
+    return regressed
+
+
+def printResults(results):
+    print('{:<14} {:>10} {:>10} {:>10} {:>9}'
+          .format('kernel', 'median_s', 'min_s', 'base_s', 'change'))
+    for (kernel, result) in results.items():
+        base = result.get('baseline_median_s')
+        print('{:<14} {:>10.4f} {:>10.4f} {:>10} {:>9}'
+              .format(kernel, result['median_s'], result['min_s'],
+                      '{:.4f}'.format(base) if base is not None else '',
+                      '{:+.1f}%'.format(100.0 * result['change'])
+                      if 'change' in result else ''))
+
+
+def main ():
+    logger = logging.getLogger(__name__)
+
+    parser = OptionParser()
+    parser.add_option ('--rows', type='int', dest='rows', default=CMG_ROWS,
+        help='rows of the grids (default is {})'.format(CMG_ROWS))
+    parser.add_option ('--cols', type='int', dest='cols', default=CMG_COLS,
+        help='columns of the grids (default is {})'.format(CMG_COLS))
+    parser.add_option ('-r', '--repeats', type='int', dest='repeats',
+        default=7, help='timed calls of each kernel (default is 7)')
+    parser.add_option ('--baseline', dest='baseline', default=None,
+        help='JSON baseline to compare against')
+    parser.add_option ('--threshold', type='float', dest='threshold',
+        default=THRESHOLD,
+        help='allowed slowdown of a kernel against the baseline, as a '
+             'fraction (default is BENCH_THRESHOLD or 0.2)')
+    parser.add_option ('--save_baseline', dest='save_baseline',
+        default=None, help='save the results as a JSON baseline')
+
+    (options, args) = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='laads_kernels_')
+    try:
+        results = runKernels(options.rows, options.cols, options.repeats,
+                             workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressed = []
+    if options.baseline is not None:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)
+        if [baseline['rows'], baseline['cols']] != [options.rows,
+                                                    options.cols]:
+            logger.error('The baseline is for {}x{} grids'
+                         .format(baseline['rows'], baseline['cols']))
+            return ERROR
+        regressed = compareBaseline(results, baseline['kernels'],
+                                    options.threshold)
+
+    printResults(results)
+
+    if options.save_baseline is not None:
+        with open(options.save_baseline, 'w') as fh:
+            json.dump({'rows': options.rows, 'cols': options.cols,
+                       'kernels': results}, fh, indent=2)
+        logger.info('Wrote {}'.format(options.save_baseline))
+
+    return ERROR if regressed else SUCCESS
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format=('%(asctime)s.%(msecs)03d %(process)d'
+                                ' %(levelname)-8s'
+                                ' %(filename)s:%(lineno)d:'
+                                '%(funcName)s -- %(message)s'),
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO)
+    sys.exit(main())
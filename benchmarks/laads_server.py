@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Local stand-in for the LAADS DAAC archive used by the
+# benchmarks.  It serves the archive layout read by laads_client.py:
+#
+#     /archive/allData/5200/<product>/<year>/<doy>.csv    daily listing
+#     /archive/allData/5200/<product>/<year>/<doy>/<name> daily granule
+#
+# Every day up to --lag days ago has one granule per served product.  The
+# granules are synthetic template files (see make_granules.py) served under
+# the LAADS name of each day, so any date range can be served from a few
+# templates.  Requests need the bearer token, and latency, errors, granule
+# transfers cut off partway and a bandwidth limit can be injected.  Granule
+# requests may have a Range header (bytes=<start>-) to continue a partial
+# download.  GET /stats returns the request counters as JSON.
+#
+#     laads_server.py --port 8080 --latency 0.05 --error_rate 0.01 \
+#         --truncate_rate 0.05 template1.h5 template2.h5
+#
+# Point updatelads.py and generate_monthly_climatology.py at it with
+# LAADS_SERVER_URL=http://localhost:8080.
+############################################################################
+
+import sys
+import os
+import re
+import json
+import time
+import random
+import logging
+import datetime
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from email.utils import formatdate
+from optparse import OptionParser
+
+from make_granules import granuleName
+
+ARCHIVE_PATH = '/archive/allData/5200'
+DEFAULT_PRODUCTS = ('VJ104ANC', 'VNP04ANC')
+DEFAULT_TOKEN = 'benchmark-token'
+
+LISTING_RE = re.compile(r'^{}/(?P<product>[A-Z0-9]+)/(?P<year>\d{{4}})/'
+                        r'(?P<doy>\d{{3}})\.csv$'.format(ARCHIVE_PATH))
+GRANULE_RE = re.compile(r'^{}/(?P<product>[A-Z0-9]+)/(?P<year>\d{{4}})/'
+                        r'(?P<doy>\d{{3}})/(?P<name>[^/]+)$'
+                        .format(ARCHIVE_PATH))
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d+)-$')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class LaadsStats(object):
+    """
+    Description: request counters of the server, shared by the handler
+    threads.
+    """
+    FIELDS = ('requests', 'listings', 'granules', 'ranges', 'bytes',
+              'not_found', 'unauthorized', 'injected_errors', 'truncated')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict((field, 0) for field in self.FIELDS)
+
+    def add(self, field, value=1):
+        with self._lock:
+            self._counts[field] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    Description: HTTP server handling each request in a thread (the
+    http.server one needs Python 3.7).
+    """
+    daemon_threads = True
+
+
+class LaadsServer(ThreadingHTTPServer):
+    """
+    Description: threaded HTTP server with the stand-in archive settings.
+
+    Args:
+      address: (host, port) to listen on, port 0 picks a free port
+      templates: granule files served for the days (chosen by DOY)
+      products: products available for every day
+      token: bearer token required by the requests (None to allow any)
+      latency: seconds added to each request
+      error_rate: fraction of the requests answered with a 503
+      truncate_rate: fraction of the granule downloads cut off halfway
+      bandwidth: bytes per second per granule download (0 is unlimited)
+      lag: days before today which are available
+    """
+    daemon_threads = True
+
+    def __init__(self, address, templates, products=DEFAULT_PRODUCTS,
+                 token=DEFAULT_TOKEN, latency=0.0, error_rate=0.0,
+                 truncate_rate=0.0, bandwidth=0, lag=1):
+        ThreadingHTTPServer.__init__(self, address, LaadsHandler)
+        self.templates = list(templates)
+        self.products = tuple(products)
+        self.token = token
+        self.latency = latency
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.bandwidth = bandwidth
+        self.last_day = datetime.date.today() - datetime.timedelta(days=lag)
+        self.stats = LaadsStats()
+        self._random = random.Random(0)
+        self._random_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.server_address[0],
+                                     self.server_address[1])
+
+    def injectError(self):
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def injectTruncate(self):
+        with self._random_lock:
+            return self._random.random() < self.truncate_rate
+
+    def isAvailable(self, product, year, doy):
+        if product not in self.products:
+            return False
+        try:
+            day = (datetime.date(year, 1, 1) +
+                   datetime.timedelta(days=doy - 1))
+        except ValueError:
+            return False
+        return day.year == year and day <= self.last_day
+
+    def template(self, doy):
+        return self.templates[doy % len(self.templates)]
+
+
+class LaadsHandler(BaseHTTPRequestHandler):
+    """
+    Description: handles the listing, granule and stats requests.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # the headers and body are written separately, so without this the
+    # keep-alive connections stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def sendEmpty(self, status, headers=None):
+        self.send_response(status)
+        for (key, value) in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def respond(self, send_body):
+        server = self.server
+        path = self.path.split('?', 1)[0]
+
+        if path == '/stats':
+            body = json.dumps(server.stats.snapshot()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return
+
+        server.stats.add('requests')
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        if server.token is not None and \
+                self.headers.get('Authorization') != \
+                'Bearer {}'.format(server.token):
+            server.stats.add('unauthorized')
+            self.sendEmpty(401)
+            return
+
+        if server.injectError():
+            server.stats.add('injected_errors')
+            self.sendEmpty(503, {'Retry-After': '1'})
+            return
+
+        match = LISTING_RE.match(path)
+        if match:
+            self.sendListing(match.group('product'),
+                             int(match.group('year')),
+                             int(match.group('doy')), send_body)
+            return
+
+        match = GRANULE_RE.match(path)
+        if match:
+            self.sendGranule(match.group('product'),
+                             int(match.group('year')),
+                             int(match.group('doy')), match.group('name'),
+                             send_body)
+            return
+
+        server.stats.add('not_found')
+        self.sendEmpty(404)
+
+    def sendListing(self, product, year, doy, send_body):
+        server = self.server
+        if not server.isAvailable(product, year, doy):
+            server.stats.add('not_found')
+            self.sendEmpty(404)
+            return
+
+        template = server.template(doy)
+        last_modified = datetime.datetime.fromtimestamp(
+            os.path.getmtime(template), datetime.timezone.utc).strftime(
+            '%Y-%m-%d %H:%M')
+        body = ('name,last_modified,size\n{},{},{}\n'
+                .format(granuleName(product, year, doy), last_modified,
+                        os.path.getsize(template))).encode()
+
+        server.stats.add('listings')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def sendGranule(self, product, year, doy, name, send_body):
+        server = self.server
+        if not server.isAvailable(product, year, doy) or \
+                name != granuleName(product, year, doy):
+            server.stats.add('not_found')
+            self.sendEmpty(404)
+            return
+
+        template = server.template(doy)
+        stat = os.stat(template)
+        etag = '"{}-{:x}"'.format(name, int(stat.st_mtime))
+
+        # continue a partial download, unless If-Range shows the client's
+        # part is of a different version of the file
+        offset = 0
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range') in (None, etag):
+            offset = int(match.group('start'))
+            if offset >= stat.st_size:
+                self.sendEmpty(416, {'Content-Range':
+                                     'bytes */{}'.format(stat.st_size)})
+                return
+
+        self.send_response(206 if offset else 200)
+        self.send_header('Content-Type', 'application/x-hdf5')
+        self.send_header('Content-Length', str(stat.st_size - offset))
+        if offset:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                offset, stat.st_size - 1, stat.st_size))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+        if not send_body:
+            return
+
+        server.stats.add('granules')
+        if offset:
+            server.stats.add('ranges')
+
+        # a cut off transfer sends half of the rest of the file and closes
+        # the connection
+        remaining = stat.st_size - offset
+        if server.injectTruncate():
+            server.stats.add('truncated')
+            remaining //= 2
+            self.close_connection = True
+
+        with open(template, 'rb') as fh:
+            fh.seek(offset)
+            while remaining > 0:
+                chunk = fh.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                start = time.monotonic()
+                self.wfile.write(chunk)
+                server.stats.add('bytes', len(chunk))
+                if server.bandwidth > 0:
+                    wait = (len(chunk) / float(server.bandwidth) -
+                            (time.monotonic() - start))
+                    if wait > 0:
+                        time.sleep(wait)
+
+
+def startServer(templates, host='127.0.0.1', port=0, **settings):
+    """
+    Description: starts the stand-in server in a background thread.
+
+    Args:
+      templates: granule files served for the days
+      host, port: address to listen on, port 0 picks a free port
+      settings: other LaadsServer settings (products, token, latency, ...)
+
+    Returns: LaadsServer, stop it with shutdown()
+    """
+    server = LaadsServer((host, port), templates, **settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main ():
+    logger = logging.getLogger(__name__)
+
+    parser = OptionParser(usage='%prog [options] template.h5 ...')
+    parser.add_option ('--host', dest='host', default='127.0.0.1',
+        help='address to listen on')
+    parser.add_option ('--port', type='int', dest='port', default=8080,
+        help='port to listen on')
+    parser.add_option ('--products', dest='products',
+        default=','.join(DEFAULT_PRODUCTS),
+        help='comma-separated products available for every day')
+    parser.add_option ('--token', dest='token', default=DEFAULT_TOKEN,
+        help='bearer token required by the requests (empty allows any)')
+    parser.add_option ('--latency', type='float', dest='latency',
+        default=0.0, help='seconds added to each request')
+    parser.add_option ('--error_rate', type='float', dest='error_rate',
+        default=0.0, help='fraction of the requests answered with a 503')
+    parser.add_option ('--truncate_rate', type='float',
+        dest='truncate_rate', default=0.0,
+        help='fraction of the granule downloads cut off halfway')
+    parser.add_option ('--bandwidth', type='float', dest='bandwidth',
+        default=0, help='bytes per second per granule download')
+    parser.add_option ('--lag', type='int', dest='lag', default=1,
+        help='days before today which are available (default is 1)')
+
+    (options, args) = parser.parse_args()
+    if len(args) == 0:
+        parser.error('at least one template granule is required')
+
+    server = LaadsServer((options.host, options.port), args,
+                         products=options.products.split(','),
+                         token=options.token or None,
+                         latency=options.latency,
+                         error_rate=options.error_rate,
+                         truncate_rate=options.truncate_rate,
+                         bandwidth=options.bandwidth, lag=options.lag)
+    logger.info('Serving the LAADS archive on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format=('%(asctime)s.%(msecs)03d %(process)d'
+                                ' %(levelname)-8s'
+                                ' %(filename)s:%(lineno)d:'
+                                '%(funcName)s -- %(message)s'),
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO)
+    sys.exit(main())
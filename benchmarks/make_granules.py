@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Generates synthetic daily VIIRS atmosphere (VJ104ANC/VNP04ANC)
+# granules for the benchmarks.  The granules have the HDF-EOS grid layout of
+# the real files (HDFEOS/GRIDS/VIIRS_CMG/Data_Fields) with random ozone and
+# water vapor values and a fraction of fill (0) pixels, so they exercise the
+# same read and accumulate paths as the LAADS files.
+#
+#     make_granules.py -o /tmp/granules -p VJ104ANC -y 2023 --doys 1-31
+############################################################################
+
+import sys
+import os
+import logging
+import numpy
+
+from optparse import OptionParser
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# grid and SDS names of the real granules
+VIIRS_GRID = 'HDFEOS/GRIDS/VIIRS_CMG/Data_Fields'
+OZONE_SDS = 'Coarse_Resolution_Ozone'
+WV_SDS = 'Coarse_Resolution_Water_Vapor'
+
+# size of the VIIRS CMG coarse resolution grid
+CMG_ROWS = 3600
+CMG_COLS = 7200
+
+# fraction of the pixels which are fill
+FILL_FRACTION = 0.2
+
+ERROR = 1
+SUCCESS = 0
+
+
+def granuleName(product, year, doy, collection='002', prodtime=None):
+    """
+    Description: returns the LAADS name of a daily granule.  The production
+    time defaults to noon of the granule's DOY.
+    """
+    if prodtime is None:
+        prodtime = '{:04d}{:03d}120000'.format(year, doy)
+
+    return ('{}.A{:04d}{:03d}.{}.{}.h5'
+            .format(product, year, doy, collection, prodtime))
+
+
+def makeGranule(path, rows=CMG_ROWS, cols=CMG_COLS, seed=None,
+                compression='gzip'):
+    """
+    Description: writes a synthetic VIIRS atmosphere granule.
+
+    Args:
+      path: name of the HDF5 file to write
+      rows, cols: size of the grid
+      seed: random seed, so the same seed gives the same granule
+      compression: HDF5 compression filter of the SDSs (or None)
+
+    Returns: N/A
+    """
+    if h5py is None:
+        raise RuntimeError('h5py is needed to generate synthetic granules')
+
+    rng = numpy.random.default_rng(seed)
+    fill = rng.random((rows, cols)) < FILL_FRACTION
+    ozone = rng.integers(1, 256, (rows, cols), dtype=numpy.uint8)
+    ozone[fill] = 0
+    wv = rng.integers(1, 6000, (rows, cols), dtype=numpy.uint16)
+    wv[fill] = 0
+
+    tmp = '{}.tmp'.format(path)
+    with h5py.File(tmp, 'w') as h5:
+        fields = h5.create_group(VIIRS_GRID)
+        chunks = (min(rows, 512), min(cols, 512))
+        for (sds_name, data) in ((OZONE_SDS, ozone), (WV_SDS, wv)):
+            fields.create_dataset(sds_name, data=data, chunks=chunks,
+                                  compression=compression)
+    os.rename(tmp, path)
+
+
+def parseDoys(doys):
+    """
+    Description: parses a list of DOYs such as "1-31" or "1,5,10-12".
+    """
+    result = set()
+    for item in doys.split(','):
+        if '-' in item:
+            (first, last) = item.split('-', 1)
+            result.update(range(int(first), int(last)+1))
+        else:
+            result.add(int(item))
+
+    return sorted(result)
+
+
+def main ():
+    logger = logging.getLogger(__name__)
+
+    parser = OptionParser()
+    parser.add_option ('-o', '--output_dir', dest='output_dir', default='.',
+        help='directory for the granules')
+    parser.add_option ('-p', '--product', dest='product', default='VJ104ANC',
+        help='product of the granules (default is VJ104ANC)')
+    parser.add_option ('-y', '--year', type='int', dest='year', default=2023,
+        help='year of the granules')
+    parser.add_option ('--doys', dest='doys', default='1',
+        help='DOYs of the granules, e.g. 1-31')
+    parser.add_option ('--rows', type='int', dest='rows', default=CMG_ROWS,
+        help='rows of the grid (default is {})'.format(CMG_ROWS))
+    parser.add_option ('--cols', type='int', dest='cols', default=CMG_COLS,
+        help='columns of the grid (default is {})'.format(CMG_COLS))
+
+    (options, args) = parser.parse_args()
+    if h5py is None:
+        logger.error('h5py is needed to generate synthetic granules')
+        return ERROR
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    for doy in parseDoys(options.doys):
+        name = granuleName(options.product, options.year, doy)
+        makeGranule(os.path.join(options.output_dir, name), options.rows,
+                    options.cols, seed=options.year * 1000 + doy)
+        logger.info('Wrote {}'.format(name))
+
+    return SUCCESS
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format=('%(asctime)s.%(msecs)03d %(process)d'
+                                ' %(levelname)-8s'
+                                ' %(filename)s:%(lineno)d:'
+                                '%(funcName)s -- %(message)s'),
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO)
+    sys.exit(main())
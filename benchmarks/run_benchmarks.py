@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: End-to-end benchmarks of updatelads.py and
+# generate_monthly_climatology.py against the local LAADS stand-in server
+# (laads_server.py) with synthetic granules (make_granules.py).  Each
+# scenario runs the script as it runs in the container, in a scratch
+# LASRC_AUX_DIR, and reports its wall time, download throughput and peak
+# memory (max RSS of the script and its child processes).
+#
+#     run_benchmarks.py --scenarios today,climatology -o results.json
+#     run_benchmarks.py --baseline results.json
+#
+# Scenarios:
+#   today        updatelads.py --today (the nightly update)
+#   quarterly    updatelads.py --quarterly (reconcile and reprocess back to
+#                JPSS1_START_YEAR; run after today to measure a reconcile
+#                with few changes)
+#   climatology  generate_monthly_climatology.py for the 12 months of --year
+#
+# The updatelads.py scenarios run gapfill_viirs_aux, which needs to be on
+# the PATH (it is in the hls-base container).  The synthetic granules only
+# have the ozone and water vapor SDSs; use --template to serve real LAADS
+# granules where the gap-filler needs the full SDS set.
+############################################################################
+
+import sys
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import datetime
+import subprocess
+
+from optparse import OptionParser
+
+from laads_server import startServer, DEFAULT_TOKEN
+from make_granules import makeGranule, CMG_ROWS, CMG_COLS
+
+# the scripts being benchmarked are in the directory above
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ('today', 'quarterly', 'climatology')
+
+# number of distinct synthetic granules served for the days
+TEMPLATE_COUNT = 4
+
+ERROR = 1
+SUCCESS = 0
+
+
+def scenarioCommand(scenario, year):
+    """
+    Description: returns the command line of a scenario.
+    """
+    python = sys.executable
+    if scenario == 'today':
+        return [python, os.path.join(REPO_DIR, 'updatelads.py'), '--today']
+    if scenario == 'quarterly':
+        return [python, os.path.join(REPO_DIR, 'updatelads.py'),
+                '--quarterly']
+    if scenario == 'climatology':
+        return [python, os.path.join(REPO_DIR,
+                                     'generate_monthly_climatology.py'),
+                '-y', str(year), '--months', '1-12']
+    raise ValueError('unknown scenario: {}'.format(scenario))
+
+
+def runScenario(scenario, command, env, server, logdir):
+    """
+    Description: runs a scenario and measures it.
+
+    Args:
+      scenario: name of the scenario
+      command: command line of the scenario
+      env: environment of the scenario
+      server: LaadsServer serving the scenario
+      logdir: directory for the output of the scenario
+
+    Returns: dict of the measurements
+    """
+    logger = logging.getLogger(__name__)
+
+    logname = os.path.join(logdir, '{}.log'.format(scenario))
+    logger.info('Running {}: {}'.format(scenario, ' '.join(command)))
+    before = server.stats.snapshot()
+    start = time.monotonic()
+    with open(logname, 'w') as log:
+        proc = subprocess.Popen(command, env=env, stdout=log,
+                                stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this scenario alone, including
+        # the child processes it waited for (gap-fill, month workers)
+        (pid, status, rusage) = os.wait4(proc.pid, 0)
+        # the status as Popen.returncode reports it (negative signal number
+        # if the scenario was killed)
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+    wall = time.monotonic() - start
+    after = server.stats.snapshot()
+
+    served = dict((key, after[key] - before[key]) for key in after)
+    mbytes = served['bytes'] / 1e6
+    result = {
+        'returncode': proc.returncode,
+        'wall_s': round(wall, 3),
+        'peak_rss_mb': round(rusage.ru_maxrss / 1024.0, 1),
+        'user_s': round(rusage.ru_utime, 3),
+        'system_s': round(rusage.ru_stime, 3),
+        'granules': served['granules'],
+        'listings': served['listings'],
+        'requests': served['requests'],
+        'injected_errors': served['injected_errors'],
+        'truncated': served['truncated'],
+        'resumed': served['ranges'],
+        'downloaded_mb': round(mbytes, 1),
+        'mb_per_s': round(mbytes / wall, 2) if wall > 0 else 0.0,
+        'granules_per_s': round(served['granules'] / wall, 2)
+                          if wall > 0 else 0.0,
+        'log': logname,
+    }
+    if proc.returncode != 0:
+        logger.error('{} failed ({}), see {}'
+                     .format(scenario, proc.returncode, logname))
+
+    return result
+
+
+def printResults(results, baseline=None):
+    """
+    Description: prints a table of the results, with the change in wall time
+    against the baseline results if there are any.
+    """
+    header = ('{:<12} {:>6} {:>10} {:>10} {:>9} {:>9} {:>10}'
+              .format('scenario', 'status', 'wall_s', 'peak_mb', 'granules',
+                      'mb/s', 'vs_base'))
+    print(header)
+    print('-' * len(header))
+    for (scenario, result) in results.items():
+        change = ''
+        if baseline and scenario in baseline and \
+                baseline[scenario]['wall_s'] > 0:
+            base = baseline[scenario]
+            change = '{:+.1f}%'.format(
+                100.0 * (result['wall_s'] - base['wall_s']) / base['wall_s'])
+        print('{:<12} {:>6} {:>10.2f} {:>10.1f} {:>9} {:>9.2f} {:>10}'
+              .format(scenario, 'ok' if result['returncode'] == 0 else 'FAIL',
+                      result['wall_s'], result['peak_rss_mb'],
+                      result['granules'], result['mb_per_s'], change))
+
+
+def main ():
+    logger = logging.getLogger(__name__)
+
+    last_year = datetime.date.today().year - 1
+    parser = OptionParser()
+    parser.add_option ('--scenarios', dest='scenarios',
+        default='today,climatology',
+        help='comma-separated scenarios to run: {} (default is '
+             'today,climatology)'.format(', '.join(SCENARIOS)))
+    parser.add_option ('-y', '--year', type='int', dest='year',
+        default=last_year,
+        help='year of the climatology scenario (default is {})'
+             .format(last_year))
+    parser.add_option ('--rows', type='int', dest='rows', default=CMG_ROWS,
+        help='rows of the synthetic grid (default is {})'.format(CMG_ROWS))
+    parser.add_option ('--cols', type='int', dest='cols', default=CMG_COLS,
+        help='columns of the synthetic grid (default is {})'
+             .format(CMG_COLS))
+    parser.add_option ('--template', dest='templates', action='append',
+        default=[], help='serve this granule instead of synthetic ones '
+                         '(may be repeated)')
+    parser.add_option ('--latency', type='float', dest='latency',
+        default=0.0, help='seconds added to each request')
+    parser.add_option ('--error_rate', type='float', dest='error_rate',
+        default=0.0, help='fraction of the requests answered with a 503')
+    parser.add_option ('--truncate_rate', type='float',
+        dest='truncate_rate', default=0.0,
+        help='fraction of the granule downloads cut off halfway')
+    parser.add_option ('--bandwidth', type='float', dest='bandwidth',
+        default=0, help='bytes per second per granule download')
+    parser.add_option ('--cache', dest='cache', default=False,
+        action='store_true',
+        help='use the LAADS granule cache (disabled by default so the '
+             'downloads are measured)')
+    parser.add_option ('--workdir', dest='workdir', default=None,
+        help='scratch directory (default is a new temporary directory, '
+             'removed afterwards)')
+    parser.add_option ('-o', '--output', dest='output', default=None,
+        help='write the results to this JSON file')
+    parser.add_option ('--baseline', dest='baseline', default=None,
+        help='JSON results of an earlier run to compare against')
+
+    (options, args) = parser.parse_args()
+    scenarios = options.scenarios.split(',')
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: {}'.format(scenario))
+
+    baseline = None
+    if options.baseline is not None:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)['results']
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix='laads_bench_')
+    auxdir = os.path.join(workdir, 'lasrc_aux')
+    logdir = os.path.join(workdir, 'logs')
+    os.makedirs(auxdir, exist_ok=True)
+    os.makedirs(logdir, exist_ok=True)
+
+    templates = list(options.templates)
+    if not templates:
+        logger.info('Generating {} synthetic {}x{} granules'
+                    .format(TEMPLATE_COUNT, options.rows, options.cols))
+        for i in range(TEMPLATE_COUNT):
+            template = os.path.join(workdir, 'template_{}.h5'.format(i))
+            makeGranule(template, options.rows, options.cols, seed=i)
+            templates.append(template)
+
+    server = startServer(templates, latency=options.latency,
+                         error_rate=options.error_rate,
+                         truncate_rate=options.truncate_rate,
+                         bandwidth=options.bandwidth)
+    logger.info('LAADS stand-in server on {}'.format(server.url))
+
+    env = dict(os.environ)
+    env.update({
+        'LASRC_AUX_DIR': auxdir,
+        'LAADS_SERVER_URL': server.url,
+        'LAADS_TOKEN': DEFAULT_TOKEN,
+        'LAADS_MANIFEST': os.path.join(auxdir, 'laads_manifest.db'),
+        'LAADS_CACHE_DIR': os.path.join(workdir, 'cache'),
+        'LAADS_PUBLISH_DIR': os.path.join(workdir, 'publish'),
+        'LAADS_CACHE_SIZE': env.get('LAADS_CACHE_SIZE', str(10 * 1024**3))
+                            if options.cache else '0',
+    })
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            results[scenario] = runScenario(
+                scenario, scenarioCommand(scenario, options.year), env,
+                server, logdir)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    printResults(results, baseline)
+    if options.output is not None:
+        report = {
+            'date': datetime.datetime.now().isoformat(),
+            'settings': {
+                'rows': options.rows, 'cols': options.cols,
+                'templates': options.templates or 'synthetic',
+                'latency': options.latency,
+                'error_rate': options.error_rate,
+                'truncate_rate': options.truncate_rate,
+                'bandwidth': options.bandwidth, 'cache': options.cache,
+                'year': options.year,
+            },
+            'results': results,
+        }
+        with open(options.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        logger.info('Wrote {}'.format(options.output))
+
+    # keep the scratch directory (and the logs) if a scenario failed
+    failed = [s for s in results if results[s]['returncode'] != 0]
+    if options.workdir is None and not failed:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return ERROR if failed else SUCCESS
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format=('%(asctime)s.%(msecs)03d %(process)d'
+                                ' %(levelname)-8s'
+                                ' %(filename)s:%(lineno)d:'
+                                '%(funcName)s -- %(message)s'),
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO)
+    sys.exit(main())
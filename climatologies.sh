@@ -4,25 +4,63 @@ lasrc_directory="$LASRC_AUX_DIR"
 year="$CLIM_YEAR"
 month="$CLIM_MONTH"
 
+incremental=""
+if [ -n "$CLIM_INCREMENTAL" ]; then
+  incremental="--incremental"
+fi
+
+formats="${CLIM_FORMATS:-envi}"
+
 echo "Checking mount status"
 mount | grep -q "$lasrc_directory" || exit 1
 cd "$lasrc_directory" || exit 1
 
 echo "Aux directory is $LASRC_AUX_DIR"
 
+# cache of raw LAADS granules shared by the updatelads and climatology jobs.
+# it is set in the job definition (production uses $LASRC_AUX_DIR/laads_cache
+# on EFS); without LAADS_CACHE_DIR every granule is downloaded from LAADS.
+if [ -n "$LAADS_CACHE_DIR" ]; then
+  echo "LAADS granule cache is $LAADS_CACHE_DIR (budget ${LAADS_CACHE_SIZE:-10737418240} bytes)"
+else
+  echo "LAADS granule cache is disabled (LAADS_CACHE_DIR is not set)"
+fi
+
+# publish lists of the files written by the runs, kept on EFS so a list
+# left by a failed run or upload is published by the next run
+publish_directory="${LAADS_PUBLISH_DIR:-$LASRC_AUX_DIR/.publish}"
+
+status=0
 if [ -z "$CLIM_MONTH" ]; then
-  for i in 1 2 3 4 5 6 7 8 9 10 11 12
-  do
-    echo "running generate_monthly_climatology.py for $year month $i"
-    generate_monthly_climatology.py -y "$year" -m "$i"
-  done
+  echo "running generate_monthly_climatology.py for $year months 1-12"
+  generate_monthly_climatology.py -y "$year" --months 1-12 --formats "$formats" $incremental || status=1
 else
   echo "running generate_monthly_climatology.py for $year and month $month"
-  generate_monthly_climatology.py -y "$year" -m "$month"
+  generate_monthly_climatology.py -y "$year" -m "$month" --formats "$formats" $incremental || status=1
+fi
+if [ $status -ne 0 ]; then
+  echo "generate_monthly_climatology.py failed"
 fi
 
 
+# the months a failed run did write are complete, so they are uploaded too
+# (then the job still fails)
 if [ -n "$LAADS_BUCKET" ]; then
-  echo "Syncing data to s3 bucket s3://$LAADS_BUCKET/lasrc_aux/monthly_avgs/" 
-  aws s3 sync "$LASRC_AUX_DIR/monthly_avgs/" "s3://$LAADS_BUCKET/lasrc_aux/monthly_avgs/"
+  # upload only the files listed by this run and any earlier runs whose
+  # upload failed, unless a full sync is requested
+  publish_lists=$(ls "$publish_directory"/climatology*.txt 2>/dev/null)
+  if [ -z "$LAADS_FULL_SYNC" ] && [ -n "$publish_lists" ]; then
+    echo "Publishing the files in" $publish_lists "to s3://$LAADS_BUCKET/lasrc_aux/"
+    laads_publish.py --bucket "$LAADS_BUCKET" --prefix lasrc_aux $publish_lists || exit 1
+  else
+    echo "Syncing data to s3 bucket s3://$LAADS_BUCKET/lasrc_aux/monthly_avgs/"
+    aws s3 sync "$LASRC_AUX_DIR/monthly_avgs/" "s3://$LAADS_BUCKET/lasrc_aux/monthly_avgs/" --exclude "*monthly_sums_*" || exit 1
+  fi
+  metrics_directory="${LAADS_METRICS_DIR:-$LASRC_AUX_DIR/metrics}"
+  if [ -d "$metrics_directory" ]; then
+    echo "Syncing run metrics to s3://$LAADS_BUCKET/lasrc_aux/metrics/"
+    aws s3 sync "$metrics_directory" "s3://$LAADS_BUCKET/lasrc_aux/metrics/"
+  fi
 fi
+
+exit $status
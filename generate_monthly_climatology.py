@@ -3,15 +3,19 @@
 import sys      # system commands
 import os       # misc commands
 import shutil   # file copy/move/delete operations
+import tempfile # scratch files
 import time     # for date/time conversions
 import argparse # for command line aruguments
 import logging  # for message logging
-import glob     # list and manipulate filenames
 import numpy
-import fnmatch
 import datetime
 import calendar
-from download_lads import downloadLads
+import concurrent.futures
+from laads_client import downloadLads, listLads, isResumable, RETRY_POLICY
+from laads_index import GranuleIndex
+from laads_cache import getCache
+from laads_metrics import METRICS, getMetricsDir
+from laads_publish import PUBLISHED
 from config_utils import retrieve_cfg
 from api_interface import api_connect
 
@@ -22,6 +26,13 @@ from osgeo import osr
 from osgeo import gdal_array
 from osgeo import gdalconst
 
+# h5py is optional.  if it's available each daily file is opened once to read
+# all the SDSs, otherwise GDAL opens each SDS separately.
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
 ##NOTE: For non-ESPA environments, the TOKEN needs to be defined.  This is
 ##the application token that is required for accessing the LAADS data
 ##https://ladsweb.modaps.eosdis.nasa.gov/tools-and-services/data-download-scripts/
@@ -35,6 +46,15 @@ ldayEOM = [31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335, 366]
 rdaySOM = [ 1, 32, 60,  91, 121, 152, 182, 213, 244, 274, 305, 335]
 rdayEOM = [31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365]
 
+# VIIRS atmosphere products in priority order (JPSS2, JPSS1, then NPP)
+VIIRS_PRODUCTS = ('VJ204ANC', 'VJ104ANC', 'VNP04ANC')
+
+# location and names of the VIIRS auxiliary SDSs used for the climatology
+VIIRS_GRID = 'HDFEOS/GRIDS/VIIRS_CMG/Data_Fields'
+OZONE_SDS = 'Coarse_Resolution_Ozone'
+WV_SDS = 'Coarse_Resolution_Water_Vapor'
+AUX_SDS = (OZONE_SDS, WV_SDS)
+
 # ignore divide by zero temporarily
 numpy.seterr(divide='ignore')
 numpy.seterr(invalid='ignore')
@@ -42,6 +62,25 @@ numpy.seterr(invalid='ignore')
 # error object used for handling fatal errors
 ERROR = 1
 SUCCESS = 0
+REBUILD = 2
+
+# download directory for the daily LAADS files of a year.  all the months of
+# the year processed in a run share it.
+DOWNLOAD_DIR = '/tmp/lads_monthly/{}'
+
+# output formats of the monthly averages and their file extensions.  ENVI is
+# what the LaSRC gap-filler reads, COG is a tiled, compressed GeoTIFF which
+# can be read by window (e.g. straight from S3).
+OUTPUT_FORMATS = {'envi': '.img', 'cog': '.tif'}
+DEFAULT_FORMATS = ('envi',)
+
+# COG creation options.  the compression codec and internal tile size can be
+# overridden in the environment.
+COG_OPTIONS = ['COMPRESS={}'.format(os.environ.get('CLIM_COG_COMPRESS',
+                                                   'DEFLATE')),
+               'BLOCKSIZE={}'.format(os.environ.get('CLIM_COG_BLOCKSIZE',
+                                                    '512')),
+               'PREDICTOR=YES', 'OVERVIEWS=NONE', 'BIGTIFF=IF_SAFER']
 
 # set the per-file cache in MB
 gdal.SetConfigOption('GDAL_CACHEMAX', '256')
@@ -64,7 +103,35 @@ def writeResultsEnvi(auxData, outputFilename, imageType=gdal.GDT_Byte,
 
     Returns: N/A
     """
-    # if the monthly average file already exists, remove it
+    # write a temporary file which replaces the output once it's complete
+    aux_dataset = createResultsEnvi(getTmpName(outputFilename),
+                                    auxData.shape[1], auxData.shape[0],
+                                    imageType, bandDesc)
+
+    # get the output band
+    aux_band = aux_dataset.GetRasterBand(1)
+    aux_band.WriteArray(auxData)
+
+    aux_band = None
+    aux_dataset = None
+    replaceOutput(outputFilename)
+
+
+def createResultsEnvi(outputFilename, xsize, ysize, imageType=gdal.GDT_Byte,
+    bandDesc="Monthly Avgs"):
+    """
+    Description: create an empty output ENVI file, to be written whole or by
+    blocks of rows
+
+    Args:
+      outputFilename: filename of the ENVI file
+      xsize, ysize: columns and rows of the band
+      imageType: data type of the output band
+      bandDesc: description for the band names in the ENVI header file
+
+    Returns: GDAL dataset of the ENVI file
+    """
+    # if the file already exists (e.g. left by a run which failed), remove it
     if os.path.isfile(outputFilename):
         os.remove(outputFilename)
 
@@ -72,33 +139,237 @@ def writeResultsEnvi(auxData, outputFilename, imageType=gdal.GDT_Byte,
     driver = gdal.GetDriverByName('ENVI')
 
     # create the output dataset
-    aux_dataset = driver.Create(outputFilename, xsize=auxData.shape[1],
-                  ysize=auxData.shape[0], bands=1, eType=imageType)
+    aux_dataset = driver.Create(outputFilename, xsize=xsize, ysize=ysize,
+                                bands=1, eType=imageType)
 
-    # get the output band
+    # set up the output band
     aux_band = aux_dataset.GetRasterBand(1)
     aux_band.SetNoDataValue(0)
     aux_band.SetDescription(bandDesc)
-    aux_band.WriteArray(auxData)
+    aux_band = None
 
+    return aux_dataset
+
+
+def writeResultsCog(auxData, outputFilename, imageType=gdal.GDT_Byte,
+    bandDesc="Monthly Avgs"):
+    """
+    Description: write the output data to a Cloud-Optimized GeoTIFF, tiled
+    and compressed with COG_OPTIONS
+
+    Args:
+      auxData: array of data to write
+      outputFilename: filename for writing the auxData (COG)
+      imageType: data type of the output band
+      bandDesc: description for the output band
+
+    Returns: N/A
+    """
+    # the COG driver only supports CreateCopy, so the band is built in memory
+    # and then copied out
+    driver = gdal.GetDriverByName('MEM')
+    aux_dataset = driver.Create('', xsize=auxData.shape[1],
+                  ysize=auxData.shape[0], bands=1, eType=imageType)
+    aux_band = aux_dataset.GetRasterBand(1)
+    aux_band.SetNoDataValue(0)
+    aux_band.SetDescription(bandDesc)
+    aux_band.WriteArray(auxData)
     aux_band = None
+
+    copyToCog(aux_dataset, outputFilename)
     aux_dataset = None
 
 
-def addFiletoAvg(auxfile, init_totals, aux_total, aux_sum):
+def copyToCog(aux_dataset, outputFilename):
+    """
+    Description: copy a GDAL dataset to a Cloud-Optimized GeoTIFF.  The COG
+    is written to a temporary file which replaces the output once it's
+    complete.
+
+    Args:
+      aux_dataset: GDAL dataset to copy
+      outputFilename: filename of the COG
+
+    Returns: N/A
+    """
+    tmp_name = getTmpName(outputFilename)
+    if os.path.isfile(tmp_name):
+        os.remove(tmp_name)
+
+    driver = gdal.GetDriverByName('COG')
+    cog_dataset = driver.CreateCopy(tmp_name, aux_dataset,
+                                    options=COG_OPTIONS)
+    cog_dataset = None
+    replaceOutput(outputFilename)
+
+
+def getTmpName(outputFilename):
+    """
+    Description: returns the temporary name an output file is written to
+    (e.g. monthly_avg_oz_2023_01.tmp.img), so the existing output is only
+    replaced once the new one is complete.
+    """
+    (base, ext) = os.path.splitext(outputFilename)
+    return '{}.tmp{}'.format(base, ext)
+
+
+def replaceOutput(outputFilename):
+    """
+    Description: replaces an output file, and the header of an ENVI file,
+    with the complete temporary file written by getTmpName.
+    """
+    tmp_name = getTmpName(outputFilename)
+    if outputFilename.endswith(OUTPUT_FORMATS['envi']):
+        os.replace('{}.hdr'.format(os.path.splitext(tmp_name)[0]),
+                   '{}.hdr'.format(os.path.splitext(outputFilename)[0]))
+    os.replace(tmp_name, outputFilename)
+
+
+def recordOutput(outputFilename):
+    """
+    Description: records an output file, and the header of an ENVI file, in
+    the list of files to publish
+    """
+    PUBLISHED.record(outputFilename)
+    if outputFilename.endswith(OUTPUT_FORMATS['envi']):
+        PUBLISHED.record('{}.hdr'.format(os.path.splitext(outputFilename)[0]))
+
+
+# writers of the monthly averages for each output format
+OUTPUT_WRITERS = {'envi': writeResultsEnvi, 'cog': writeResultsCog}
+
+
+def writeResults(auxData, outputBase, imageType=gdal.GDT_Byte,
+    bandDesc="Monthly Avgs", formats=DEFAULT_FORMATS):
+    """
+    Description: write the output data in each of the output formats
+
+    Args:
+      auxData: array of data to write
+      outputBase: output filename without the extension, which is added
+                  for each format (OUTPUT_FORMATS)
+      imageType: data type of the output band
+      bandDesc: description for the output band
+      formats: output formats (keys of OUTPUT_WRITERS)
+
+    Returns: N/A
+    """
+    for fmt in formats:
+        outname = '{}{}'.format(outputBase, OUTPUT_FORMATS[fmt])
+        with METRICS.timer('write_{}'.format(fmt)):
+            OUTPUT_WRITERS[fmt](auxData, outname, imageType, bandDesc)
+        recordOutput(outname)
+
+
+class SdsAccumulator(object):
+    """
+    Description: running per-pixel total and good pixel count for one SDS
+    over the days of a month.  The totals (uint64) and counts (uint8) are
+    allocated once, when the first daily grid is added, and are then updated
+    in place so no full-grid temporaries are created per day.
     """
-    Description: addFiletoAvg will add the current auxiliary file/SDS to the
-    specific SDS monthly average.
+    def __init__(self):
+        self.total = None       # running total for the SDS (uint64)
+        self.count = None       # good pixel count for the SDS (uint8)
+        self.nfiles = 0         # number of daily grids added
+        self._mask = None       # scratch buffer for the good pixel mask
+
+    def add(self, aux_image):
+        """
+        Description: adds a daily grid to the totals.  Fill values are zero,
+        so they don't change the total and aren't counted.
+
+        Args:
+          aux_image: 2D array of the SDS for one day
+        """
+        # if this is the first grid, then we need to initialize the totals
+        if self.total is None:
+            self.total = numpy.zeros(aux_image.shape, dtype=numpy.uint64)
+            self.count = numpy.zeros(aux_image.shape, dtype=numpy.uint8)
+            self._mask = numpy.empty(aux_image.shape, dtype=numpy.bool_)
+
+        # add the current band to the total
+        numpy.add(self.total, aux_image, out=self.total, casting='unsafe')
+
+        # add one to the good pixel count for any pixel that is not fill
+        numpy.greater(aux_image, 0, out=self._mask)
+        numpy.add(self.count, 1, out=self.count, where=self._mask)
+        self.nfiles += 1
+
+    def remove(self, aux_image):
+        """
+        Description: removes a daily grid which was previously added, e.g.
+        when the granule for that day has been replaced on LAADS.
+
+        Args:
+          aux_image: 2D array of the SDS for one day, as it was added
+        """
+        numpy.subtract(self.total, aux_image, out=self.total,
+                       casting='unsafe')
+        numpy.greater(aux_image, 0, out=self._mask)
+        numpy.subtract(self.count, 1, out=self.count, where=self._mask)
+        self.nfiles -= 1
+
+    def setTotals(self, total, count, nfiles):
+        """
+        Description: restores totals and counts which were saved earlier.
+        """
+        self.total = total.astype(numpy.uint64, copy=False)
+        self.count = count.astype(numpy.uint8, copy=False)
+        self._mask = numpy.empty(total.shape, dtype=numpy.bool_)
+        self.nfiles = nfiles
+
+    def merge(self, other):
+        """
+        Description: adds the totals and counts of another accumulator, e.g.
+        the same month of another year.  The counts are widened to uint32,
+        since the good pixel counts of several months overflow uint8.
+
+        Args:
+          other: SdsAccumulator for the same grid
+        """
+        if self.total is None:
+            self.total = numpy.zeros(other.total.shape, dtype=numpy.uint64)
+            self.count = numpy.zeros(other.count.shape, dtype=numpy.uint32)
+            self._mask = numpy.empty(other.total.shape, dtype=numpy.bool_)
+        elif self.count.dtype != numpy.uint32:
+            self.count = self.count.astype(numpy.uint32)
+
+        numpy.add(self.total, other.total, out=self.total)
+        numpy.add(self.count, other.count, out=self.count, casting='unsafe')
+        self.nfiles += other.nfiles
+
+    def addAll(self, aux_images):
+        """
+        Description: adds each of the daily grids produced by an iterable
+        (e.g. a generator reading one day at a time).
+        """
+        for aux_image in aux_images:
+            self.add(aux_image)
+
+    def average(self):
+        """
+        Description: returns the average of the added grids, with zero where
+        there were no good pixels.
+        """
+        avg = numpy.zeros(self.total.shape, dtype=numpy.float64)
+        numpy.divide(self.total, self.count, out=avg, where=self.count > 0)
+        return avg
+
+
+def readSds(auxfile, window=None):
+    """
+    Description: readSds reads the first band of an auxiliary file or SDS
+    using GDAL.
 
     Args:
-      auxfile: name of the auxiliary file or SDS to open and add to the
-               auxiliary totals
-      init_totals: boolean to specify if the auxiliary totals need initialized
-      aux_total: running total for the auxiliary data (uint64)
+      auxfile: name of the auxiliary file or SDS to read
+      window: (first row, number of rows) to read, or None for the whole
+              band
 
     Returns:
-        False: error occurred while processing
-        True: processing completed successfully
+        None: error occurred while reading
+        2D array of the band
     """
 
     # initialize the logger and error objects
@@ -108,109 +379,296 @@ def addFiletoAvg(auxfile, init_totals, aux_total, aux_sum):
     aux_dataset = gdal.Open(auxfile)
     if aux_dataset is None:
         logger.error('Failed to open auxiliary file: {}'.format(auxfile))
-        return False
+        return None
 
     # get the band from the file
     aux_band = aux_dataset.GetRasterBand(1)
     if aux_band is None:
         logger.error('Failed to open the band from {}'.format(auxfile))
-        return False
+        return None
 
     # read the auxiliary data
-    aux_image = aux_band.ReadAsArray()
+    if window is None:
+        aux_image = aux_band.ReadAsArray()
+    else:
+        (row, nrows) = window
+        nrows = min(nrows, aux_band.YSize - row)
+        aux_image = aux_band.ReadAsArray(0, row, aux_band.XSize, nrows)
 
     # close the input bands and dataset
     aux_band = None
     aux_dataset = None
 
-    # if this is the first file in the averages, then we need to initialize
-    # the totals
-    if init_totals == True:
-        init_totals = False
+    return aux_image
 
-        # array to hold the auxiliary totals for this dataset
-        aux_total = numpy.zeros_like(aux_image, dtype=numpy.uint64)
 
-        # array to hold the auxiliary good pixel count for this dataset
-        aux_sum = numpy.zeros_like(aux_image, dtype=numpy.uint8)
+def readViirsAux(viirs_file, sds_names=AUX_SDS, window=None):
+    """
+    Description: readViirsAux reads the specified SDSs from a daily VIIRS
+    *4ANC file.  With h5py the file is opened and its metadata parsed once
+    for all the SDSs; otherwise each SDS is read through GDAL.
 
-    # add the current band to the total. fill values are already zero so no
-    # special handling is needed.
-    aux_total = aux_total + aux_image
+    Args:
+      viirs_file: name of the VIIRS auxiliary file
+      sds_names: names of the SDSs in the VIIRS_CMG Data_Fields group
+      window: (first row, number of rows) to read, or None for the whole
+              grid
 
-    # add one to the good pixel count for any pixel that is not fill
-    aux_sum = numpy.where(aux_image > 0, aux_sum+1, aux_sum)
+    Returns:
+        None: error occurred while reading
+        dict of SDS name to 2D array
+    """
 
-    # free the image data
-    aux_image = None
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
 
-    return True, init_totals, aux_total, aux_sum
+    aux_images = {}
+    start = time.monotonic()
+    if h5py is not None:
+        try:
+            with h5py.File(viirs_file, 'r') as h5:
+                fields = h5[VIIRS_GRID]
+                for sds_name in sds_names:
+                    if window is None:
+                        aux_images[sds_name] = fields[sds_name][()]
+                    else:
+                        (row, nrows) = window
+                        aux_images[sds_name] = \
+                            fields[sds_name][row:row+nrows]
+        except (IOError, OSError, KeyError) as e:
+            logger.error('Failed to read {} from {}: {}'
+                         .format(', '.join(sds_names), viirs_file, e))
+            return None
 
+    else:
+        for sds_name in sds_names:
+            sds = ('HDF5:\"{}\"://{}/{}'
+                   .format(viirs_file, VIIRS_GRID, sds_name))
+            aux_image = readSds(sds, window)
+            if aux_image is None:
+                return None
+            aux_images[sds_name] = aux_image
 
-def downloadFiles(dloaddir, year, start_doy, end_doy, token):
+    METRICS.observe('read', time.monotonic() - start)
+    METRICS.count('files_read')
+    return aux_images
+
+
+def getViirsAuxShape(viirs_file):
     """
-    Description: Download the VIIRS products for the specified year and DOY
-    range. Download them to the specified download directory.
+    Description: getViirsAuxShape returns the (rows, columns) of the ozone
+    SDS of a daily VIIRS *4ANC file without reading the data.
 
     Args:
-      dloaddir: directory to download the VIIRS products
-      year: year of the VIIRS product
-      start_doy - end_doy: inclusive day of year date range for the year
-      token: application token for the desired website
+      viirs_file: name of the VIIRS auxiliary file
 
     Returns:
-        ERROR: error occurred while processing
-        SUCCESS: processing completed successfully
+        None: error occurred while reading
+        (rows, columns)
+    """
+
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    if h5py is not None:
+        try:
+            with h5py.File(viirs_file, 'r') as h5:
+                return h5[VIIRS_GRID][OZONE_SDS].shape
+        except (IOError, OSError, KeyError) as e:
+            logger.error('Failed to read {} from {}: {}'
+                         .format(OZONE_SDS, viirs_file, e))
+            return None
+
+    sds = 'HDF5:\"{}\"://{}/{}'.format(viirs_file, VIIRS_GRID, OZONE_SDS)
+    aux_dataset = gdal.Open(sds)
+    if aux_dataset is None:
+        logger.error('Failed to open auxiliary file: {}'.format(sds))
+        return None
+
+    shape = (aux_dataset.RasterYSize, aux_dataset.RasterXSize)
+    aux_dataset = None
+    return shape
+
+
+class MonthlySums(object):
+    """
+    Description: the ozone and water vapor totals and counts for a month,
+    along with the granule which was added for each DOY.  These are saved
+    next to the monthly averages so the month can be updated one day at a
+    time instead of being rebuilt from every daily granule.
+    """
+    def __init__(self):
+        self.oz = SdsAccumulator()
+        self.wv = SdsAccumulator()
+        self.granules = {}      # DOY -> granule name
+
+    def getAccumulator(self, sds_name):
+        """
+        Description: returns the SdsAccumulator of an SDS (OZONE_SDS or
+        WV_SDS).
+        """
+        return {OZONE_SDS: self.oz, WV_SDS: self.wv}[sds_name]
+
+    def addGranule(self, doy, name, aux_images):
+        """
+        Description: adds the SDSs of a daily granule to the totals.
+
+        Args:
+          doy: day of year of the granule
+          name: granule name
+          aux_images: dict of SDS name to 2D array from readViirsAux
+        """
+        with METRICS.timer('accumulate'):
+            self.oz.add(aux_images[OZONE_SDS])
+            self.wv.add(aux_images[WV_SDS])
+        self.granules[doy] = name
+
+    def removeGranule(self, doy, aux_images):
+        """
+        Description: removes the SDSs of a daily granule from the totals.
+
+        Args:
+          doy: day of year of the granule
+          aux_images: dict of SDS name to 2D array from readViirsAux
+        """
+        self.oz.remove(aux_images[OZONE_SDS])
+        self.wv.remove(aux_images[WV_SDS])
+        del self.granules[doy]
+
+    def save(self, path):
+        """
+        Description: saves the totals, counts and granules (compressed
+        .npz).  A month's totals fit in uint32 (31 days of uint16 water
+        vapor) and its counts in uint8, so they are saved at those sizes
+        and widened again by load().  The file is written to a temporary
+        name and renamed so a failed run never leaves a partial file behind.
+        """
+        doys = sorted(self.granules)
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as fh:
+            numpy.savez_compressed(
+                fh, oz_total=self.oz.total.astype(numpy.uint32),
+                oz_count=self.oz.count.astype(numpy.uint8, copy=False),
+                wv_total=self.wv.total.astype(numpy.uint32),
+                wv_count=self.wv.count.astype(numpy.uint8, copy=False),
+                doys=numpy.array(doys, dtype=numpy.int32),
+                names=numpy.array([self.granules[d] for d in doys],
+                                  dtype=numpy.str_))
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """
+        Description: loads the sums saved by save().
+
+        Returns:
+            None: the file doesn't exist or can't be read
+            MonthlySums
+        """
+        logger = logging.getLogger(__name__)
+
+        if not os.path.exists(path):
+            return None
+
+        sums = MonthlySums()
+        try:
+            with numpy.load(path, allow_pickle=False) as data:
+                nfiles = len(data['doys'])
+                sums.oz.setTotals(data['oz_total'], data['oz_count'], nfiles)
+                sums.wv.setTotals(data['wv_total'], data['wv_count'], nfiles)
+                sums.granules = dict(zip(data['doys'].tolist(),
+                                         data['names'].tolist()))
+        except (IOError, OSError, KeyError, ValueError) as e:
+            logger.warning('Unable to read the monthly sums {}: {}'
+                           .format(path, e))
+            return None
+
+        return sums
+
+
+def cleanDownloadDir(dloaddir):
+    """
+    Description: makes sure the download directory exists (and is cleaned
+    up) or creates it recursively.
+
+    Args:
+      dloaddir: directory to download the VIIRS products
+
+    Returns: N/A
     """
 
     # initialize the logger and error objects
     logger = logging.getLogger(__name__)
 
-    # make sure the download directory exists (and is cleaned up) or create
-    # it recursively
     if not os.path.exists(dloaddir):
         msg = '{} does not exist... creating'.format(dloaddir)
         logger.info(msg)
         os.makedirs(dloaddir, 0o777)
     else:
         # directory already exists and possibly has files in it.  any old
-        # files need to be cleaned up
+        # files need to be cleaned up, except partial downloads which this
+        # run can resume
         msg = 'Cleaning download directory: {}'.format(dloaddir)
         logger.info(msg)
         for myfile in os.listdir(dloaddir):
             name = os.path.join(dloaddir, myfile)
-            if os.path.isfile(name):
+            if os.path.isfile(name) and not isResumable(name):
                 os.remove(name)
 
+
+def downloadFiles(dloaddir, year, start_doy, end_doy, token):
+    """
+    Description: Download the VIIRS products for the specified year and DOY
+    range. Download them to the specified download directory.
+
+    Args:
+      dloaddir: directory to download the VIIRS products
+      year: year of the VIIRS product
+      start_doy - end_doy: inclusive day of year date range for the year
+      token: application token for the desired website
+
+    Returns:
+        (ERROR, None): error occurred while processing
+        (SUCCESS, index): processing completed successfully. index is the
+            GranuleIndex of the downloaded files.
+    """
+
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    # make sure the download directory exists or create it recursively.  it
+    # is cleaned up by cleanDownloadDir at the start of the run.
+    if not os.path.exists(dloaddir):
+        msg = '{} does not exist... creating'.format(dloaddir)
+        logger.info(msg)
+        os.makedirs(dloaddir, 0o777, exist_ok=True)
+
+    # index of the downloaded files, updated as each day is downloaded
+    index = GranuleIndex(dloaddir)
+
     # loop through each day in the year and download the LAADS data
     for doy in range(start_doy, end_doy+1):
-        # get the year + DOY string
-        datestr = '{}{:03d}'.format(year, doy)
-
         # download the daily LAADS files for the specified year and DOY. The
         # JPSS2 file is the priority, but if that isn't found then check for
         # JPSS1 followed by NPP to be downloaded.
         found_vjx04anc = False
         found_vnp04anc = False
-        status = downloadLads (year, doy, dloaddir, token)
+        with METRICS.timer('download'):
+            status = downloadLads (year, doy, dloaddir, token,
+                                   VIIRS_PRODUCTS, index, cache=getCache(),
+                                   cache_link=True)
         if status == ERROR:
             # warning message already printed
-            return ERROR
+            return (ERROR, None)
 
         # get the JPSS[1|2] file for the current DOY (should only be one)
-        fileList = []    # create empty list to store files matching date
-        for myfile in os.listdir(dloaddir):
-            if fnmatch.fnmatch (myfile, 'VJ?04ANC.A{}*.h5'.format(datestr)):
-                fileList.append (myfile)
+        fileList = index.find(('VJ104ANC', 'VJ204ANC'), year, doy)
 
         # make sure files were found or search for the NPP file
         nfiles = len(fileList)
         if nfiles == 0:
             # get the NPP file for the current DOY (should only be one)
-            for myfile in os.listdir(dloaddir):
-                if fnmatch.fnmatch (myfile, 'VNP04ANC.A{}*.h5'
-                                    .format(datestr)):
-                    fileList.append (myfile)
+            fileList = index.find('VNP04ANC', year, doy)
 
             # make sure files were found
             nfiles = len(fileList)
@@ -225,7 +683,7 @@ def downloadFiles(dloaddir, year, start_doy, end_doy, token):
                     msg = ('Multiple LAADS VNP04ANC files found for doy {} '
                            'year {}'.format(doy, year))
                     logger.error(msg)
-                    return ERROR
+                    return (ERROR, None)
 
         else:
             # if only one file was found which matched our date, then that's
@@ -238,7 +696,7 @@ def downloadFiles(dloaddir, year, start_doy, end_doy, token):
                 msg = ('Multiple LAADS VJX04ANC files found for doy {} year {}'
                        .format(doy, year))
                 logger.error(msg)
-                return ERROR
+                return (ERROR, None)
 
         # make sure at least one of the JPSS[1|2] or NPP files is present
         if not found_vjx04anc and not found_vnp04anc:
@@ -247,9 +705,635 @@ def downloadFiles(dloaddir, year, start_doy, end_doy, token):
             logger.warning(msg)
             continue
 
+    return (SUCCESS, index)
+
+
+def findMonthlyFiles(dloaddir, aux_year, min_doy, max_doy, token):
+    """
+    Description: findMonthlyFiles downloads all the daily VIIRS files for the
+    DOY range and returns the file for each DOY.
+
+    Args:
+      dloaddir: directory to download the VIIRS products
+      aux_year: year of the VIIRS products
+      min_doy - max_doy: inclusive day of year date range for the month
+      token: application token for the desired website
+
+    Returns:
+        (ERROR, None): error occurred while processing
+        (SUCCESS, files): dict of DOY to the VIIRS file for the DOY.  DOYs
+                          without a file are left out.
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    # make sure the LAADS data exists for the specified year
+    (status, index) = downloadFiles(dloaddir, aux_year, min_doy, max_doy,
+                                    token)
+    if status == ERROR:
+        msg = ('Problems occurred while downloading LAADS data for year {}, '
+               'date range {}-{}'.format(aux_year, min_doy, max_doy))
+        logger.error(msg)
+        return (ERROR, None)
+
+    auxdir_in = dloaddir
+    if not os.path.exists(auxdir_in):
+        msg = ('Auxiliary directory {} does not exist... exiting'
+               .format(auxdir_in))
+        logger.error(msg)
+        return (ERROR, None)
+
+    # loop through the year/month files in the auxiliary directory
+    files = {}
+    for doy in range(min_doy, max_doy+1):
+        glob_pattern = ('{}/*4ANC.A{:04d}{:03d}.*.h5'
+                        .format(auxdir_in, aux_year, doy))
+        doy_file = [os.path.join(auxdir_in, name)
+                    for name in index.find(VIIRS_PRODUCTS, aux_year, doy)]
+
+        # if there are no files in this directory for the year/doy then
+        # continue to the next doy. if there are more than one file, then
+        # we have an issue that needs to be resolved (error).
+        if len(doy_file) == 0:
+            continue
+        elif len(doy_file) > 1:
+            msg = ('There is more than one file for {}. Something is wrong '
+                   'in the auxiliary directory {}.'
+                   .format(glob_pattern, auxdir_in))
+            logger.error(msg)
+            return (ERROR, None)
+        logger.debug('Found {} DOY files: {}'
+                     .format(len(doy_file), doy_file[0]))
+        files[doy] = doy_file[0]
+
+    return (SUCCESS, files)
+
+
+def buildMonthlySums(dloaddir, aux_year, min_doy, max_doy, token):
+    """
+    Description: buildMonthlySums downloads all the daily VIIRS files for the
+    DOY range and adds them to new monthly sums.
+
+    Args:
+      dloaddir: directory to download the VIIRS products
+      aux_year: year of the VIIRS products
+      min_doy - max_doy: inclusive day of year date range for the month
+      token: application token for the desired website
+
+    Returns:
+        (ERROR, None): error occurred while processing
+        (SUCCESS, sums): MonthlySums for the DOY range
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    (status, files) = findMonthlyFiles(dloaddir, aux_year, min_doy, max_doy,
+                                       token)
+    if status == ERROR:
+        return (ERROR, None)
+
+    sums = MonthlySums()
+    for doy in sorted(files):
+        logger.info('Processing DOY {}'.format(doy))
+
+        # read the ozone and water vapor SDSs from the file and add them to
+        # the overall totals
+        aux_images = readViirsAux(files[doy])
+        if aux_images is None:
+            msg = ('An error occurred adding {} to the overall total.'
+                   .format(files[doy]))
+            logger.error(msg)
+            return (ERROR, None)
+
+        sums.addGranule(doy, os.path.basename(files[doy]), aux_images)
+        aux_images = None
+        logger.debug('Count: {}'.format(len(sums.granules)))
+
+    return (SUCCESS, sums)
+
+
+def writeMonthBlocks(files, block_rows, oz_outbase, wv_outbase,
+                     formats=DEFAULT_FORMATS, sums_path=None):
+    """
+    Description: writeMonthBlocks computes the monthly averages one block of
+    rows at a time.  Each block is read from every daily file, averaged and
+    written to temporary ENVI outputs before moving on to the next block, so
+    only one block of the totals and counts is in memory.  The outputs are
+    replaced once all the blocks are written, and COG outputs are copied
+    from the ENVI files.  The totals and counts of each block are written
+    to memory-mapped scratch files, from which the monthly sums are saved.
+
+    Args:
+      files: dict of DOY to the daily VIIRS file for the DOY
+      block_rows: number of rows in each block
+      oz_outbase, wv_outbase: ozone and water vapor output filenames without
+                              the extension
+      formats: output formats of the averages (keys of OUTPUT_WRITERS)
+      sums_path: where to save the monthly sums, or None to not save them
+
+    Returns:
+        ERROR: error occurred while processing
+        SUCCESS: processing completed successfully
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    doy_files = [files[doy] for doy in sorted(files)]
+    shape = getViirsAuxShape(doy_files[0])
+    if shape is None:
+        return ERROR
+    (ysize, xsize) = shape
+
+    outputs = ((OZONE_SDS, oz_outbase, gdal.GDT_Byte),
+               (WV_SDS, wv_outbase, gdal.GDT_UInt16))
+    bands = {}
+    datasets = {}
+    for (sds_name, outbase, imageType) in outputs:
+        datasets[sds_name] = createResultsEnvi(
+            getTmpName('{}.img'.format(outbase)), xsize, ysize, imageType,
+            os.path.basename(outbase))
+        bands[sds_name] = datasets[sds_name].GetRasterBand(1)
+
+    # scratch files for the totals and counts of the whole grid
+    scratchdir = None
+    sums = None
+    if sums_path is not None:
+        scratchdir = tempfile.mkdtemp(prefix='monthly_sums_')
+        sums = MonthlySums()
+        for sds_name in AUX_SDS:
+            total = numpy.lib.format.open_memmap(
+                os.path.join(scratchdir, '{}_total.npy'.format(sds_name)),
+                mode='w+', dtype=numpy.uint64, shape=shape)
+            count = numpy.lib.format.open_memmap(
+                os.path.join(scratchdir, '{}_count.npy'.format(sds_name)),
+                mode='w+', dtype=numpy.uint8, shape=shape)
+            sums.getAccumulator(sds_name).setTotals(total, count,
+                                                    len(doy_files))
+        sums.granules = dict((doy, os.path.basename(files[doy]))
+                             for doy in files)
+
+    status = SUCCESS
+    try:
+        for row in range(0, ysize, block_rows):
+            logger.debug('Processing rows {}-{}'
+                         .format(row, min(row+block_rows, ysize)-1))
+            accumulators = dict((sds_name, SdsAccumulator())
+                                for sds_name in AUX_SDS)
+            for doy_file in doy_files:
+                aux_images = readViirsAux(doy_file, window=(row, block_rows))
+                if aux_images is None:
+                    msg = ('An error occurred adding {} to the overall total.'
+                           .format(doy_file))
+                    logger.error(msg)
+                    status = ERROR
+                    break
+                for sds_name in AUX_SDS:
+                    accumulators[sds_name].add(aux_images[sds_name])
+                aux_images = None
+            if status == ERROR:
+                break
+
+            for sds_name in AUX_SDS:
+                accumulator = accumulators[sds_name]
+                bands[sds_name].WriteArray(accumulator.average(), 0, row)
+                if sums is not None:
+                    rows = slice(row, row + accumulator.total.shape[0])
+                    sums.getAccumulator(sds_name).total[rows] = \
+                        accumulator.total
+                    sums.getAccumulator(sds_name).count[rows] = \
+                        accumulator.count
+            accumulators = None
+
+        # replace the outputs only if every block was written, so a failed
+        # run leaves the previous averages in place
+        bands = None
+        for (sds_name, outbase, imageType) in outputs:
+            envi_name = '{}.img'.format(outbase)
+            datasets[sds_name].FlushCache()
+            if status == SUCCESS and 'cog' in formats:
+                copyToCog(datasets[sds_name],
+                          '{}{}'.format(outbase, OUTPUT_FORMATS['cog']))
+                recordOutput('{}{}'.format(outbase, OUTPUT_FORMATS['cog']))
+            datasets[sds_name] = None
+
+            # the ENVI file is only an intermediate if it wasn't requested
+            if status == SUCCESS and 'envi' in formats:
+                replaceOutput(envi_name)
+                recordOutput(envi_name)
+            else:
+                gdal.GetDriverByName('ENVI').Delete(getTmpName(envi_name))
+
+        # save the sums so the month can be updated incrementally
+        if status == SUCCESS and sums is not None:
+            sums.save(sums_path)
+
+    finally:
+        sums = None
+        if scratchdir is not None:
+            shutil.rmtree(scratchdir, ignore_errors=True)
+
+    return status
+
+
+def updateMonthlySums(sums, dloaddir, aux_year, min_doy, max_doy, token):
+    """
+    Description: updateMonthlySums brings saved monthly sums up to date.  The
+    LAADS listing of each DOY is compared against the granule which was
+    added for that DOY, and only new or replaced granules are downloaded.  A
+    replaced granule is removed from the sums using the copy of the old
+    granule in the LAADS cache.  If the old granule isn't cached, the month
+    needs to be rebuilt.
+
+    Args:
+      sums: MonthlySums loaded from an earlier run (updated in place)
+      dloaddir: directory to download the VIIRS products
+      aux_year: year of the VIIRS products
+      min_doy - max_doy: inclusive day of year date range for the month
+      token: application token for the desired website
+
+    Returns:
+        ERROR: error occurred while processing
+        REBUILD: the month needs to be rebuilt from all its daily files
+        SUCCESS: the sums are up to date
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    cache = getCache()
+    index = GranuleIndex(dloaddir)
+    updated = 0
+    for doy in range(min_doy, max_doy+1):
+        (status, listing) = listLads(aux_year, doy, token, VIIRS_PRODUCTS)
+        if status == ERROR:
+            return ERROR
+        if listing is None:
+            continue
+        if len(listing.entries) > 1:
+            msg = ('Multiple LAADS {} files found for doy {} year {}'
+                   .format(listing.product, doy, aux_year))
+            logger.error(msg)
+            return ERROR
+
+        name = listing.entries[0]['name']
+        old_name = sums.granules.get(doy)
+        if name == old_name:
+            continue
+
+        # the old granule is needed to take its values back out of the sums
+        old_images = None
+        if old_name is not None:
+            old_path = cache.path(old_name) if cache is not None else None
+            if old_path is None or not os.path.exists(old_path):
+                msg = ('{} was replaced by {} but is not in the LAADS '
+                       'cache. Rebuilding the month.'.format(old_name, name))
+                logger.info(msg)
+                return REBUILD
+            old_images = readViirsAux(old_path)
+            if old_images is None:
+                return REBUILD
+
+        status = downloadLads(aux_year, doy, dloaddir, token, VIIRS_PRODUCTS,
+                              index, listing=listing, cache=cache,
+                              cache_link=True)
+        if status == ERROR:
+            return ERROR
+
+        aux_images = readViirsAux(os.path.join(dloaddir, name))
+        if aux_images is None:
+            msg = ('An error occurred adding {} to the overall total.'
+                   .format(name))
+            logger.error(msg)
+            return ERROR
+
+        if old_images is not None:
+            sums.removeGranule(doy, old_images)
+        sums.addGranule(doy, name, aux_images)
+        updated += 1
+
+    msg = ('Updated {} days of the saved sums for year {}, DOY {}-{}'
+           .format(updated, aux_year, min_doy, max_doy))
+    logger.info(msg)
+    return SUCCESS
+
+
+def processMonthBlocks(auxdir_out, dloaddir, aux_year, aux_month, min_doy,
+                       max_doy, token, formats, block_rows, sums_path):
+    """
+    Description: processMonthBlocks generates the monthly averages for
+    processMonth by blocks of rows (see writeMonthBlocks).
+
+    Args:
+      auxdir_out: monthly averages directory of the year
+      dloaddir: directory to download the VIIRS products
+      aux_year: year of the monthly averages
+      aux_month: month (1-12) of the monthly averages
+      min_doy - max_doy: inclusive day of year date range for the month
+      token: application token for the desired website
+      formats: output formats of the averages (keys of OUTPUT_WRITERS)
+      block_rows: number of rows in each block
+      sums_path: where to save the sums of the month
+
+    Returns:
+        ERROR: error occurred while processing
+        SUCCESS: processing completed successfully
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    (status, files) = findMonthlyFiles(dloaddir, aux_year, min_doy, max_doy,
+                                       token)
+    if status == ERROR:
+        return ERROR
+
+    # make sure there are auxiliary files for this month
+    if len(files) == 0:
+        msg = ('No auxiliary files were found for year {} month {}. '
+               'Something is wrong in the auxiliary directory {}.'
+               .format(aux_year, aux_month, dloaddir))
+        logger.error(msg)
+        return ERROR
+
+    msg = ('Averaging {} days by blocks of {} rows'
+           .format(len(files), block_rows))
+    logger.info(msg)
+    oz_outbase = ('{}/monthly_avg_oz_{:4}_{:02}'
+                  .format(auxdir_out, aux_year, aux_month))
+    wv_outbase = ('{}/monthly_avg_wv_{:4}_{:02}'
+                  .format(auxdir_out, aux_year, aux_month))
+    status = writeMonthBlocks(files, block_rows, oz_outbase, wv_outbase,
+                              formats, sums_path)
+    if status == ERROR:
+        return ERROR
+
+    logger.info('LAADS download retries for {}-{:02}: {}'
+                .format(aux_year, aux_month, RETRY_POLICY.summary()))
+    return SUCCESS
+
+
+def processMonth(auxdir, aux_year, aux_month, token, incremental=False,
+                 formats=DEFAULT_FORMATS, block_rows=0):
+    """
+    Description: processMonth downloads the daily LAADS VIIRS files for the
+    year and month and generates the monthly ozone and water vapor averages
+    in monthly_avgs/<year>.  Months of the same year share the year's
+    download directory, so months may be processed in parallel.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory
+      aux_year: year of the monthly averages
+      aux_month: month (1-12) of the monthly averages
+      token: application token for the desired website
+      incremental: if True and the month's sums were saved by an earlier
+                   run, only the days which have changed are downloaded and
+                   folded into the sums
+      formats: output formats of the averages (keys of OUTPUT_WRITERS)
+      block_rows: if not 0, compute the averages from all the daily files
+                  this many rows at a time to limit memory use.  The sums
+                  of the month are still saved for later incremental runs,
+                  but this mode can't be used with incremental.
+
+    Returns:
+        ERROR: error occurred while processing
+        SUCCESS: processing completed successfully
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    msg = ('Processing LAADS VIIRS monthly averages for year {} and month {}.'
+           .format(aux_year, aux_month))
+    logger.info(msg)
+
+    # make sure the monthly averages year directory exists or make it
+    auxdir_out = ('{}/monthly_avgs/{}'.format(auxdir, aux_year))
+    if not os.path.exists(auxdir_out):
+        msg = ('Auxiliary directory for monthly averages year {} does not '
+               'exist. Creating...'.format(auxdir_out))
+        logger.info(msg)
+        os.makedirs(auxdir_out, exist_ok=True)
+
+    # determine the DOY values included in the aux_year and aux_month, handling
+    # leap years
+    if calendar.isleap(aux_year):
+        min_doy = ldaySOM[aux_month-1]
+        max_doy = ldayEOM[aux_month-1]
+    else:
+        min_doy = rdaySOM[aux_month-1]
+        max_doy = rdayEOM[aux_month-1]
+    logger.info('DOY range to process: {} - {}'.format(min_doy, max_doy))
+
+    # set the download directory in /tmp/lads_monthly
+    dloaddir = DOWNLOAD_DIR.format(aux_year)
+
+    msg = ('Auxiliary temp directory: {}'.format(dloaddir))
+    logger.info(msg)
+    msg = ('Monthly averages output directory: {}'.format(auxdir_out))
+    logger.info(msg)
+
+    # update the saved sums for the month with the days which have changed
+    # on LAADS, or rebuild the month from all the daily files
+    sums_path = ('{}/monthly_sums_{:4}_{:02}.npz'
+                 .format(auxdir_out, aux_year, aux_month))
+    if block_rows > 0:
+        return processMonthBlocks(auxdir_out, dloaddir, aux_year, aux_month,
+                                  min_doy, max_doy, token, formats,
+                                  block_rows, sums_path)
+
+    sums = None
+    if incremental:
+        sums = MonthlySums.load(sums_path)
+        if sums is not None:
+            status = updateMonthlySums(sums, dloaddir, aux_year, min_doy,
+                                       max_doy, token)
+            if status == ERROR:
+                return ERROR
+            if status == REBUILD:
+                sums = None
+
+    if sums is None:
+        (status, sums) = buildMonthlySums(dloaddir, aux_year, min_doy,
+                                          max_doy, token)
+        if status == ERROR:
+            return ERROR
+
+    # make sure there are auxiliary files for this month
+    if len(sums.granules) == 0:
+        msg = ('No auxiliary files were found for year {} month {}. '
+               'Something is wrong in the auxiliary directory {}.'
+               .format(aux_year, aux_month, dloaddir))
+        logger.error(msg)
+        return ERROR
+
+    # make sure the ozone and water vapor arrays are valid
+    if sums.oz.total is None:
+        msg = ('Ozone total for year {} month {} is None. Something is wrong '
+               'in the auxiliary directory {}.'
+               .format(aux_year, aux_month, dloaddir))
+        logger.error(msg)
+        return ERROR
+
+    if sums.wv.total is None:
+        msg = ('Water vapor total for year {} month {} is None. Something is '
+               'wrong in the auxiliary directory {}.'
+               .format(aux_year, aux_month, dloaddir))
+        logger.error(msg)
+        return ERROR
+
+    # determine the averages and handle divide by zero
+    oz_total = sums.oz.average()
+    wv_total = sums.wv.average()
+
+    # write data to the output files
+    basename = 'monthly_avg_oz_{:4}_{:02}'.format(aux_year, aux_month)
+    outbase = '{}/{}'.format(auxdir_out, basename)
+    writeResults(oz_total, outbase, gdal.GDT_Byte, basename, formats)
+    basename = 'monthly_avg_wv_{:4}_{:02}'.format(aux_year, aux_month)
+    outbase = '{}/{}'.format(auxdir_out, basename)
+    writeResults(wv_total, outbase, gdal.GDT_UInt16, basename, formats)
+
+    # save the sums so the month can be updated incrementally
+    sums.save(sums_path)
+
+    logger.info('LAADS download retries for {}-{:02}: {}'
+                .format(aux_year, aux_month, RETRY_POLICY.summary()))
     return SUCCESS
 
 
+def aggregateMonth(auxdir, first_year, last_year, aux_month,
+                   formats=DEFAULT_FORMATS):
+    """
+    Description: aggregateMonth combines the monthly sums saved by
+    processMonth for a range of years into a multi-year average of the month
+    in monthly_avgs/multiyear.  Only the saved totals and counts are read, so
+    no daily files are downloaded.  Years without saved sums are skipped.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory
+      first_year - last_year: inclusive range of years to combine
+      aux_month: month (1-12) of the averages
+      formats: output formats of the averages (keys of OUTPUT_WRITERS)
+
+    Returns:
+        ERROR: error occurred while processing
+        SUCCESS: processing completed successfully
+    """
+    # initialize the logger and error objects
+    logger = logging.getLogger(__name__)
+
+    msg = ('Aggregating the monthly averages for month {} of years {}-{}.'
+           .format(aux_month, first_year, last_year))
+    logger.info(msg)
+
+    oz = SdsAccumulator()
+    wv = SdsAccumulator()
+    years = []
+    for year in range(first_year, last_year+1):
+        sums_path = ('{}/monthly_avgs/{}/monthly_sums_{:4}_{:02}.npz'
+                     .format(auxdir, year, year, aux_month))
+        sums = MonthlySums.load(sums_path)
+        if sums is None or sums.oz.total is None:
+            msg = ('No monthly sums for year {} month {} ({}). Skipping the '
+                   'year.'.format(year, aux_month, sums_path))
+            logger.warning(msg)
+            continue
+
+        oz.merge(sums.oz)
+        wv.merge(sums.wv)
+        years.append(year)
+        sums = None
+
+    if len(years) == 0:
+        msg = ('No monthly sums were found for month {} of years {}-{}. '
+               'Generate the monthly averages for those years first.'
+               .format(aux_month, first_year, last_year))
+        logger.error(msg)
+        return ERROR
+
+    # make sure the multi-year directory exists or make it
+    auxdir_out = '{}/monthly_avgs/multiyear'.format(auxdir)
+    os.makedirs(auxdir_out, exist_ok=True)
+
+    # write data to the output files
+    basename = ('multiyear_avg_oz_{:4}_{:4}_{:02}'
+                .format(first_year, last_year, aux_month))
+    outbase = '{}/{}'.format(auxdir_out, basename)
+    writeResults(oz.average(), outbase, gdal.GDT_Byte, basename, formats)
+    basename = ('multiyear_avg_wv_{:4}_{:4}_{:02}'
+                .format(first_year, last_year, aux_month))
+    outbase = '{}/{}'.format(auxdir_out, basename)
+    writeResults(wv.average(), outbase, gdal.GDT_UInt16, basename, formats)
+
+    msg = ('Combined {} days from years {} for month {}'
+           .format(oz.nfiles, ', '.join(str(y) for y in years), aux_month))
+    logger.info(msg)
+    return SUCCESS
+
+
+def runMonth(auxdir, aux_year, aux_month, token, incremental, formats,
+             block_rows):
+    """
+    Description: runMonth runs processMonth in a worker process.  The
+    metrics of the month and the files it wrote are returned to the main
+    process, since they are recorded in the worker's copies of METRICS and
+    PUBLISHED.
+
+    Returns: (status of processMonth, snapshot of the month's metrics,
+              list of the files written)
+    """
+    METRICS.reset()
+    PUBLISHED.reset()
+    status = processMonth(auxdir, aux_year, aux_month, token, incremental,
+                          formats, block_rows)
+    return (status, METRICS.snapshot(), PUBLISHED.paths())
+
+
+def writeMetrics(auxdir, status):
+    """
+    Description: writes the metrics of the run to the metrics directory
+    (see laads_metrics.py) and the list of the files written by the run,
+    which are the only files uploaded to S3 (see laads_publish.py).
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory
+      status: exit status of the run
+    """
+    logger = logging.getLogger(__name__)
+
+    try:
+        PUBLISHED.extend(METRICS.write(getMetricsDir(auxdir), 'climatology',
+                                       status))
+    except (IOError, OSError) as e:
+        logger.warning('Unable to write the run metrics: {}'.format(e))
+
+    publish_list = PUBLISHED.write('climatology', auxdir)
+    logger.info('Files to publish are listed in {}'.format(publish_list))
+
+
+def parseMonths(months):
+    """
+    Description: parses a list of months such as "1-12" or "1,2,6-8".
+
+    Args:
+      months: comma-separated months and/or ranges of months
+
+    Returns: sorted list of the months (1-12)
+
+    Raises:
+      ValueError: the list is invalid
+    """
+    result = set()
+    for item in months.split(','):
+        if '-' in item:
+            (first, last) = item.split('-', 1)
+            result.update(range(int(first), int(last)+1))
+        else:
+            result.add(int(item))
+
+    if not result or min(result) < 1 or max(result) > 12:
+        raise ValueError('months must be between 1 and 12: {}'.format(months))
+
+    return sorted(result)
+
+
 #########
 # generate the monthly averages
 #########
@@ -266,10 +1350,49 @@ def main ():
         default=0, help='month (1-12) for which to generate monthly averages '
                         'of the LAADS VIIRS data (default is the previous '
                         'month)')
+    parser.add_option ('-e', '--end_year', type='int', dest='end_year',
+        default=0, help='last year for which to generate monthly averages. '
+                        'all the years from --aux_year through --end_year '
+                        'are processed (default is --aux_year)')
+    parser.add_option ('--months', dest='months', default=None,
+        help='months for which to generate monthly averages, e.g. 1-12 or '
+             '1,2,6-8 (overrides --aux_month)')
+    parser.add_option ('--incremental', dest='incremental', default=False,
+        action='store_true',
+        help='update the sums saved by an earlier run with only the days '
+             'which are new or have changed on LAADS instead of rebuilding '
+             'the month')
+    parser.add_option ('--aggregate', dest='aggregate', default=False,
+        action='store_true',
+        help='combine the monthly sums saved for --aux_year through '
+             '--end_year into multi-year averages in monthly_avgs/multiyear '
+             'instead of generating the monthly averages')
+    parser.add_option ('--formats', dest='formats',
+        default=','.join(DEFAULT_FORMATS),
+        help='comma-separated output formats of the averages: {} (default '
+             'is {})'.format(', '.join(sorted(OUTPUT_FORMATS)),
+                             ','.join(DEFAULT_FORMATS)))
+    parser.add_option ('--block_rows', type='int', dest='block_rows',
+        default=int(os.environ.get('CLIM_BLOCK_ROWS', 0)),
+        help='compute the averages this many rows at a time, which bounds '
+             'memory use by the block size instead of the grid size.  every '
+             'day is read, so this can\'t be used with --incremental, but '
+             'the monthly sums are saved for later incremental runs '
+             '(default is CLIM_BLOCK_ROWS or 0, the whole grid)')
+    parser.add_option ('--workers', type='int', dest='workers',
+        default=os.cpu_count() or 1,
+        help='number of months to process in parallel (default is the '
+             'number of cores)')
 
     (options, args) = parser.parse_args()
     aux_year = options.aux_year     # year
     aux_month = options.aux_month   # month
+    end_year = options.end_year     # last year
+    workers = options.workers       # number of parallel months
+    incremental = options.incremental  # update the saved monthly sums
+    aggregate = options.aggregate   # combine the saved sums of the years
+    formats = options.formats.split(',')  # output formats
+    block_rows = options.block_rows  # rows per block, 0 for the whole grid
 
     # check the arguments and default to the current year and previous
     # month for processing if the year and/or month were not specified
@@ -283,9 +1406,27 @@ def main ():
         else:
             aux_month = 12
 
-    msg = ('Processing LAADS VIIRS monthly averages for year {} and month {}.'
-           .format(aux_year, aux_month))
-    logger.info(msg)
+    if options.months is not None:
+        try:
+            months = parseMonths(options.months)
+        except ValueError as e:
+            logger.error('Invalid --months: {}'.format(e))
+            return ERROR
+    else:
+        months = [aux_month]
+
+    if end_year == 0:
+        end_year = aux_year
+    if end_year < aux_year or workers < 1 or \
+            not set(formats).issubset(OUTPUT_FORMATS) or block_rows < 0 or \
+            (block_rows > 0 and incremental):
+        msg = ('Invalid command line argument combination.  Type --help '
+               'for more information.')
+        logger.error(msg)
+        return ERROR
+
+    years = list(range(aux_year, end_year+1))
+    tasks = [(year, month) for year in years for month in months]
 
     # determine the auxiliary directory to store the data
     auxdir = os.environ.get('LASRC_AUX_DIR')
@@ -308,13 +1449,23 @@ def main ():
         logger.info(msg)
         os.mkdir(auxdir_out)
 
-    # make sure the monthly averages year directory exists or make it
-    auxdir_out = ('{}/monthly_avgs/{}'.format(auxdir, aux_year))
-    if not os.path.exists(auxdir_out):
-        msg = ('Auxiliary directory for monthly averages year {} does not '
-               'exist. Creating...'.format(auxdir_out))
+    # the multi-year averages only need the saved monthly sums
+    if aggregate:
+        failed = [month for month in months
+                  if aggregateMonth(auxdir, aux_year, end_year, month,
+                                    formats) == ERROR]
+        METRICS.count('months_aggregated', len(months) - len(failed))
+        if failed:
+            msg = ('Problems occurred aggregating the monthly averages for '
+                   'months {}'.format(', '.join(str(m) for m in failed)))
+            logger.error(msg)
+            writeMetrics(auxdir, ERROR)
+            return ERROR
+
+        msg = ('Successful completion')
         logger.info(msg)
-        os.mkdir(auxdir_out)
+        writeMetrics(auxdir, SUCCESS)
+        return SUCCESS
 
     # Get the application token for the LAADS https interface. for ESPA
     # systems, pull the token from the config file.
@@ -340,137 +1491,55 @@ def main ():
             'https://ladsweb.modaps.eosdis.nasa.gov/tools-and-services/data-download-scripts/')
         return ERROR
 
-    # determine the DOY values included in the aux_year and aux_month, handling
-    # leap years
-    if calendar.isleap(aux_year):
-        min_doy = ldaySOM[aux_month-1]
-        max_doy = ldayEOM[aux_month-1]
+    # clean up the download directories once for the run.  the months of a
+    # year share the year's download directory.
+    for year in years:
+        cleanDownloadDir(DOWNLOAD_DIR.format(year))
+
+    # generate the monthly averages, running the months in parallel if there
+    # is more than one
+    if len(tasks) == 1 or workers == 1:
+        statuses = [processMonth(auxdir, year, month, token, incremental,
+                                 formats, block_rows)
+                    for (year, month) in tasks]
     else:
-        min_doy = rdaySOM[aux_month-1]
-        max_doy = rdayEOM[aux_month-1]
-    logger.info('DOY range to process: {} - {}'.format(min_doy, max_doy))
-
-    # set the download directory in /tmp/lads_monthly
-    dloaddir = '/tmp/lads_monthly/{}'.format(aux_year)
-
-    # make sure the LAADS data exists for the specified year
-    status = downloadFiles(dloaddir, aux_year, min_doy, max_doy, token)
-    if status == ERROR:
-        msg = ('Problems occurred while downloading LAADS data for year {}, '
-               'date range {}-{}'.format(aux_year, min_doy, max_doy))
-        logger.error(msg)
-        return ERROR
-
-    auxdir_in = dloaddir
-    if not os.path.exists(auxdir_in):
-        msg = ('Auxiliary directory {} does not exist... exiting'
-               .format(auxdir_in))
-        logger.error(msg)
-        return ERROR
-
-    msg = ('Auxiliary temp directory: {}'.format(auxdir_in))
-    logger.info(msg)
-    msg = ('Monthly averages output directory: {}'.format(auxdir_out))
-    logger.info(msg)
-
-    # loop through the year/month files in the auxiliary directory
-    init_oz_totals = True
-    init_wv_totals = True
-    oz_total = None
-    oz_count = None
-    wv_total = None
-    wv_count = None
-    count = 0
-    for doy in range(min_doy, max_doy+1):
-        logger.info('Processing DOY {}'.format(doy))
-        glob_pattern = ('{}/*4ANC.A{:04d}{:03d}.*.h5'
-                        .format(auxdir_in, aux_year, doy))
-        doy_file = glob.glob(glob_pattern)
-
-        # if there are no files in this directory for the year/doy then
-        # continue to the next doy. if there are more than one file, then
-        # we have an issue that needs to be resolved (error).
-        if len(doy_file) == 0:
-            continue
-        elif len(doy_file) > 1:
-            msg = ('There is more than one file for {}. Something is wrong '
-                   'in the auxiliary directory {}.'
-                   .format(glob_pattern, auxdir_in))
-            logger.error(msg)
-            return ERROR
-        logger.debug('{} DOY files were found'.format(len(doy_file)))
-        logger.debug('Found {} DOY files: {}'
-                     .format(len(doy_file), doy_file[0]))
-
-        # generate the SDS names for the ozone and water vapor bands
-        oz_sds = ('HDF5:\"{}\"://HDFEOS/GRIDS/VIIRS_CMG/Data_Fields/'
-                  'Coarse_Resolution_Ozone'.format(doy_file[0]))
-        wv_sds = ('HDF5:\"{}\"://HDFEOS/GRIDS/VIIRS_CMG/Data_Fields/'
-                  'Coarse_Resolution_Water_Vapor'.format(doy_file[0]))
-
-        # process the current file and add the SDS data to the overall total
-        # for ozone and water vapor
-        # if this is the first file in the month then we need to setup and
-        # initialize the ozone and water vapor totals
-        count = count + 1
-        [status, init_oz_totals, oz_total, oz_count] =  \
-            addFiletoAvg(oz_sds, init_oz_totals, oz_total, oz_count)
-        if not status:
-            msg = ('An error occurred adding {} to the overall total.'
-                   .format(oz_sds))
-            logger.error(msg)
-            return ERROR
-
-        [status, init_wv_totals, wv_total, wv_count] =  \
-            addFiletoAvg(wv_sds, init_wv_totals, wv_total, wv_count)
-        if not status:
-            msg = ('An error occurred adding {} to the overall total.'
-                   .format(wv_sds))
-            logger.error(msg)
-            return ERROR
-        logger.debug('Count: {}'.format(count))
-
-    # make sure there are auxiliary files for this month
-    if count == 0:
-        msg = ('No auxiliary files were found for {}. Something is wrong '
-               'in the auxiliary directory {}.'.format(glob_pattern, auxdir_in))
-        logger.error(msg)
-        return ERROR
-
-    # make sure the ozone and water vapor arrays are valid
-    if oz_total is None:
-        msg = ('Ozone total for {} is None. Something is wrong '
-               'in the auxiliary directory {}.'.format(glob_pattern, auxdir_in))
-        logger.error(msg)
-        return ERROR
-
-    if wv_total is None:
-        msg = ('Water vapor total for {} is None. Something is wrong '
-               'in the auxiliary directory {}.'.format(glob_pattern, auxdir_in))
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(workers, len(tasks))) as executor:
+            futures = [executor.submit(runMonth, auxdir, year, month,
+                                       token, incremental, formats,
+                                       block_rows)
+                       for (year, month) in tasks]
+            statuses = []
+            for future in futures:
+                (status, metrics, published) = future.result()
+                statuses.append(status)
+                METRICS.merge(metrics)
+                PUBLISHED.extend(published)
+
+    failed = [task for (task, status) in zip(tasks, statuses)
+              if status == ERROR]
+    METRICS.count('months_processed', len(tasks) - len(failed))
+    METRICS.count('months_failed', len(failed))
+    if failed:
+        msg = ('Problems occurred generating the monthly averages for {}'
+               .format(', '.join('{}-{:02}'.format(year, month)
+                                 for (year, month) in failed)))
         logger.error(msg)
+        writeMetrics(auxdir, ERROR)
         return ERROR
 
-    # determine the averages and handle divide by zero
-    oz_total = numpy.where(oz_count > 0, oz_total / oz_count, 0)
-    wv_total = numpy.where(wv_count > 0, wv_total / wv_count, 0)
-
-    # write data to the output ENVI File
-    basename = 'monthly_avg_oz_{:4}_{:02}'.format(aux_year, aux_month)
-    outname = '{}/{}.img'.format(auxdir_out, basename)
-    writeResultsEnvi(oz_total, outname, gdal.GDT_Byte, basename)
-    basename = 'monthly_avg_wv_{:4}_{:02}'.format(aux_year, aux_month)
-    outname = '{}/{}.img'.format(auxdir_out, basename)
-    writeResultsEnvi(wv_total, outname, gdal.GDT_UInt16, basename)
-
-    # clean up the temporary download directory
-    for myfile in os.listdir(dloaddir):
-        name = os.path.join(dloaddir, myfile)
-        if os.path.isfile(name):
-            os.remove(name)
+    # clean up the temporary download directories
+    for year in years:
+        dloaddir = DOWNLOAD_DIR.format(year)
+        for myfile in os.listdir(dloaddir):
+            name = os.path.join(dloaddir, myfile)
+            if os.path.isfile(name):
+                os.remove(name)
 
     # successful completion
     msg = ('Successful completion')
     logger.info(msg)
+    writeMetrics(auxdir, SUCCESS)
     return SUCCESS
 
 
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Local cache of raw LAADS granules shared by updatelads.py and
+# generate_monthly_climatology.py, so repeat runs and climatology builds
+# reuse granules which have already been downloaded instead of pulling them
+# from LAADS again.
+#
+# Granules are keyed by their name, which includes the production time, so a
+# reprocessed granule is a new cache entry.  The cache has a size budget and
+# evicts the least recently used granules when it is exceeded.  Entries are
+# written to a temporary file and renamed into place, and eviction is
+# serialized with a lock file, so several processes can share the cache.
+#
+# The cache is a deployment setting: it is only used when LAADS_CACHE_DIR
+# is set, and is limited to LAADS_CACHE_SIZE bytes (default 10 GB, 0
+# disables the cache).  In production it is $LASRC_AUX_DIR/laads_cache,
+# i.e. on EFS, so it outlives the Batch job and is shared by the updatelads
+# and climatology jobs (see the README).
+############################################################################
+
+import os
+import shutil
+import fcntl
+import logging
+import threading
+
+from laads_index import parseGranuleName
+
+CACHE_DIR = os.environ.get('LAADS_CACHE_DIR')
+CACHE_SIZE = int(os.environ.get('LAADS_CACHE_SIZE', 10 * 1024**3))
+
+# when the budget is exceeded, evict down to this fraction of it so eviction
+# doesn't run on every store
+EVICT_TARGET = 0.9
+
+LOCK_NAME = '.lock'
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class GranuleCache(object):
+    """
+    Description: size-limited LRU cache of raw LAADS granules on local disk.
+    Granules are stored as <directory>/<product>/<year>/<name> and their
+    modification time is updated on each hit to track recent use.
+
+    Args:
+      directory: cache directory (created if it doesn't exist)
+      max_bytes: size budget of the cache in bytes
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, 0o777, exist_ok=True)
+        self._size = sum(size for (path, size, mtime) in self._entries())
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        # list the cached granules as (path, size, mtime)
+        entries = []
+        for (dirpath, dirnames, filenames) in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def path(self, name):
+        """
+        Description: returns the cache path for the granule name.
+        """
+        granule = parseGranuleName(name)
+        if granule is None:
+            return os.path.join(self.directory, 'other', name)
+
+        return os.path.join(self.directory, granule.product,
+                            str(granule.year), name)
+
+    def fetch(self, name, dest, size=None, link=False):
+        """
+        Description: copies (or hard links) the cached granule to dest.
+
+        Args:
+          name: granule name
+          dest: path where the granule is wanted
+          size: expected size of the granule in bytes.  A cached granule of
+                a different size is treated as a miss.
+          link: hard link rather than copy.  Only for callers which don't
+                modify the file, since the link shares the cached bytes.
+
+        Returns:
+            True: dest was filled from the cache
+            False: the granule isn't cached
+        """
+        cached = self.path(name)
+        try:
+            if size is not None and os.path.getsize(cached) != size:
+                return False
+
+            # a hit makes this the most recently used granule
+            os.utime(cached)
+            if os.path.exists(dest):
+                os.remove(dest)
+            if link:
+                try:
+                    os.link(cached, dest)
+                    return True
+                except OSError:
+                    # different filesystems, fall back to a copy
+                    pass
+            shutil.copyfile(cached, dest)
+
+        except (IOError, OSError):
+            # not cached, or evicted while it was being copied
+            if os.path.exists(dest):
+                os.remove(dest)
+            return False
+
+        return True
+
+    def store(self, src, name):
+        """
+        Description: adds a downloaded granule to the cache, evicting the
+        least recently used granules if the cache is over its budget.
+
+        Args:
+          src: path of the downloaded granule
+          name: granule name
+        """
+        cached = self.path(name)
+        os.makedirs(os.path.dirname(cached), 0o777, exist_ok=True)
+
+        # copy into a temporary file and rename it into place so other
+        # processes never see a partial granule
+        tmp = os.path.join(os.path.dirname(cached), '.{}.{}.{}.tmp'
+                           .format(name, os.getpid(), threading.get_ident()))
+        shutil.copyfile(src, tmp)
+
+        # a granule which was already cached is replaced, so only the
+        # difference in size is added
+        try:
+            replaced = os.path.getsize(cached)
+        except OSError:
+            replaced = 0
+        os.rename(tmp, cached)
+
+        with self._lock:
+            self._size += os.path.getsize(cached) - replaced
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """
+        Description: removes the least recently used granules until the
+        cache is under EVICT_TARGET of its budget.  The lock file keeps
+        processes sharing the cache from evicting at the same time.
+        """
+        logger = logging.getLogger(__name__)
+
+        with open(os.path.join(self.directory, LOCK_NAME), 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                entries = sorted(self._entries(), key=lambda e: e[2])
+                total = sum(size for (path, size, mtime) in entries)
+                target = self.max_bytes * EVICT_TARGET
+                for (path, size, mtime) in entries:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    logger.debug('Evicted {} from the LAADS cache'
+                                 .format(path))
+                    total -= size
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+        # other processes (and concurrent stores) also change the cache, so
+        # the scanned total is the best estimate of its size
+        with self._lock:
+            self._size = total
+
+
+def getCache():
+    """
+    Description: returns the GranuleCache shared by the run, creating it on
+    first use, or None if the cache is disabled (LAADS_CACHE_DIR not set, or
+    LAADS_CACHE_SIZE=0).
+    """
+    global _cache
+
+    if not CACHE_DIR or CACHE_SIZE <= 0:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = GranuleCache(CACHE_DIR, CACHE_SIZE)
+
+    return _cache
@@ -0,0 +1,629 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: HTTP client for the LAADS DAAC archive.  All the downloads in
+# a run share a single keep-alive requests session, so TLS sessions and
+# connections are reused across files instead of starting a new curl
+# process for every request.
+#
+# The archive server can be pointed at a local stand-in server by setting
+# the LAADS_SERVER_URL environment variable.
+############################################################################
+
+import sys
+import os
+import csv
+import logging
+import threading
+import time
+import random
+import collections
+import email.utils
+from io import StringIO
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from laads_metrics import METRICS
+
+# Global static variables
+ERROR = 1
+SUCCESS = 0
+UNCHANGED = 2
+
+USERAGENT = 'espa.cr.usgs.gov/updatelads.py 1.4.1--' + sys.version.replace('\n','').replace('\r','')
+
+# LAADS archive location of the VIIRS atmosphere (collection 5200) products
+SERVER_URL = os.environ.get('LAADS_SERVER_URL',
+                            'https://ladsweb.modaps.eosdis.nasa.gov')
+ARCHIVE_PATH = '/archive/allData/5200'
+
+# VIIRS atmosphere products in priority order.  only the first product
+# available for a given day is downloaded.
+VIIRS_PRODUCTS = ('VJ104ANC', 'VNP04ANC')
+
+# largest read streamed to disk, connection pool size and the (connect,
+# read) timeouts in seconds
+CHUNK_SIZE = 1024 * 1024
+POOL_SIZE = int(os.environ.get('LAADS_HTTP_POOL_SIZE', 16))
+TIMEOUT = (60, 300)
+
+# default retry policy: retry failed requests up to 5 times with an
+# exponential backoff starting at 5 seconds and capped at 60 seconds.  give up
+# on a file once 300 seconds have been spent retrying it.
+RETRIES = int(os.environ.get('LAADS_RETRIES', 5))
+RETRY_DELAY = float(os.environ.get('LAADS_RETRY_DELAY', 5))
+RETRY_MAX_DELAY = float(os.environ.get('LAADS_RETRY_MAX_DELAY', 60))
+RETRY_DEADLINE = float(os.environ.get('LAADS_RETRY_DEADLINE', 300))
+RETRY_JITTER = 0.5
+
+# HTTP status codes which are worth retrying (same as curl --retry).  429
+# (throttled) and 503 (unavailable) responses may also tell us how long to
+# wait with a Retry-After header.
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+RETRY_AFTER_STATUS = (429, 503)
+# status recorded for the retries of a response cut off partway through
+STREAM_ERROR = 'stream_error'
+
+# granules are downloaded to <name>.part and renamed once they are complete
+# and the right size.  a failed transfer leaves the partial file so the
+# retries, and reruns within PART_MAX_AGE seconds, continue it with a Range
+# request rather than starting over.
+PART_SUFFIX = '.part'
+PART_MAX_AGE = int(os.environ.get('LAADS_PART_MAX_AGE', 24 * 60 * 60))
+
+# set to cancel any downloads waiting to retry
+CANCEL = threading.Event()
+
+_session = None
+_session_lock = threading.Lock()
+
+# archive listing of the granules of a product for a single day.  entries
+# are the rows of the LAADS .csv listing (name, last_modified, size).
+LadsListing = collections.namedtuple('LadsListing',
+                                     ['product', 'url', 'entries'])
+
+
+class DownloadError(Exception):
+    """
+    Description: raised by geturl when a URL could not be retrieved.
+    status_code is the HTTP status of the last attempt, STREAM_ERROR if
+    its response was cut off, or None if the request never got a response
+    (connection error or cancelled).
+    """
+    def __init__(self, url, status_code=None, reason=''):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        Exception.__init__(self, 'Unable to retrieve {} ({}): {}'
+                           .format(url, status_code, reason))
+
+
+class RetryPolicy(object):
+    """
+    Description: decides whether and how long to wait before retrying a
+    failed request, and counts the retries made during the run.  The delay
+    grows exponentially with each attempt and is randomly shortened by up to
+    jitter (a fraction) so concurrent downloads don't retry in lockstep.  A
+    Retry-After header on a 429 or 503 response is honored as the minimum
+    delay.
+
+    Args:
+      retries: maximum number of retries per request
+      base_delay: delay in seconds before the first retry
+      max_delay: maximum backoff delay in seconds
+      deadline: maximum number of seconds to spend on a single request,
+                including the retry delays
+      jitter: fraction (0-1) of the backoff delay which is randomized
+    """
+    def __init__(self, retries=RETRIES, base_delay=RETRY_DELAY,
+                 max_delay=RETRY_MAX_DELAY, deadline=RETRY_DEADLINE,
+                 jitter=RETRY_JITTER):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+
+        # retries made during this run, in total and by HTTP status code
+        # (None for connection errors)
+        self.retry_count = 0
+        self.status_counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def isRetryable(self, status_code):
+        """
+        Description: returns True if a request which failed with the
+        specified HTTP status code (None for a connection error) is worth
+        retrying.
+        """
+        return status_code is None or status_code in RETRY_STATUS
+
+    def getDelay(self, attempt, status_code=None, retry_after=None):
+        """
+        Description: returns the number of seconds to wait before the
+        specified retry attempt (1-based).
+
+        Args:
+          attempt: retry attempt which is about to be made
+          status_code: HTTP status code of the failed request
+          retry_after: value of the Retry-After header of the failed request
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = delay * (1 - self.jitter * random.random())
+
+        if status_code in RETRY_AFTER_STATUS:
+            wait = parseRetryAfter(retry_after)
+            if wait is not None:
+                delay = max(delay, wait)
+
+        return delay
+
+    def recordRetry(self, status_code):
+        """
+        Description: counts a retry of a request which failed with the
+        specified HTTP status code.
+        """
+        with self._lock:
+            self.retry_count += 1
+            self.status_counts[status_code] += 1
+
+    def summary(self):
+        """
+        Description: returns a one-line description of the retries made
+        during the run.
+        """
+        with self._lock:
+            counts = ', '.join('{}: {}'.format(k or 'connection', v)
+                               for (k, v) in sorted(self.status_counts.items(),
+                                                    key=lambda x: str(x[0])))
+            return '{} retries ({})'.format(self.retry_count, counts or 'none')
+
+
+# retry policy used by geturl unless one is specified
+RETRY_POLICY = RetryPolicy()
+
+
+def parseRetryAfter(value):
+    """
+    Description: parses a Retry-After header, which is either a number of
+    seconds or an HTTP date.
+
+    Args:
+      value: value of the Retry-After header (or None)
+
+    Returns: number of seconds to wait, or None if there is no valid header
+    """
+    if value is None:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_time is None:
+        return None
+
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+def getSession(pool_size=POOL_SIZE):
+    """
+    Description: returns the requests session shared by all downloads in
+    this run, creating it on first use.
+
+    Args:
+      pool_size: number of keep-alive connections to keep per host. Only
+                 used when the session is created.
+
+    Returns: requests.Session
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['user-agent'] = USERAGENT
+            _session = session
+
+    return _session
+
+
+def closeSession():
+    """
+    Description: closes the shared session and its pooled connections.
+
+    Returns: None
+    """
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def cancelDownloads():
+    """
+    Description: wakes up any downloads sleeping before a retry and stops
+    them from retrying again.
+
+    Returns: None
+    """
+    CANCEL.set()
+
+
+def isResumable(path):
+    """
+    Description: returns True if the file is a partial download which is
+    recent enough to be continued, so it should be kept when the download
+    directory is cleaned.
+    """
+    return path.endswith(PART_SUFFIX) and \
+        time.time() - os.path.getmtime(path) < PART_MAX_AGE
+
+
+def iterBody(response):
+    """
+    Description: iterates over the body of a streamed response, returning
+    the bytes as soon as they arrive (up to CHUNK_SIZE at a time) so a
+    transfer which is cut off loses nothing that was received.
+
+    Args:
+      response: streamed requests response
+
+    Raises:
+      requests.ConnectionError: the connection was closed or broke before
+                                the end of the body
+    """
+    raw = response.raw
+    if not hasattr(raw, 'read1'):
+        # urllib3 1.x only reads whole chunks
+        for chunk in response.iter_content(64 * 1024):
+            yield chunk
+        # and doesn't raise if the connection closes before Content-Length
+        remaining = getattr(raw, 'length_remaining', None)
+        if remaining:
+            raise requests.ConnectionError(
+                'Connection closed with {} bytes of the body not received'
+                .format(remaining))
+        return
+
+    while True:
+        try:
+            chunk = raw.read1(CHUNK_SIZE, decode_content=True)
+        except urllib3.exceptions.HTTPError as e:
+            raise requests.ConnectionError(e)
+        if not chunk:
+            return
+        yield chunk
+
+
+def geturl(url, token=None, out=None, policy=None, info=None,
+           method='GET', resume=False, size=None):
+    """
+    Pulls the file specified by URL.  If there is a problem with the
+    connection or the server, then retry as allowed by the retry policy.
+
+    Args:
+      url: URL for the file to be downloaded
+      token: application token for the desired website
+      out: open binary file handle where the downloaded file will be written
+      policy: RetryPolicy to use (default is RETRY_POLICY)
+      info: dict which is filled in with the 'etag' and 'last_modified'
+            headers of the successful response
+      method: HTTP method (GET, or HEAD to only fill in info)
+      resume: if True, the bytes already in out are kept and the download
+              (and each retry) continues from the end of out with a Range
+              request.  Otherwise every attempt starts from the beginning.
+      size: expected size of the file, if known.  With resume, a file
+            already complete in out isn't requested again.
+
+    Returns:
+      contents of the URL as text if out is None, otherwise the number of
+      bytes in out
+
+    Raises:
+      DownloadError: the URL could not be retrieved
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    if policy is None:
+        policy = RETRY_POLICY
+
+    # get the headers for the application data download.  the user-agent is
+    # set on the session.
+    headers = {}
+    if not token is None:
+        headers['Authorization'] = 'Bearer ' + token
+
+    session = getSession()
+    start = time.monotonic()
+    attempt = 0
+    validator = None
+    while True:
+        if CANCEL.is_set():
+            raise DownloadError(url, reason='cancelled')
+
+        # continue from the bytes already received.  If-Range makes the
+        # server send the whole file if it has changed since the first part.
+        offset = 0
+        request_headers = headers
+        if out is not None and resume:
+            out.seek(0, os.SEEK_END)
+            offset = out.tell()
+            if size is not None and offset == size:
+                logger.info('{} was already downloaded ({} bytes)'
+                            .format(url, offset))
+                return offset
+            if size is not None and offset > size:
+                # longer than the file on the server, so not a part of it
+                out.seek(0)
+                out.truncate()
+                offset = 0
+            if offset > 0:
+                request_headers = dict(headers)
+                request_headers['Range'] = 'bytes={}-'.format(offset)
+                if validator is not None:
+                    request_headers['If-Range'] = validator
+
+        status_code = None
+        retry_after = None
+        try:
+            with session.request(method, url, headers=request_headers,
+                                 stream=out is not None,
+                                 timeout=TIMEOUT) as response:
+                status_code = response.status_code
+                reason = response.reason
+                if status_code == 416 and offset > 0:
+                    # the partial file is no longer a prefix of the file on
+                    # the server.  start over without using up a retry.
+                    logger.info('Restarting the download of {} ({} bytes '
+                                'already received)'.format(url, offset))
+                    out.seek(0)
+                    out.truncate()
+                    continue
+                if status_code >= 400:
+                    if not policy.isRetryable(status_code):
+                        raise DownloadError(url, status_code, reason)
+                    retry_after = response.headers.get('Retry-After')
+
+                else:
+                    if info is not None:
+                        info['etag'] = response.headers.get('ETag')
+                        info['last_modified'] = \
+                            response.headers.get('Last-Modified')
+
+                    if out is None:
+                        text = response.text
+                        METRICS.count('http_requests',
+                                      labels={'method': method})
+                        METRICS.observe('http_request',
+                                        time.monotonic() - start)
+                        return text
+
+                    # stream the response to disk.  a partial response is
+                    # appended to the bytes already received, anything else
+                    # starts from the beginning of the file.
+                    if status_code == 206 and response.headers.get(
+                            'Content-Range', '').startswith(
+                            'bytes {}-'.format(offset)):
+                        METRICS.count('download_resumes')
+                        logger.info('Resuming the download of {} at byte {}'
+                                    .format(url, offset))
+                    else:
+                        out.seek(0)
+                        out.truncate()
+                    if resume:
+                        validator = (response.headers.get('ETag') or
+                                     response.headers.get('Last-Modified'))
+                    nbytes = 0
+                    try:
+                        for chunk in iterBody(response):
+                            out.write(chunk)
+                            nbytes += len(chunk)
+                    except requests.RequestException:
+                        # the response was fine, the stream broke
+                        status_code = STREAM_ERROR
+                        raise
+                    finally:
+                        # keep what was received for the next attempt
+                        out.flush()
+                        METRICS.count('download_bytes', nbytes)
+                    METRICS.count('http_requests', labels={'method': method})
+                    METRICS.observe('http_download', time.monotonic() - start)
+                    return out.tell()
+
+        except requests.RequestException as e:
+            reason = str(e)
+
+        # determine how long to wait before the next attempt, giving up if
+        # the retries or the deadline for this file have run out
+        attempt += 1
+        if attempt > policy.retries:
+            logger.warning('Unsuccessful download of {} (retried {} times)'
+                           .format(url, policy.retries))
+            METRICS.count('http_failures')
+            raise DownloadError(url, status_code, reason)
+
+        delay = policy.getDelay(attempt, status_code, retry_after)
+        if time.monotonic() - start + delay > policy.deadline:
+            logger.warning('Unsuccessful download of {} (retry deadline of '
+                           '{} seconds exceeded)'.format(url, policy.deadline))
+            METRICS.count('http_failures')
+            raise DownloadError(url, status_code, reason)
+
+        # the sleep is cut short if the downloads are cancelled
+        policy.recordRetry(status_code)
+        METRICS.count('http_retries',
+                      labels={'status': str(status_code or 'connection')})
+        logger.info('Retry {} of download for {} in {:.1f} seconds ({}: {})'
+                    .format(attempt, url, delay, status_code, reason))
+        if CANCEL.wait(delay):
+            raise DownloadError(url, status_code, 'cancelled')
+
+
+def listingSize(entry):
+    """
+    Description: returns the size in bytes of a file in a LAADS archive
+    listing, or None if the listing doesn't have a valid size.
+    """
+    try:
+        return int(entry.get('size'))
+    except (TypeError, ValueError):
+        return None
+
+
+def listLads (year, doy, token=None, products=VIIRS_PRODUCTS):
+    """
+    Description: listLads gets the LAADS archive listing of the daily VIIRS
+    atmosphere files for the specified year and DOY.  The products are
+    checked in priority order and the listing of the first product available
+    for the day is returned.
+
+    Args:
+      year: year of LAADS data (integer)
+      doy: day of year of LAADS data (integer)
+      token: application token for the desired website
+      products: VIIRS products to check, in priority order
+
+    Returns:
+        (ERROR, None): error occurred while getting the listing
+        (SUCCESS, None): none of the products are available for the day
+        (SUCCESS, listing): LadsListing of the granules for the day
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    for product in products:
+        # get the list of files in the archive for this product and date.  if
+        # the directory doesn't exist then the product isn't available.
+        url = ('{}{}/{}/{}/{:03d}'
+               .format(SERVER_URL, ARCHIVE_PATH, product, year, doy))
+        try:
+            listing = geturl(url + '.csv', token)
+        except DownloadError as e:
+            if e.status_code == 404:
+                continue
+            logger.error('Unable to list LAADS {} files for doy {} year {}. '
+                         '{}'.format(product, doy, year, e))
+            return (ERROR, None)
+
+        entries = [f for f in
+                   csv.DictReader(StringIO(listing), skipinitialspace=True)
+                   if f['name'].endswith('.h5')]
+        if len(entries) != 0:
+            return (SUCCESS, LadsListing(product, url, entries))
+
+    return (SUCCESS, None)
+
+
+def downloadLads (year, doy, destination, token=None,
+                  products=VIIRS_PRODUCTS, index=None, manifest=None,
+                  skip_current=False, listing=None, cache=None,
+                  cache_link=False):
+    """
+    Description: downloadLads downloads the daily VIIRS atmosphere files for
+    the specified year and DOY into the destination directory.  The products
+    are checked in priority order and only the first product available for
+    the day is downloaded.
+
+    Args:
+      year: year of LAADS data to be downloaded (integer)
+      doy: day of year of LAADS data to be downloaded (integer)
+      destination: directory where the LAADS files will be written
+      token: application token for the desired website
+      products: VIIRS products to check, in priority order
+      index: GranuleIndex of the destination directory, updated with the
+             downloaded files
+      manifest: GranuleManifest where the downloaded files are recorded
+      skip_current: if True, don't download the day if the manifest shows
+                    its granules have already been published unchanged
+      listing: LadsListing for the day from listLads.  The listing is
+               retrieved if it isn't specified.
+      cache: GranuleCache to take the granules from if they're cached, and
+             to add the downloaded granules to
+      cache_link: hard link granules from the cache rather than copying
+                  them (only if the caller doesn't modify the files)
+
+    Returns:
+        ERROR: error occurred while downloading
+        SUCCESS: download completed successfully (or no data was available)
+        UNCHANGED: the day's granules have already been published
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    if listing is None:
+        (status, listing) = listLads (year, doy, token, products)
+        if status == ERROR:
+            return ERROR
+        if listing is None:
+            return SUCCESS
+
+    # the production time is part of the granule name, so if the same
+    # granules (and sizes) have already been published there is nothing new
+    # to download
+    if skip_current and manifest is not None and \
+            all(manifest.isCurrent(f['name'], listingSize(f),
+                                   f.get('last_modified'))
+                for f in listing.entries):
+        logger.info('LAADS {} files for doy {} year {} are unchanged. Skip.'
+                    .format(listing.product, doy, year))
+        METRICS.count('granules_unchanged', len(listing.entries))
+        return UNCHANGED
+
+    for entry in listing.entries:
+        name = entry['name']
+        path = os.path.join(destination, name)
+        url = listing.url + '/' + name
+        size = listingSize(entry)
+        info = {}
+        if cache is not None and cache.fetch(name, path, size, cache_link):
+            logger.info('Using cached {}'.format(name))
+            nbytes = os.path.getsize(path)
+            METRICS.count('granules_cached')
+        else:
+            # download to a .part file, continuing one left by an earlier
+            # run, and only give it the granule name once it's complete
+            logger.info('Downloading {}'.format(name))
+            part = path + PART_SUFFIX
+            try:
+                with open(part, 'a+b') as fh:
+                    nbytes = geturl(url, token, fh, info=info, resume=True,
+                                    size=size)
+            except DownloadError as e:
+                logger.error('Unable to download LAADS file {}. {}'
+                             .format(name, e))
+                return ERROR
+
+            if size is not None and nbytes != size:
+                logger.error('Downloaded LAADS file {} is {} bytes but the '
+                             'listing has {} bytes'.format(name, nbytes, size))
+                METRICS.count('download_size_mismatches')
+                os.remove(part)
+                return ERROR
+            os.replace(part, path)
+
+            METRICS.count('granules_downloaded')
+            if cache is not None:
+                cache.store(path, name)
+
+        if index is not None:
+            index.add(name)
+        if manifest is not None:
+            manifest.recordDownload(name, url, nbytes,
+                                    entry.get('last_modified'),
+                                    info.get('etag'))
+
+    return SUCCESS
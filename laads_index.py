@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: In-memory index of the LAADS granules in a directory.  The
+# directory is scanned once and the granules are keyed by product, year and
+# DOY, so checking for a day's files doesn't need another directory listing
+# (which is expensive on EFS).  The index is kept up to date as files are
+# downloaded into or moved out of the directory.
+############################################################################
+
+import os
+import re
+import threading
+import collections
+
+# LAADS granule names look like VJ104ANC.A2023001.002.2023002123456.h5
+# (product, year + DOY, collection, production time)
+GRANULE_RE = re.compile(r'^(?P<product>[A-Z0-9]+)\.A(?P<year>\d{4})'
+                        r'(?P<doy>\d{3})(?:\.(?P<collection>\d+))?'
+                        r'(?:\.(?P<prodtime>\d+))?.*\.h5$')
+
+Granule = collections.namedtuple('Granule', ['name', 'product', 'year', 'doy',
+                                             'collection', 'prodtime'])
+
+
+def parseGranuleName(name):
+    """
+    Description: parses a LAADS granule filename.
+
+    Args:
+      name: filename of the granule (without the directory)
+
+    Returns: Granule, or None if the name isn't a LAADS granule
+    """
+    match = GRANULE_RE.match(name)
+    if match is None:
+        return None
+
+    return Granule(name, match.group('product'), int(match.group('year')),
+                   int(match.group('doy')), match.group('collection'),
+                   match.group('prodtime'))
+
+
+class GranuleIndex(object):
+    """
+    Description: index of the LAADS granules in a directory keyed by
+    (year, DOY) and product.  The directory is listed once when the index is
+    created.  Files added to or removed from the directory afterwards need
+    to be recorded with add() and remove().  Safe to share between threads.
+
+    Args:
+      directory: directory to be indexed
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._dates = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Description: rebuilds the index from a single listing of the
+        directory.
+        """
+        dates = {}
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file():
+                    self._addName(dates, entry.name)
+
+        with self._lock:
+            self._dates = dates
+
+    @staticmethod
+    def _addName(dates, name):
+        granule = parseGranuleName(name)
+        if granule is None:
+            return
+        products = dates.setdefault((granule.year, granule.doy), {})
+        products.setdefault(granule.product, set()).add(name)
+
+    def add(self, name):
+        """
+        Description: records a file added to the directory.
+
+        Args:
+          name: filename of the granule (without the directory)
+        """
+        with self._lock:
+            self._addName(self._dates, name)
+
+    def remove(self, name):
+        """
+        Description: records a file moved or removed from the directory.
+
+        Args:
+          name: filename of the granule (without the directory)
+        """
+        granule = parseGranuleName(name)
+        if granule is None:
+            return
+
+        with self._lock:
+            products = self._dates.get((granule.year, granule.doy), {})
+            products.get(granule.product, set()).discard(name)
+
+    def find(self, products, year, doy):
+        """
+        Description: returns the granules in the directory for the year/DOY.
+
+        Args:
+          products: product name (e.g. VJ104ANC), tuple of product names, or
+                    None for any product
+          year: year of the granules (integer)
+          doy: day of year of the granules (integer)
+
+        Returns: sorted list of the matching filenames
+        """
+        if isinstance(products, str):
+            products = (products,)
+
+        with self._lock:
+            entry = self._dates.get((year, doy), {})
+            names = []
+            for (product, productNames) in entry.items():
+                if products is None or product in products:
+                    names.extend(productNames)
+
+        return sorted(names)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Advisory lease locks which work on NFS/EFS, so overlapping
+# runs of updatelads.py (e.g. the nightly --today and a --quarterly) on the
+# same LASRC_AUX_DIR divide the days between them rather than processing
+# the same day twice.  A lock is a small JSON file created with O_EXCL
+# (atomic on NFSv4) which records its owner and when its lease expires:
+#
+#     {"owner": "host.pid", "acquired": ..., "expires": ...}
+#
+# The owner renews the leases of the locks it holds in the background.  A
+# lock whose lease expired more than LOCK_GRACE seconds ago was left by a
+# run which died, and is broken by the next run which wants it.  A lock
+# held by a live run is skipped rather than waited for.
+############################################################################
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from laads_metrics import METRICS
+
+# seconds a lock is held without being renewed, and the extra seconds
+# allowed for clock differences between hosts before a lock is stale
+LOCK_LEASE = float(os.environ.get('LAADS_LOCK_LEASE', 900))
+LOCK_GRACE = 60
+
+# directory of the locks (in the directory of the data being locked)
+LOCK_DIR_NAME = '.locks'
+
+# owner of the locks taken by this process
+OWNER = '{}.{}'.format(socket.gethostname(), os.getpid())
+
+
+class LeaseLocks(object):
+    """
+    Description: the lease locks held by this process.  Safe to share
+    between threads.  The leases are renewed by a background thread while
+    any locks are held.
+
+    Args:
+      lease: seconds each lease lasts without being renewed
+      owner: owner recorded in the locks
+    """
+    def __init__(self, lease=LOCK_LEASE, owner=OWNER):
+        self.lease = lease
+        self.owner = owner
+        self._lock = threading.Lock()
+        self._held = {}         # path -> record written to the lock
+        self._io_lock = threading.Lock()    # serializes renew and release
+        self._renewer = None
+        self._stop = threading.Event()
+
+    def _record(self, acquired=None):
+        now = time.time()
+        return {'owner': self.owner,
+                'acquired': acquired if acquired is not None else now,
+                'expires': now + self.lease}
+
+    @staticmethod
+    def _read(path):
+        # returns the record of the lock, {} if it can't be parsed (e.g. its
+        # owner died while creating it) or None if it no longer exists
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _isStale(self, path, record):
+        if record:
+            expires = record.get('expires', 0)
+        else:
+            try:
+                expires = os.path.getmtime(path) + self.lease
+            except OSError:
+                return False
+        return time.time() > expires + LOCK_GRACE
+
+    def _create(self, path):
+        record = self._record()
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(record, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        return record
+
+    def _breakStale(self, path, record):
+        """
+        Description: removes a stale lock.  The lock is renamed out of the
+        way first, so only one of several runs breaking it at the same time
+        succeeds, and is put back if it was renewed in the meantime.
+
+        Returns: True if the lock is gone, False if it is held after all
+        """
+        logger = logging.getLogger(__name__)
+
+        stale = '{}.stale.{}'.format(path, self.owner)
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            # someone else broke it first
+            return True
+
+        if self._read(stale) != record:
+            try:
+                os.link(stale, path)
+            except OSError:
+                pass
+            os.remove(stale)
+            return False
+
+        os.remove(stale)
+        logger.warning('Broke the stale lock {} of {}'
+                       .format(path, record.get('owner', 'unknown')))
+        METRICS.count('locks_recovered')
+        return True
+
+    def acquire(self, path):
+        """
+        Description: takes the lock if it's free or stale.
+
+        Args:
+          path: path of the lock file
+
+        Returns: True if the lock was taken, False if a live run holds it
+        """
+        os.makedirs(os.path.dirname(path), 0o777, exist_ok=True)
+        for attempt in range(3):
+            try:
+                record = self._create(path)
+            except FileExistsError:
+                record = self._read(path)
+                if record is None:
+                    # released in the meantime
+                    continue
+                if record.get('owner') == self.owner or \
+                        not self._isStale(path, record):
+                    METRICS.count('locks_held_elsewhere')
+                    return False
+                if not self._breakStale(path, record):
+                    METRICS.count('locks_held_elsewhere')
+                    return False
+                continue
+
+            with self._lock:
+                self._held[path] = record
+                if self._renewer is None:
+                    self._stop.clear()
+                    self._renewer = threading.Thread(target=self._renew,
+                                                     daemon=True)
+                    self._renewer.start()
+            METRICS.count('locks_acquired')
+            return True
+
+        return False
+
+    def isHeld(self, path):
+        """
+        Description: returns True if this process still holds the lock,
+        i.e. its lease hasn't been lost to another run.
+        """
+        with self._lock:
+            record = self._held.get(path)
+        return record is not None and self._read(path) == record
+
+    def release(self, path):
+        """
+        Description: releases a lock held by this process.  Nothing is done
+        if the lock isn't held (or was lost).
+        """
+        with self._io_lock:
+            with self._lock:
+                record = self._held.pop(path, None)
+            if record is not None and self._read(path) == record:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def releaseAll(self):
+        """
+        Description: releases every lock held by this process and stops
+        renewing the leases.
+        """
+        with self._lock:
+            paths = list(self._held)
+        for path in paths:
+            self.release(path)
+
+        self._stop.set()
+        with self._lock:
+            renewer = self._renewer
+            self._renewer = None
+        if renewer is not None:
+            renewer.join()
+
+    def _renew(self):
+        # renew the leases a few times per lease period.  a lock whose
+        # record changed was broken by another run, so it's no longer held.
+        logger = logging.getLogger(__name__)
+
+        while not self._stop.wait(self.lease / 3.0):
+            with self._lock:
+                paths = list(self._held)
+            for path in paths:
+                with self._io_lock:
+                    self._renewLock(path, logger)
+
+    def _renewLock(self, path, logger):
+        with self._lock:
+            record = self._held.get(path)
+        if record is None:
+            # released
+            return
+
+        if self._read(path) != record:
+            logger.error('Lost the lock {}'.format(path))
+            METRICS.count('locks_lost')
+            with self._lock:
+                self._held.pop(path, None)
+            return
+
+        renewed = self._record(record['acquired'])
+        tmp = '{}.{}.tmp'.format(path, self.owner)
+        try:
+            with open(tmp, 'w') as fh:
+                json.dump(renewed, fh)
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            logger.warning('Unable to renew the lock {}: {}'.format(path, e))
+            return
+        with self._lock:
+            self._held[path] = renewed
+
+
+# locks held by this process
+LOCKS = LeaseLocks()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Persistent manifest (SQLite) of the LAADS granules which have
+# been downloaded, gap-filled and published into LADS/<year>.  updatelads.py
+# uses it to skip granules which haven't changed since they were published,
+# and it can be inspected offline instead of crawling the aux directory:
+#
+#     laads_manifest.py $LASRC_AUX_DIR/LADS/laads_manifest.db --year 2023
+#
+# The manifest is on EFS, where SQLite's file locking can't be trusted with
+# several writers (the shards of an array job, overlapping runs on other
+# hosts).  So a run works on a local copy (openWorkingCopy) and merges the
+# granules it recorded back into the shared manifest when it's done
+# (mergeWorkingCopy).  The shared manifest is only opened while holding its
+# lease lock (see laads_lock.py), and the merge also writes a snapshot of
+# it (laads_manifest.snapshot.db) which is what gets published to S3, so
+# the live database is never uploaded partway through a merge.
+############################################################################
+
+import sys
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import datetime
+import tempfile
+import threading
+import urllib.request
+
+from optparse import OptionParser
+from laads_index import parseGranuleName
+from laads_lock import LOCKS, LOCK_DIR_NAME
+
+# granule status values
+DOWNLOADED = 'downloaded'
+GAPFILLED = 'gapfilled'
+GAPFILL_FAILED = 'gapfill_failed'
+PUBLISHED = 'published'
+
+# name of the manifest in the LADS directory, unless LAADS_MANIFEST is set
+MANIFEST_NAME = 'laads_manifest.db'
+
+# seconds to wait for the lock of the shared manifest
+MANIFEST_LOCK_WAIT = float(os.environ.get('LAADS_MANIFEST_LOCK_WAIT', 600))
+
+COLUMNS = ['name', 'product', 'year', 'doy', 'collection', 'prodtime',
+           'source_url', 'size', 'last_modified', 'etag', 'checksum',
+           'published_path', 'status', 'updated']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS granules (
+    name TEXT PRIMARY KEY,
+    product TEXT,
+    year INTEGER,
+    doy INTEGER,
+    collection TEXT,
+    prodtime TEXT,
+    source_url TEXT,
+    size INTEGER,
+    last_modified TEXT,
+    etag TEXT,
+    checksum TEXT,
+    published_path TEXT,
+    status TEXT,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS granules_date ON granules (year, doy);
+'''
+
+
+def getManifestPath(auxdir):
+    """
+    Description: returns the path of the manifest for the auxiliary
+    directory.  The LAADS_MANIFEST environment variable overrides the
+    default of LADS/laads_manifest.db.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory
+
+    Returns: path of the manifest
+    """
+    return os.environ.get('LAADS_MANIFEST',
+                          os.path.join(auxdir, 'LADS', MANIFEST_NAME))
+
+
+def getSnapshotPath(path):
+    """
+    Description: returns the path of the published snapshot of a manifest,
+    e.g. LADS/laads_manifest.snapshot.db.
+    """
+    (base, ext) = os.path.splitext(path)
+    return '{}.snapshot{}'.format(base, ext)
+
+
+def getManifestLockPath(path):
+    """
+    Description: returns the path of the lease lock of a shared manifest.
+    """
+    return os.path.join(os.path.dirname(path), LOCK_DIR_NAME,
+                        '{}.lock'.format(os.path.basename(path)))
+
+
+def lockManifest(path, wait=MANIFEST_LOCK_WAIT):
+    """
+    Description: waits for the lease lock of a shared manifest.  Release it
+    with LOCKS.release.
+
+    Args:
+      path: path of the shared manifest
+      wait: seconds to wait for a run holding the lock
+
+    Returns: path of the lock
+
+    Raises:
+      IOError: the lock wasn't free within wait seconds
+    """
+    lock = getManifestLockPath(path)
+    deadline = time.monotonic() + wait
+    while not LOCKS.acquire(lock):
+        if time.monotonic() > deadline:
+            raise IOError('Timed out waiting for the lock {}'.format(lock))
+        time.sleep(1)
+
+    return lock
+
+
+def copyDatabase(source, destination):
+    """
+    Description: copies a SQLite database by dumping it as SQL into a new
+    database.  Unlike a file copy, reading it through SQLite rolls back a
+    transaction left by a writer which died partway through, so the copy
+    is consistent.  (Connection.backup would do the same, but needs Python
+    3.7.)  The copy is written to a temporary name and renamed.
+    """
+    tmp = '{}.tmp'.format(destination)
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    src = sqlite3.connect(source, timeout=60)
+    try:
+        dst = sqlite3.connect(tmp)
+        try:
+            dst.executescript('\n'.join(src.iterdump()))
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.replace(tmp, destination)
+
+
+def openWorkingCopy(path, localdir=None):
+    """
+    Description: copies the shared manifest to a local working copy and
+    opens it.  If the shared manifest doesn't exist yet but its snapshot
+    does (e.g. restored from S3), the manifest is started from the
+    snapshot.
+
+    Args:
+      path: path of the shared manifest
+      localdir: directory of the working copy (default is the system
+                temporary directory)
+
+    Returns: GranuleManifest of the working copy
+    """
+    logger = logging.getLogger(__name__)
+
+    (fd, local) = tempfile.mkstemp(prefix='laads_manifest_', suffix='.db',
+                                   dir=localdir)
+    os.close(fd)
+    try:
+        lock = lockManifest(path)
+        try:
+            snapshot = getSnapshotPath(path)
+            if not os.path.exists(path) and os.path.exists(snapshot):
+                logger.info('Starting the manifest {} from {}'
+                            .format(path, snapshot))
+                copyDatabase(snapshot, path)
+            if os.path.exists(path):
+                copyDatabase(path, local)
+        finally:
+            LOCKS.release(lock)
+    except Exception:
+        os.remove(local)
+        raise
+
+    return GranuleManifest(local)
+
+
+def mergeWorkingCopy(manifest, path):
+    """
+    Description: merges the granules recorded in a working copy since it
+    was opened into the shared manifest, and writes the snapshot of the
+    shared manifest which is published.  The working copy is closed and
+    removed.  Different runs record different days, so each granule's
+    entry simply replaces the shared one.
+
+    Args:
+      manifest: GranuleManifest of the working copy (from openWorkingCopy)
+      path: path of the shared manifest
+
+    Returns: path of the snapshot
+    """
+    rows = [manifest.get(name) for name in manifest.changed()]
+    manifest.close()
+
+    snapshot = getSnapshotPath(path)
+    lock = lockManifest(path)
+    try:
+        conn = sqlite3.connect(path, timeout=60)
+        try:
+            with conn:
+                conn.executescript(SCHEMA)
+                conn.executemany(
+                    'INSERT OR REPLACE INTO granules ({}) VALUES ({})'
+                    .format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    [[row[k] for k in COLUMNS] for row in rows])
+        finally:
+            conn.close()
+        copyDatabase(path, snapshot)
+    finally:
+        LOCKS.release(lock)
+
+    os.remove(manifest.path)
+    return snapshot
+
+
+def fileChecksum(path, blocksize=1024*1024):
+    """
+    Description: returns the SHA-256 checksum (hex) of the file.
+
+    Args:
+      path: file to checksum
+      blocksize: number of bytes to read at a time
+
+    Returns: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(blocksize), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class GranuleManifest(object):
+    """
+    Description: SQLite manifest of processed LAADS granules, one row per
+    granule name.  The connection is shared between threads, so all access
+    goes through a lock.  The names of the granules recorded since it was
+    opened are kept for mergeWorkingCopy.
+
+    Args:
+      path: path of the SQLite database (created if it doesn't exist)
+      readonly: if True, open an existing database without writing to it
+                (not even the schema), e.g. for a dry run
+    """
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._changed = set()
+        if readonly:
+            uri = 'file:{}?mode=ro'.format(
+                urllib.request.pathname2url(os.path.abspath(path)))
+            self._conn = sqlite3.connect(uri, uri=True, timeout=60,
+                                         check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, timeout=60,
+                                         check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if not readonly:
+            with self._conn:
+                self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def changed(self):
+        """
+        Description: returns the names of the granules recorded since the
+        manifest was opened.
+        """
+        with self._lock:
+            return sorted(self._changed)
+
+    def _upsert(self, name, **values):
+        # insert the granule if it's new, then update the specified columns
+        granule = parseGranuleName(name)
+        values['updated'] = datetime.datetime.now(
+            datetime.timezone.utc).isoformat()
+        columns = ', '.join('{} = ?'.format(k) for k in values)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO granules '
+                '(name, product, year, doy, collection, prodtime) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (name,
+                 granule.product if granule else None,
+                 granule.year if granule else None,
+                 granule.doy if granule else None,
+                 granule.collection if granule else None,
+                 granule.prodtime if granule else None))
+            self._conn.execute(
+                'UPDATE granules SET {} WHERE name = ?'.format(columns),
+                list(values.values()) + [name])
+            self._changed.add(name)
+
+    def recordDownload(self, name, source_url, size, last_modified=None,
+                       etag=None):
+        """
+        Description: records a granule downloaded from LAADS.
+
+        Args:
+          name: filename of the granule
+          source_url: URL the granule was downloaded from
+          size: size of the downloaded granule in bytes
+          last_modified: modification time reported by LAADS
+          etag: ETag reported by LAADS
+        """
+        self._upsert(name, source_url=source_url, size=size,
+                     last_modified=last_modified, etag=etag,
+                     status=DOWNLOADED)
+
+    def setStatus(self, name, status):
+        """
+        Description: updates the processing status of a granule.
+        """
+        self._upsert(name, status=status)
+
+    def recordPublished(self, name, published_path, checksum):
+        """
+        Description: records a gap-filled granule published into the
+        auxiliary directory.
+
+        Args:
+          name: filename of the granule
+          published_path: path of the published granule
+          checksum: SHA-256 checksum of the published granule
+        """
+        self._upsert(name, published_path=published_path, checksum=checksum,
+                     status=PUBLISHED)
+
+    def get(self, name):
+        """
+        Description: returns the manifest entry for the granule as a dict,
+        or None if the granule isn't in the manifest.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM granules WHERE name = ?',
+                                     (name,)).fetchone()
+
+        return dict(row) if row is not None else None
+
+    def isCurrent(self, name, size=None, last_modified=None, etag=None):
+        """
+        Description: returns True if the granule has already been published,
+        its published file still exists and the size, modification time and
+        ETag of the granule on LAADS match the ones recorded when it was
+        downloaded.  Values which are None (or weren't recorded) aren't
+        compared.  The production time is part of the granule name, so a
+        reprocessed granule is never current.
+
+        Args:
+          name: filename of the granule
+          size: size of the granule on LAADS in bytes
+          last_modified: modification time of the granule on LAADS
+          etag: ETag of the granule on LAADS
+        """
+        entry = self.get(name)
+        if entry is None or entry['status'] != PUBLISHED:
+            return False
+        if size is not None and entry['size'] is not None and \
+                entry['size'] != int(size):
+            return False
+        if last_modified and entry['last_modified'] and \
+                entry['last_modified'] != last_modified:
+            return False
+        if etag and entry['etag'] and entry['etag'] != etag:
+            return False
+
+        return os.path.exists(entry['published_path'] or '')
+
+    def adoptPublished(self, name, source_url, size, last_modified,
+                       published_path):
+        """
+        Description: records a granule which was published before the
+        manifest existed (or without it), using the LAADS listing for the
+        source information.  No checksum is recorded.
+
+        Args:
+          name: filename of the granule
+          source_url: URL of the granule on LAADS
+          size: size of the granule on LAADS in bytes
+          last_modified: modification time of the granule on LAADS
+          published_path: path of the published granule
+        """
+        self._upsert(name, source_url=source_url, size=size,
+                     last_modified=last_modified,
+                     published_path=published_path, status=PUBLISHED)
+
+    def select(self, year=None, doy=None, status=None):
+        """
+        Description: returns the manifest entries (dicts) matching the
+        optional year, DOY and status, ordered by name.
+        """
+        clauses = []
+        params = []
+        for (column, value) in (('year', year), ('doy', doy),
+                                ('status', status)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                params.append(value)
+
+        sql = 'SELECT * FROM granules'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY name'
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [dict(row) for row in rows]
+
+
+def main ():
+    """
+    Description: prints the manifest entries as tab-separated values.
+    """
+    parser = OptionParser(usage='%prog [options] manifest')
+    parser.add_option ('-y', '--year', type='int', dest='year', default=None,
+        help='only list granules for this year')
+    parser.add_option ('-d', '--doy', type='int', dest='doy', default=None,
+        help='only list granules for this day of year')
+    parser.add_option ('--status', dest='status', default=None,
+        help='only list granules with this status')
+
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('the manifest path is required')
+    if not os.path.exists(args[0]):
+        parser.error('{} does not exist'.format(args[0]))
+
+    manifest = GranuleManifest(args[0], readonly=True)
+    print('\t'.join(COLUMNS))
+    for entry in manifest.select(options.year, options.doy, options.status):
+        print('\t'.join('' if entry[k] is None else str(entry[k])
+                        for k in COLUMNS))
+    manifest.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Run metrics of updatelads.py and
+# generate_monthly_climatology.py: per-stage timing histograms (download,
+# gap-fill, publish, ...), and counters of requests, bytes, retries and
+# files processed or skipped.  At the end of a run the metrics are written
+# to LAADS_METRICS_DIR (default $LASRC_AUX_DIR/metrics) as
+#
+#     <job>_metrics.json   summary of the run
+#     <job>.prom           Prometheus textfile collector format
+#
+# so they are shipped to S3 along with the auxiliary data.
+############################################################################
+
+import os
+import json
+import time
+import datetime
+import threading
+import contextlib
+
+# upper bounds (seconds) of the stage duration histogram buckets
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300,
+                     600, 1800)
+
+# prefix of the Prometheus metric names
+PREFIX = 'laads'
+
+METRICS_DIR_NAME = 'metrics'
+
+
+def getMetricsDir(auxdir):
+    """
+    Description: returns the directory where the run metrics are written.
+    The LAADS_METRICS_DIR environment variable overrides the default of
+    metrics in the auxiliary directory.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory
+
+    Returns: path of the metrics directory
+    """
+    return os.environ.get('LAADS_METRICS_DIR',
+                          os.path.join(auxdir, METRICS_DIR_NAME))
+
+
+class RunMetrics(object):
+    """
+    Description: thread-safe counters and stage duration histograms of a
+    run.  Counters can have labels (e.g. the HTTP status of retries).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._start = time.monotonic()
+        self.counters = {}      # (name, labels) -> value
+        self.stages = {}        # stage -> [bucket counts..., sum, count]
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def count(self, name, value=1, labels=None):
+        """
+        Description: adds to a counter.
+
+        Args:
+          name: counter name (e.g. files_published)
+          value: amount to add
+          labels: dict of label names to values
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds):
+        """
+        Description: records the duration of one pass through a stage.
+        """
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = [0] * len(HISTOGRAM_BUCKETS) + [0.0, 0]
+                self.stages[stage] = hist
+            for (i, bound) in enumerate(HISTOGRAM_BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """
+        Description: context manager which records the time spent in the
+        block as a pass through the stage.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+
+    def reset(self):
+        """
+        Description: clears the counters and histograms, e.g. in a worker
+        process before each task so its snapshot only covers that task.
+        """
+        with self._lock:
+            self.counters = {}
+            self.stages = {}
+
+    def snapshot(self):
+        """
+        Description: returns a copy of the metrics which can be pickled,
+        e.g. to return them from a worker process.
+        """
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'stages': dict((k, list(v))
+                                   for (k, v) in self.stages.items())}
+
+    def merge(self, snapshot):
+        """
+        Description: adds the metrics of a snapshot (e.g. from a worker
+        process) to these metrics.
+        """
+        with self._lock:
+            for (key, value) in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for (stage, other) in snapshot['stages'].items():
+                hist = self.stages.setdefault(stage, [0] * len(other))
+                for (i, value) in enumerate(other):
+                    hist[i] += value
+
+    def toDict(self, job, status):
+        """
+        Description: returns the JSON summary of the run.
+
+        Args:
+          job: name of the run (e.g. updatelads)
+          status: exit status of the run (0 is success)
+        """
+        snapshot = self.snapshot()
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for ((name, labels), value)
+                    in sorted(snapshot['counters'].items(),
+                              key=lambda x: (x[0][0], str(x[0][1])))]
+        stages = {}
+        for (stage, hist) in sorted(snapshot['stages'].items()):
+            stages[stage] = {
+                'count': hist[-1],
+                'total_s': round(hist[-2], 3),
+                'mean_s': round(hist[-2] / hist[-1], 3) if hist[-1] else 0,
+                'buckets': dict(zip([str(b) for b in HISTOGRAM_BUCKETS],
+                                    hist[:-2])),
+            }
+
+        return {
+            'job': job,
+            'status': status,
+            'started': datetime.datetime.fromtimestamp(
+                self.started, datetime.timezone.utc).isoformat(),
+            'duration_s': round(time.monotonic() - self._start, 3),
+            'counters': counters,
+            'stages': stages,
+        }
+
+    def toPrometheus(self, job, status):
+        """
+        Description: returns the metrics of the run in the Prometheus text
+        exposition format.
+        """
+        summary = self.toDict(job, status)
+        job_label = 'job="{}"'.format(job)
+        lines = []
+
+        def metric(name, kind, helptext):
+            lines.append('# HELP {}_{} {}'.format(PREFIX, name, helptext))
+            lines.append('# TYPE {}_{} {}'.format(PREFIX, name, kind))
+
+        metric('run_success', 'gauge', '1 if the last run succeeded')
+        lines.append('{}_run_success{{{}}} {}'
+                     .format(PREFIX, job_label, 1 if status == 0 else 0))
+        metric('run_duration_seconds', 'gauge', 'duration of the last run')
+        lines.append('{}_run_duration_seconds{{{}}} {}'
+                     .format(PREFIX, job_label, summary['duration_s']))
+        metric('run_timestamp_seconds', 'gauge', 'start time of the last run')
+        lines.append('{}_run_timestamp_seconds{{{}}} {:.0f}'
+                     .format(PREFIX, job_label, self.started))
+
+        declared = set()
+        for counter in summary['counters']:
+            name = '{}_total'.format(counter['name'])
+            if name not in declared:
+                metric(name, 'counter', counter['name'].replace('_', ' '))
+                declared.add(name)
+            labels = [job_label] + ['{}="{}"'.format(k, v) for (k, v)
+                                    in sorted(counter['labels'].items())]
+            lines.append('{}_{}{{{}}} {}'.format(PREFIX, name,
+                                                 ','.join(labels),
+                                                 counter['value']))
+
+        if summary['stages']:
+            metric('stage_seconds', 'histogram',
+                   'duration of each pass through a stage of the run')
+        for (stage, hist) in sorted(self.snapshot()['stages'].items()):
+            labels = '{},stage="{}"'.format(job_label, stage)
+            for (bound, value) in zip(HISTOGRAM_BUCKETS, hist[:-2]):
+                lines.append('{}_stage_seconds_bucket{{{},le="{}"}} {}'
+                             .format(PREFIX, labels, bound, value))
+            lines.append('{}_stage_seconds_bucket{{{},le="+Inf"}} {}'
+                         .format(PREFIX, labels, hist[-1]))
+            lines.append('{}_stage_seconds_sum{{{}}} {:.3f}'
+                         .format(PREFIX, labels, hist[-2]))
+            lines.append('{}_stage_seconds_count{{{}}} {}'
+                         .format(PREFIX, labels, hist[-1]))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory, job, status):
+        """
+        Description: writes <job>_metrics.json and <job>.prom to the
+        directory.  The files are written to temporary names and renamed
+        so readers never see a partial file.
+
+        Args:
+          directory: metrics directory (created if it doesn't exist)
+          job: name of the run (e.g. updatelads)
+          status: exit status of the run (0 is success)
+
+        Returns: list of the files written
+        """
+        os.makedirs(directory, 0o777, exist_ok=True)
+        outputs = (('{}_metrics.json'.format(job),
+                    json.dumps(self.toDict(job, status), indent=2) + '\n'),
+                   ('{}.prom'.format(job), self.toPrometheus(job, status)))
+        written = []
+        for (name, text) in outputs:
+            path = os.path.join(directory, name)
+            tmp = '{}.tmp'.format(path)
+            with open(tmp, 'w') as fh:
+                fh.write(text)
+            os.rename(tmp, path)
+            written.append(path)
+
+        return written
+
+
+# metrics of this run
+METRICS = RunMetrics()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+############################################################################
+# Description: Incremental publish of the auxiliary data to S3.
+# updatelads.py and generate_monthly_climatology.py record every file they
+# write in a publish list (one path per line) and this script uploads only
+# those files, in parallel and as multipart transfers, instead of running
+# aws s3 sync over the whole auxiliary tree:
+#
+#     laads_publish.py --bucket $LAADS_BUCKET $LASRC_AUX_DIR/.publish/*.txt
+#
+# Each run writes its own list, LAADS_PUBLISH_DIR/<job>.<host>.<pid>.txt
+# (default LAADS_PUBLISH_DIR is $LASRC_AUX_DIR/.publish), so overlapping
+# runs don't share a list.  The lists are on the auxiliary directory (EFS)
+# so they outlive the container: a list is removed once all its files are
+# uploaded, and one left by a run whose upload failed, or whose container
+# died, is uploaded by the next run along with its own.
+#
+# The S3 keys are the paths relative to LASRC_AUX_DIR under --prefix
+# (default lasrc_aux), the same keys aws s3 sync would use.
+#
+# Set LAADS_S3_ENDPOINT_URL to publish to a local S3-compatible server
+# (e.g. MinIO) for testing.
+############################################################################
+
+import sys
+import os
+import socket
+import logging
+import threading
+import subprocess
+import concurrent.futures
+
+from optparse import OptionParser
+
+# boto3 is optional.  without it each file is uploaded with the aws cli.
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = None
+
+ERROR = 1
+SUCCESS = 0
+
+# name of the directory of the publish lists in the auxiliary directory
+PUBLISH_DIR_NAME = '.publish'
+
+# S3 endpoint, for a local S3-compatible server
+S3_ENDPOINT_URL = os.environ.get('LAADS_S3_ENDPOINT_URL')
+
+# number of files uploaded concurrently, and the multipart settings of each
+# upload
+UPLOAD_WORKERS = int(os.environ.get('LAADS_UPLOAD_WORKERS', 8))
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+
+
+def getPublishDir(auxdir):
+    """
+    Description: returns the directory of the publish lists.  The
+    LAADS_PUBLISH_DIR environment variable overrides the default of .publish
+    in the auxiliary directory.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory
+
+    Returns: path of the publish list directory
+    """
+    return os.environ.get('LAADS_PUBLISH_DIR',
+                          os.path.join(auxdir, PUBLISH_DIR_NAME))
+
+
+def getPublishListPath(job, auxdir):
+    """
+    Description: returns the path of the publish list of this run of the
+    job.  The host and process ID keep the lists of overlapping runs apart.
+
+    Args:
+      job: name of the run (e.g. updatelads)
+      auxdir: name of the base LASRC_SR auxiliary directory
+    """
+    return os.path.join(getPublishDir(auxdir), '{}.{}.{}.txt'
+                        .format(job, socket.gethostname(), os.getpid()))
+
+
+def readPublishList(path):
+    """
+    Description: returns the file paths in a publish list, or an empty list
+    if the publish list doesn't exist.
+    """
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+class PublishList(object):
+    """
+    Description: thread-safe list of the files written during a run, in the
+    order they were first written.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+
+    def record(self, path):
+        """
+        Description: records a file which has been written.
+        """
+        with self._lock:
+            self._paths.setdefault(os.path.abspath(path), None)
+
+    def extend(self, paths):
+        """
+        Description: records several files, e.g. those written by a worker
+        process.
+        """
+        for path in paths:
+            self.record(path)
+
+    def paths(self):
+        with self._lock:
+            return list(self._paths)
+
+    def reset(self):
+        with self._lock:
+            self._paths = {}
+
+    def write(self, job, auxdir):
+        """
+        Description: adds the recorded files to the publish list of this
+        run of the job.
+
+        Args:
+          job: name of the run (e.g. updatelads)
+          auxdir: name of the base LASRC_SR auxiliary directory
+
+        Returns: path of the publish list
+        """
+        path = getPublishListPath(job, auxdir)
+        os.makedirs(os.path.dirname(path), 0o777, exist_ok=True)
+
+        paths = dict((p, None) for p in readPublishList(path))
+        for p in self.paths():
+            paths.setdefault(p, None)
+
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'w') as fh:
+            for p in paths:
+                fh.write('{}\n'.format(p))
+        os.rename(tmp, path)
+        return path
+
+
+# files written by this run
+PUBLISHED = PublishList()
+
+
+def s3Key(path, auxdir, prefix):
+    """
+    Description: returns the S3 key of a file in the auxiliary directory,
+    or None if the file isn't in the auxiliary directory.
+    """
+    relpath = os.path.relpath(os.path.abspath(path), os.path.abspath(auxdir))
+    if relpath.startswith(os.pardir):
+        return None
+
+    return '/'.join([p for p in prefix.split('/') if p] +
+                    relpath.split(os.sep))
+
+
+def uploadFiles(paths, auxdir, bucket, prefix='lasrc_aux',
+                workers=UPLOAD_WORKERS, endpoint_url=S3_ENDPOINT_URL):
+    """
+    Description: uploads files from the auxiliary directory to S3, several
+    at a time.  Large files are uploaded in parts.
+
+    Args:
+      paths: files to upload
+      auxdir: name of the base LASRC_SR auxiliary directory
+      bucket: S3 bucket
+      prefix: key prefix of the auxiliary directory in the bucket
+      workers: number of files to upload concurrently
+      endpoint_url: S3 endpoint (None for AWS)
+
+    Returns:
+        (ERROR, uploaded): some of the files failed to upload
+        (SUCCESS, uploaded): all the files were uploaded (or no longer
+                             exist).  uploaded is the number of files.
+    """
+    logger = logging.getLogger(__name__)
+
+    if boto3 is not None:
+        client = boto3.client('s3', endpoint_url=endpoint_url)
+        config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                                multipart_chunksize=MULTIPART_CHUNKSIZE,
+                                max_concurrency=MULTIPART_CONCURRENCY)
+
+    def upload(path):
+        key = s3Key(path, auxdir, prefix)
+        if key is None:
+            logger.warning('{} is not in {}. Not publishing it.'
+                           .format(path, auxdir))
+            return None
+        if not os.path.exists(path):
+            # replaced or removed by a later run
+            logger.info('{} no longer exists. Skip.'.format(path))
+            return None
+
+        logger.info('Uploading {} to s3://{}/{}'.format(path, bucket, key))
+        try:
+            if boto3 is not None:
+                client.upload_file(path, bucket, key, Config=config)
+            else:
+                cmd = ['aws', 's3', 'cp', '--only-show-errors', path,
+                       's3://{}/{}'.format(bucket, key)]
+                if endpoint_url:
+                    cmd.extend(['--endpoint-url', endpoint_url])
+                subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            logger.error('Unable to upload {}: {}'
+                         .format(path, e.output.decode(errors='replace')))
+            return False
+        except Exception as e:
+            logger.error('Unable to upload {}: {}'.format(path, e))
+            return False
+
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) \
+            as executor:
+        results = list(executor.map(upload, paths))
+
+    uploaded = results.count(True)
+    if False in results:
+        return (ERROR, uploaded)
+
+    return (SUCCESS, uploaded)
+
+
+def main ():
+    logger = logging.getLogger(__name__)
+
+    parser = OptionParser(usage='%prog [options] publish_list ...')
+    parser.add_option ('-b', '--bucket', dest='bucket', default=None,
+        help='S3 bucket to publish to')
+    parser.add_option ('-p', '--prefix', dest='prefix', default='lasrc_aux',
+        help='key prefix of the auxiliary directory (default is lasrc_aux)')
+    parser.add_option ('--workers', type='int', dest='workers',
+        default=UPLOAD_WORKERS,
+        help='number of files to upload concurrently (default is {})'
+             .format(UPLOAD_WORKERS))
+    parser.add_option ('--endpoint_url', dest='endpoint_url',
+        default=S3_ENDPOINT_URL,
+        help='S3 endpoint URL, e.g. of a local S3-compatible server')
+    parser.add_option ('--keep', dest='keep', default=False,
+        action='store_true',
+        help='keep the publish lists after a successful upload')
+
+    (options, args) = parser.parse_args()
+    if options.bucket is None or len(args) == 0:
+        parser.error('the bucket and at least one publish list are required')
+    if options.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    auxdir = os.environ.get('LASRC_AUX_DIR')
+    if auxdir is None:
+        msg = 'LASRC_AUX_DIR environment variable not set... exiting'
+        logger.error(msg)
+        return ERROR
+
+    paths = {}
+    for publish_list in args:
+        for path in readPublishList(publish_list):
+            paths.setdefault(path, None)
+    paths = list(paths)
+
+    (status, uploaded) = uploadFiles(paths, auxdir, options.bucket,
+                                     options.prefix, options.workers,
+                                     options.endpoint_url)
+    msg = ('Published {} of {} files to s3://{}/{}'
+           .format(uploaded, len(paths), options.bucket, options.prefix))
+    logger.info(msg)
+    if status == ERROR:
+        logger.error('Some files failed to upload. The publish lists are '
+                     'kept so they are uploaded by the next run.')
+        return ERROR
+
+    if not options.keep:
+        for publish_list in args:
+            if os.path.exists(publish_list):
+                os.remove(publish_list)
+
+    return SUCCESS
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format=('%(asctime)s.%(msecs)03d %(process)d'
+                                ' %(levelname)-8s'
+                                ' %(filename)s:%(lineno)d:'
+                                '%(funcName)s -- %(message)s'),
+                        datefmt='%Y-%m-%d %H:%M:%S',
+                        level=logging.INFO)
+    sys.exit(main())
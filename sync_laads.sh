@@ -27,16 +27,53 @@ if [ -n "$LAADS_BUCKET_BOOTSTRAP" ]; then
   aws s3 sync "s3://$LAADS_BUCKET_BOOTSTRAP/lasrc_aux/" .
 fi
 
+# cache of raw LAADS granules shared by the updatelads and climatology jobs.
+# it is set in the job definition (production uses $LASRC_AUX_DIR/laads_cache
+# on EFS); without LAADS_CACHE_DIR every granule is downloaded from LAADS.
+if [ -n "$LAADS_CACHE_DIR" ]; then
+  echo "LAADS granule cache is $LAADS_CACHE_DIR (budget ${LAADS_CACHE_SIZE:-10737418240} bytes)"
+else
+  echo "LAADS granule cache is disabled (LAADS_CACHE_DIR is not set)"
+fi
+
+# run metrics (timings, bytes, retries) written by updatelads.py
+metrics_directory="${LAADS_METRICS_DIR:-$LASRC_AUX_DIR/metrics}"
+
+# publish lists of the files written by the runs, kept on EFS so a list
+# left by a failed run or upload is published by the next run
+publish_directory="${LAADS_PUBLISH_DIR:-$LASRC_AUX_DIR/.publish}"
+
 echo "running updatelads.py $LAADS_FLAG"
+status=0
 if ! updatelads.py "$LAADS_FLAG"; then
+    status=1
     echo "updatelads.py failed"
     echo "sync current /tmp/lads to s3://hls-debug-output/laads_error to debug"
     aws s3 sync /tmp/lads "s3://hls-debug-output/laads_error/${AWS_BATCH_JOB_ID}/"
-    exit 1
+    if [ -d "$metrics_directory" ]; then
+      aws s3 sync "$metrics_directory" "s3://hls-debug-output/laads_error/${AWS_BATCH_JOB_ID}/metrics/"
+    fi
 fi
 
 
+# the days a failed run did publish into LADS/<year> are complete, so they
+# are uploaded too (then the job still fails)
 if [ -n "$LAADS_BUCKET" ]; then
-  echo "Syncing data to s3 bucket s3://$LAADS_BUCKET/lasrc_aux/"
-  aws s3 sync "$LASRC_AUX_DIR" "s3://$LAADS_BUCKET/lasrc_aux/"
+  # upload only the files listed by this run and any earlier runs whose
+  # upload failed, unless a full sync is requested.  a shard of an array job
+  # lists its files in updatelads_shard_<i>_of_<N>.<host>.<pid>.txt.
+  publish_lists=$(ls "$publish_directory"/updatelads*.txt 2>/dev/null)
+  if [ -z "$LAADS_FULL_SYNC" ] && [ -n "$publish_lists" ]; then
+    echo "Publishing the files in" $publish_lists "to s3://$LAADS_BUCKET/lasrc_aux/"
+    laads_publish.py --bucket "$LAADS_BUCKET" --prefix lasrc_aux $publish_lists || exit 1
+  else
+    echo "Syncing data to s3 bucket s3://$LAADS_BUCKET/lasrc_aux/"
+    aws s3 sync "$LASRC_AUX_DIR" "s3://$LAADS_BUCKET/lasrc_aux/" --exclude "*/.staging/*" --exclude "*/.locks/*" --exclude ".publish/*" --exclude "laads_cache/*" --exclude "*monthly_sums_*" --exclude "LADS/laads_manifest.db*" || exit 1
+  fi
+  if [ -d "$metrics_directory" ]; then
+    echo "Syncing run metrics to s3://$LAADS_BUCKET/lasrc_aux/metrics/"
+    aws s3 sync "$metrics_directory" "s3://$LAADS_BUCKET/lasrc_aux/metrics/"
+  fi
 fi
+
+exit $status
@@ -0,0 +1,79 @@
+############################################################################
+# Description: Shared fixtures of the tests.  The scripts are flat modules
+# (installed into /usr/local/bin by the Dockerfile), so the repository and
+# benchmarks directories are put on the path to import them, and the
+# LAADS stand-in server from the benchmarks serves the archive.
+############################################################################
+
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+def unavailable(*args, **kwargs):
+    raise RuntimeError('the ESPA modules are not available in the tests')
+
+
+# updatelads.py and generate_monthly_climatology.py import the ESPA
+# config_utils and api_interface modules of the hls-base image, which are
+# only used to look up the token when LAADS_TOKEN isn't set.  Outside the
+# image they are replaced with modules whose functions raise.
+for (module_name, function_name) in (('config_utils', 'retrieve_cfg'),
+                                     ('api_interface', 'api_connect')):
+    try:
+        __import__(module_name)
+    except ImportError:
+        module = types.ModuleType(module_name)
+        setattr(module, function_name, unavailable)
+        sys.modules[module_name] = module
+
+from laads_server import startServer, DEFAULT_TOKEN
+import laads_client
+
+# size of the template granule served by the stand-in server
+TEMPLATE_SIZE = 3 * 1024 * 1024 + 123
+
+
+@pytest.fixture(scope='session')
+def template(tmp_path_factory):
+    """
+    Description: a template granule of random bytes (the server doesn't
+    need a valid HDF5 file).
+    """
+    path = tmp_path_factory.mktemp('templates') / 'template.h5'
+    path.write_bytes(os.urandom(TEMPLATE_SIZE))
+    return str(path)
+
+
+@pytest.fixture
+def laads(template, monkeypatch):
+    """
+    Description: starts a stand-in LAADS server and points laads_client at
+    it.  Call the fixture with the LaadsServer settings (error_rate,
+    truncate_rate, ...) to get the running server.
+    """
+    servers = []
+
+    def start(**settings):
+        server = startServer([template], **settings)
+        servers.append(server)
+        monkeypatch.setattr(laads_client, 'SERVER_URL', server.url)
+        return server
+
+    yield start
+
+    laads_client.closeSession()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def token():
+    return DEFAULT_TOKEN
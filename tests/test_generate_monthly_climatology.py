@@ -0,0 +1,284 @@
+############################################################################
+# Description: Tests of the monthly climatology.  generate_monthly_climatology
+# writes the averages with GDAL, so these tests are skipped without it.
+############################################################################
+
+import os
+import zipfile
+
+import numpy
+import pytest
+
+pytest.importorskip('osgeo')
+
+import generate_monthly_climatology
+from generate_monthly_climatology import SdsAccumulator, MonthlySums, \
+    OZONE_SDS, WV_SDS, SUCCESS, ERROR, aggregateMonth, readViirsAux, \
+    writeMonthBlocks, writeResults
+from osgeo import gdal
+
+
+def dailyGrids(count, shape=(6, 8), high=256, dtype=numpy.uint8, seed=0):
+    """
+    Description: returns random daily grids with some fill (zero) pixels.
+    """
+    rng = numpy.random.RandomState(seed)
+    grids = []
+    for i in range(count):
+        grid = rng.randint(1, high, shape).astype(dtype)
+        grid[rng.random_sample(shape) < 0.3] = 0
+        grids.append(grid)
+    return grids
+
+
+def granuleName(doy, prodtime=2):
+    return 'VJ104ANC.A2023{:03d}.002.2023{:03d}123456.h5'.format(doy,
+                                                                doy+prodtime)
+
+
+def monthlySums(days, seed=0):
+    """
+    Description: returns MonthlySums of random ozone and water vapor grids
+    for the days, and the grids added for each day.
+    """
+    oz = dailyGrids(days, seed=seed)
+    wv = dailyGrids(days, high=65536, dtype=numpy.uint16, seed=seed+1)
+    sums = MonthlySums()
+    images = {}
+    for doy in range(1, days+1):
+        images[doy] = {OZONE_SDS: oz[doy-1], WV_SDS: wv[doy-1]}
+        sums.addGranule(doy, granuleName(doy), images[doy])
+    return (sums, images)
+
+
+def expectedAverage(grids):
+    """
+    Description: the average of the good (non-zero) pixels of each grid
+    cell, or zero where there are none, computed from the whole stack.
+    """
+    stack = numpy.array(grids, dtype=numpy.float64)
+    count = (stack > 0).sum(axis=0)
+    average = numpy.zeros(stack.shape[1:])
+    numpy.divide(stack.sum(axis=0), count, out=average, where=count > 0)
+    return average
+
+
+def test_accumulator_averages_the_good_pixels():
+    grids = dailyGrids(31, high=65536, dtype=numpy.uint16)
+    accumulator = SdsAccumulator()
+    accumulator.addAll(iter(grids))
+
+    assert accumulator.nfiles == 31
+    assert accumulator.total.dtype == numpy.uint64
+    assert accumulator.count.dtype == numpy.uint8
+    assert (accumulator.count == sum(g > 0 for g in grids)).all()
+    assert numpy.allclose(accumulator.average(), expectedAverage(grids))
+
+
+def test_accumulator_pixel_without_good_days_is_zero():
+    grids = dailyGrids(3)
+    for grid in grids:
+        grid[0, 0] = 0
+
+    accumulator = SdsAccumulator()
+    accumulator.addAll(grids)
+    assert accumulator.count[0, 0] == 0
+    assert accumulator.average()[0, 0] == 0
+
+
+def test_accumulator_remove_undoes_add():
+    grids = dailyGrids(4)
+    accumulator = SdsAccumulator()
+    accumulator.addAll(grids)
+
+    accumulator.remove(grids[1])
+    assert accumulator.nfiles == 3
+    rest = [grids[0], grids[2], grids[3]]
+    assert (accumulator.count == sum(g > 0 for g in rest)).all()
+    assert numpy.allclose(accumulator.average(), expectedAverage(rest))
+
+
+def test_monthly_sums_round_trip(tmp_path):
+    (sums, images) = monthlySums(31)
+    path = str(tmp_path / 'monthly_sums_2023_01.npz')
+    sums.save(path)
+
+    # the sums are saved compressed, at their smallest exact sizes
+    with zipfile.ZipFile(path) as npz:
+        assert all(info.compress_type == zipfile.ZIP_DEFLATED
+                   for info in npz.infolist())
+    with numpy.load(path) as data:
+        assert data['oz_total'].dtype == numpy.uint32
+        assert data['wv_total'].dtype == numpy.uint32
+        assert data['oz_count'].dtype == numpy.uint8
+        assert data['wv_count'].dtype == numpy.uint8
+
+    loaded = MonthlySums.load(path)
+    assert loaded.granules == sums.granules
+    for sds_name in (OZONE_SDS, WV_SDS):
+        (saved, restored) = (sums.getAccumulator(sds_name),
+                             loaded.getAccumulator(sds_name))
+        assert restored.total.dtype == numpy.uint64
+        assert (restored.total == saved.total).all()
+        assert (restored.count == saved.count).all()
+        assert restored.nfiles == 31
+        grids = [images[doy][sds_name] for doy in range(1, 32)]
+        assert numpy.allclose(restored.average(), expectedAverage(grids))
+
+
+def test_missing_or_unreadable_sums(tmp_path):
+    assert MonthlySums.load(str(tmp_path / 'missing.npz')) is None
+
+    path = tmp_path / 'monthly_sums_2023_01.npz'
+    path.write_bytes(b'not an npz file')
+    assert MonthlySums.load(str(path)) is None
+
+
+def test_replaced_granule_updates_the_sums(tmp_path):
+    (sums, images) = monthlySums(5)
+    path = str(tmp_path / 'monthly_sums_2023_01.npz')
+    sums.save(path)
+
+    # day 3 is reprocessed on LAADS
+    sums = MonthlySums.load(path)
+    replacement = {OZONE_SDS: dailyGrids(1, seed=10)[0],
+                   WV_SDS: dailyGrids(1, high=65536, dtype=numpy.uint16,
+                                      seed=11)[0]}
+    sums.removeGranule(3, images[3])
+    sums.addGranule(3, granuleName(3, prodtime=40), replacement)
+
+    images[3] = replacement
+    assert sums.granules[3] == granuleName(3, prodtime=40)
+    assert sums.oz.nfiles == 5
+    for sds_name in (OZONE_SDS, WV_SDS):
+        grids = [images[doy][sds_name] for doy in range(1, 6)]
+        assert numpy.allclose(sums.getAccumulator(sds_name).average(),
+                              expectedAverage(grids))
+
+
+def test_merge_widens_the_counts():
+    # twelve months of a pixel which is good every day overflow uint8
+    months = []
+    for month in range(12):
+        accumulator = SdsAccumulator()
+        accumulator.addAll([numpy.full((2, 2), 100, numpy.uint8)] * 31)
+        months.append(accumulator)
+
+    merged = SdsAccumulator()
+    for accumulator in months:
+        merged.merge(accumulator)
+    assert merged.count.dtype == numpy.uint32
+    assert (merged.count == 12 * 31).all()
+    assert merged.nfiles == 12 * 31
+    assert (merged.average() == 100).all()
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """
+    Description: captures the averages passed to writeResults, by output
+    basename, instead of writing them.
+    """
+    written = {}
+
+    def writeResults(auxData, outputBase, imageType, bandDesc, formats):
+        written[os.path.basename(outputBase)] = auxData
+
+    monkeypatch.setattr(generate_monthly_climatology, 'writeResults',
+                        writeResults)
+    return written
+
+
+def test_aggregate_month_combines_the_saved_sums(tmp_path, written):
+    auxdir = str(tmp_path)
+    images = {}
+    # 2021 has no saved sums and is skipped
+    for (year, seed) in ((2020, 0), (2022, 10)):
+        (sums, images[year]) = monthlySums(31, seed=seed)
+        os.makedirs(os.path.join(auxdir, 'monthly_avgs', str(year)))
+        sums.save(os.path.join(auxdir, 'monthly_avgs', str(year),
+                               'monthly_sums_{}_01.npz'.format(year)))
+
+    assert aggregateMonth(auxdir, 2020, 2022, 1) == SUCCESS
+    for (sds_name, name) in ((OZONE_SDS, 'oz'), (WV_SDS, 'wv')):
+        grids = [images[year][doy][sds_name] for year in (2020, 2022)
+                 for doy in range(1, 32)]
+        assert numpy.allclose(
+            written['multiyear_avg_{}_2020_2022_01'.format(name)],
+            expectedAverage(grids))
+
+
+def test_aggregate_month_without_sums(tmp_path, written):
+    assert aggregateMonth(str(tmp_path), 2020, 2022, 1) == ERROR
+    assert written == {}
+
+
+@pytest.fixture
+def granules(tmp_path):
+    """
+    Description: synthetic daily granules (51 x 40 grids) for five days.
+    """
+    pytest.importorskip('h5py')
+    from make_granules import makeGranule
+
+    files = {}
+    for doy in range(1, 6):
+        files[doy] = str(tmp_path / granuleName(doy))
+        makeGranule(files[doy], rows=51, cols=40, seed=doy)
+    return files
+
+
+def readImage(path):
+    dataset = gdal.Open(path)
+    image = dataset.GetRasterBand(1).ReadAsArray()
+    dataset = None
+    return image
+
+
+def test_blocks_match_the_whole_grid(tmp_path, granules):
+    # the whole grid at once
+    sums = MonthlySums()
+    for doy in sorted(granules):
+        sums.addGranule(doy, os.path.basename(granules[doy]),
+                        readViirsAux(granules[doy]))
+    whole = str(tmp_path / 'whole')
+    writeResults(sums.oz.average(), whole + '_oz', gdal.GDT_Byte, 'oz')
+    writeResults(sums.wv.average(), whole + '_wv', gdal.GDT_UInt16, 'wv')
+
+    # blocks of rows which don't divide the grid evenly
+    blocks = str(tmp_path / 'blocks')
+    sums_path = str(tmp_path / 'monthly_sums_2023_01.npz')
+    assert writeMonthBlocks(granules, 7, blocks + '_oz', blocks + '_wv',
+                            sums_path=sums_path) == SUCCESS
+
+    for name in ('oz', 'wv'):
+        assert (readImage('{}_{}.img'.format(blocks, name)) ==
+                readImage('{}_{}.img'.format(whole, name))).all()
+    saved = MonthlySums.load(sums_path)
+    assert saved.granules == sums.granules
+    for sds_name in (OZONE_SDS, WV_SDS):
+        assert (saved.getAccumulator(sds_name).total ==
+                sums.getAccumulator(sds_name).total).all()
+        assert (saved.getAccumulator(sds_name).count ==
+                sums.getAccumulator(sds_name).count).all()
+
+
+def test_failed_block_keeps_the_previous_averages(tmp_path, granules):
+    outbase = str(tmp_path / 'monthly_avg')
+    sums_path = str(tmp_path / 'monthly_sums_2023_01.npz')
+    assert writeMonthBlocks(granules, 7, outbase + '_oz', outbase + '_wv',
+                            sums_path=sums_path) == SUCCESS
+    previous = readImage(outbase + '_oz.img')
+
+    # a daily file which can't be read
+    with open(granules[3], 'wb') as fh:
+        fh.write(b'truncated')
+    os.remove(sums_path)
+    assert writeMonthBlocks(granules, 7, outbase + '_oz', outbase + '_wv',
+                            sums_path=sums_path) == ERROR
+
+    assert (readImage(outbase + '_oz.img') == previous).all()
+    assert not os.path.exists(sums_path)
+    # and the temporary outputs are removed
+    assert not [name for name in os.listdir(str(tmp_path))
+                if '.tmp' in name]
@@ -0,0 +1,89 @@
+############################################################################
+# Description: Tests of the shared cache of raw LAADS granules.
+############################################################################
+
+import os
+
+import pytest
+
+import laads_cache
+from laads_cache import GranuleCache, getCache
+
+NAMES = ['VJ104ANC.A2023{:03d}.002.2023{:03d}123456.h5'.format(doy, doy+1)
+         for doy in range(1, 6)]
+
+
+def granule(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GranuleCache(str(tmp_path / 'cache'), 1000)
+
+
+def test_store_and_fetch(cache, tmp_path):
+    src = granule(tmp_path, NAMES[0], 100)
+    cache.store(src, NAMES[0])
+    assert cache.path(NAMES[0]).endswith(
+        os.path.join('VJ104ANC', '2023', NAMES[0]))
+
+    dest = str(tmp_path / 'fetched.h5')
+    assert cache.fetch(NAMES[0], dest, size=100)
+    assert open(dest, 'rb').read() == open(src, 'rb').read()
+
+    # a cached granule of the wrong size is a miss
+    missed = str(tmp_path / 'missed.h5')
+    assert not cache.fetch(NAMES[0], missed, size=101)
+    assert not cache.fetch(NAMES[1], missed)
+    assert not os.path.exists(missed)
+
+
+def test_fetch_link_shares_the_cached_file(cache, tmp_path):
+    cache.store(granule(tmp_path, NAMES[0], 100), NAMES[0])
+
+    dest = str(tmp_path / 'linked.h5')
+    assert cache.fetch(NAMES[0], dest, link=True)
+    assert os.path.samefile(dest, cache.path(NAMES[0]))
+
+
+def test_least_recently_used_granules_are_evicted(cache, tmp_path):
+    for (i, name) in enumerate(NAMES[:3]):
+        cache.store(granule(tmp_path, name, 300), name)
+        os.utime(cache.path(name), (1000 + i, 1000 + i))
+
+    # using the oldest granule makes it the most recently used
+    assert cache.fetch(NAMES[0], str(tmp_path / 'used.h5'))
+
+    # the fourth granule takes the cache over its budget, so the least
+    # recently used one is evicted to bring it back under 90% of it
+    cache.store(granule(tmp_path, NAMES[3], 300), NAMES[3])
+    cached = [name for name in NAMES if os.path.exists(cache.path(name))]
+    assert cached == [NAMES[0], NAMES[2], NAMES[3]]
+
+
+def test_replacing_a_granule_counts_its_size_once(cache, tmp_path):
+    for i in range(5):
+        cache.store(granule(tmp_path, NAMES[0], 400), NAMES[0])
+    assert cache._size == 400
+
+    cache.store(granule(tmp_path, NAMES[1], 400), NAMES[1])
+    assert cache._size == 800
+    assert os.path.exists(cache.path(NAMES[0]))
+
+
+def test_cache_is_off_without_a_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(laads_cache, '_cache', None)
+    monkeypatch.setattr(laads_cache, 'CACHE_DIR', None)
+    assert getCache() is None
+
+    monkeypatch.setattr(laads_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(laads_cache, 'CACHE_SIZE', 0)
+    assert getCache() is None
+
+    monkeypatch.setattr(laads_cache, 'CACHE_SIZE', 1000)
+    cache = getCache()
+    assert cache.directory == str(tmp_path / 'cache')
+    assert getCache() is cache
@@ -0,0 +1,191 @@
+############################################################################
+# Description: Tests of the LAADS client: the shared session, the retry
+# policy and the resumed downloads, against the stand-in server.
+############################################################################
+
+import time
+import datetime
+import email.utils
+
+import pytest
+
+import laads_client
+from laads_client import RetryPolicy, DownloadError, STREAM_ERROR, \
+    PART_SUFFIX, downloadLads, geturl, listLads, listingSize, getSession, \
+    closeSession, parseRetryAfter
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    """
+    Description: a retry policy without waits, used by geturl by default.
+    """
+    policy = RetryPolicy(retries=3, base_delay=0.01, max_delay=0.01,
+                         deadline=30, jitter=0)
+    monkeypatch.setattr(laads_client, 'RETRY_POLICY', policy)
+    return policy
+
+
+def listDay(token):
+    """
+    Description: returns the listing of a day served by the stand-in
+    server.
+    """
+    day = datetime.date.today() - datetime.timedelta(days=3)
+    doy = day.timetuple().tm_yday
+    (status, listing) = listLads(day.year, doy, token)
+    assert status == laads_client.SUCCESS
+    return (day.year, doy, listing)
+
+
+def test_session_is_shared():
+    session = getSession()
+    assert getSession() is session
+    closeSession()
+    assert getSession() is not session
+    closeSession()
+
+
+def test_download_writes_the_granule(laads, token, template, policy,
+                                     tmp_path):
+    server = laads()
+    (year, doy, listing) = listDay(token)
+    name = listing.entries[0]['name']
+    data = open(template, 'rb').read()
+
+    assert downloadLads(year, doy, str(tmp_path), token,
+                        listing=listing) == laads_client.SUCCESS
+    assert (tmp_path / name).read_bytes() == data
+    assert not (tmp_path / (name + PART_SUFFIX)).exists()
+    stats = server.stats.snapshot()
+    assert stats['granules'] == 1
+    assert stats['bytes'] == len(data)
+
+
+def test_bad_token_is_not_retried(laads, policy):
+    server = laads()
+    url = '{}{}/VJ104ANC/2023/001.csv'.format(server.url,
+                                               laads_client.ARCHIVE_PATH)
+
+    with pytest.raises(DownloadError) as error:
+        geturl(url, 'not-the-token')
+    assert error.value.status_code == 401
+    assert server.stats.snapshot()['unauthorized'] == 1
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    policy = RetryPolicy(base_delay=1, max_delay=8, jitter=0)
+    assert [policy.getDelay(attempt) for attempt in range(1, 7)] == \
+        [1, 2, 4, 8, 8, 8]
+
+
+def test_jitter_only_shortens_the_backoff():
+    policy = RetryPolicy(base_delay=4, max_delay=60, jitter=0.5)
+    delays = [policy.getDelay(2) for i in range(200)]
+    assert all(4 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_retry_after_is_the_minimum_delay():
+    policy = RetryPolicy(base_delay=1, max_delay=60, jitter=0)
+    assert policy.getDelay(1, 503, '30') == 30
+    assert policy.getDelay(1, 429, '30') == 30
+    # a shorter Retry-After doesn't cut the backoff short
+    assert policy.getDelay(4, 503, '1') == 8
+    # only throttled and unavailable responses have a Retry-After
+    assert policy.getDelay(1, 500, '30') == 1
+
+
+def test_retry_after_date():
+    when = email.utils.formatdate(time.time() + 120, usegmt=True)
+    assert 110 <= parseRetryAfter(when) <= 120
+    assert parseRetryAfter(None) is None
+    assert parseRetryAfter('soon') is None
+
+
+def test_retryable_statuses():
+    policy = RetryPolicy()
+    assert policy.isRetryable(None)
+    assert policy.isRetryable(503)
+    assert not policy.isRetryable(404)
+    assert not policy.isRetryable(401)
+
+
+def test_retries_honor_retry_after(laads, token, policy):
+    server = laads(error_rate=1.0)
+    url = '{}{}/VJ104ANC/2023/001.csv'.format(server.url,
+                                               laads_client.ARCHIVE_PATH)
+
+    start = time.monotonic()
+    with pytest.raises(DownloadError) as error:
+        geturl(url, token, policy=RetryPolicy(retries=2, base_delay=0.01,
+                                              max_delay=0.01, jitter=0))
+    # the server asks for a second between attempts
+    assert time.monotonic() - start >= 2
+    assert error.value.status_code == 503
+    assert server.stats.snapshot()['injected_errors'] == 3
+
+
+def test_download_resumes_a_partial_file(laads, token, template, policy,
+                                         tmp_path):
+    server = laads()
+    (year, doy, listing) = listDay(token)
+    name = listing.entries[0]['name']
+    data = open(template, 'rb').read()
+
+    # a .part left by an earlier run
+    offset = 1000001
+    (tmp_path / (name + PART_SUFFIX)).write_bytes(data[:offset])
+
+    assert downloadLads(year, doy, str(tmp_path), token,
+                        listing=listing) == laads_client.SUCCESS
+    assert (tmp_path / name).read_bytes() == data
+    assert not (tmp_path / (name + PART_SUFFIX)).exists()
+    stats = server.stats.snapshot()
+    assert stats['ranges'] == 1
+    assert stats['bytes'] == len(data) - offset
+
+
+def test_cut_off_transfers_lose_no_bytes(laads, token, template, policy,
+                                         tmp_path):
+    # every transfer sends half of the rest of the file, so the download
+    # runs out of retries partway
+    server = laads(truncate_rate=1.0)
+    (year, doy, listing) = listDay(token)
+    name = listing.entries[0]['name']
+    data = open(template, 'rb').read()
+
+    assert downloadLads(year, doy, str(tmp_path), token,
+                        listing=listing) == laads_client.ERROR
+    part = (tmp_path / (name + PART_SUFFIX)).read_bytes()
+    stats = server.stats.snapshot()
+    assert stats['truncated'] == policy.retries + 1
+    assert stats['ranges'] == policy.retries
+    # every byte sent was kept, and none was sent twice
+    assert part == data[:len(part)]
+    assert len(part) == stats['bytes']
+    assert policy.status_counts[STREAM_ERROR] == policy.retries
+
+    # the next run finishes it
+    server.truncate_rate = 0.0
+    assert downloadLads(year, doy, str(tmp_path), token,
+                        listing=listing) == laads_client.SUCCESS
+    assert (tmp_path / name).read_bytes() == data
+    assert server.stats.snapshot()['bytes'] == len(data)
+
+
+def test_complete_part_is_not_downloaded_again(laads, token, template,
+                                               policy, tmp_path):
+    server = laads()
+    (year, doy, listing) = listDay(token)
+    name = listing.entries[0]['name']
+    data = open(template, 'rb').read()
+    assert listingSize(listing.entries[0]) == len(data)
+
+    (tmp_path / (name + PART_SUFFIX)).write_bytes(data)
+    requests = server.stats.snapshot()['requests']
+
+    assert downloadLads(year, doy, str(tmp_path), token,
+                        listing=listing) == laads_client.SUCCESS
+    assert (tmp_path / name).read_bytes() == data
+    assert server.stats.snapshot()['requests'] == requests
@@ -0,0 +1,64 @@
+############################################################################
+# Description: Tests of the index of the LAADS granules in a directory.
+############################################################################
+
+from laads_index import parseGranuleName, GranuleIndex
+
+J1 = 'VJ104ANC.A2023001.002.2023002123456.h5'
+J1_REPROCESSED = 'VJ104ANC.A2023001.002.2023040123456.h5'
+NPP = 'VNP04ANC.A2023001.002.2023002123456.h5'
+
+
+def test_parse_granule_name():
+    granule = parseGranuleName(J1)
+    assert granule.product == 'VJ104ANC'
+    assert (granule.year, granule.doy) == (2023, 1)
+    assert granule.collection == '002'
+    assert granule.prodtime == '2023002123456'
+
+    # the gap-filled output is still keyed by its date
+    granule = parseGranuleName('VJ104ANC.A2023001.h5')
+    assert (granule.year, granule.doy) == (2023, 1)
+    assert granule.prodtime is None
+
+    assert parseGranuleName('VJ104ANC.A2023001.002.2023002123456.h5.part') \
+        is None
+    assert parseGranuleName('laads_manifest.db') is None
+
+
+def test_index_lists_the_directory_once(tmp_path):
+    for name in (J1, J1_REPROCESSED, NPP, 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'VJ104ANC.A2023002.002.2023003123456.h5').mkdir()
+
+    index = GranuleIndex(str(tmp_path))
+    assert index.find('VJ104ANC', 2023, 1) == [J1, J1_REPROCESSED]
+    assert index.find(('VJ104ANC', 'VNP04ANC'), 2023, 1) == \
+        sorted([J1, J1_REPROCESSED, NPP])
+    assert index.find(None, 2023, 1) == sorted([J1, J1_REPROCESSED, NPP])
+    # directories aren't granules
+    assert index.find(None, 2023, 2) == []
+
+    # files added afterwards aren't seen until they are recorded
+    (tmp_path / 'VJ104ANC.A2023003.002.2023004123456.h5').write_bytes(b'')
+    assert index.find(None, 2023, 3) == []
+    index.refresh()
+    assert index.find(None, 2023, 3) == \
+        ['VJ104ANC.A2023003.002.2023004123456.h5']
+
+
+def test_index_add_and_remove(tmp_path):
+    index = GranuleIndex(str(tmp_path / 'missing'))
+    assert index.find(None, 2023, 1) == []
+
+    index.add(J1)
+    index.add(NPP)
+    index.add('notes.txt')
+    assert index.find('VJ104ANC', 2023, 1) == [J1]
+    assert index.find('VNP04ANC', 2023, 1) == [NPP]
+
+    index.remove(J1)
+    index.remove(J1_REPROCESSED)
+    index.remove('notes.txt')
+    assert index.find('VJ104ANC', 2023, 1) == []
+    assert index.find(None, 2023, 1) == [NPP]
@@ -0,0 +1,107 @@
+############################################################################
+# Description: Tests of the lease locks: holding, renewing, expiry and
+# breaking the locks of runs which died.
+############################################################################
+
+import json
+import time
+
+import pytest
+
+import laads_lock
+from laads_lock import LeaseLocks, LOCK_GRACE
+
+
+@pytest.fixture
+def locks():
+    """
+    Description: lease locks of two runs, released at the end of the test.
+    """
+    runs = [LeaseLocks(lease=0.3, owner='run{}'.format(i)) for i in (1, 2)]
+    yield runs
+    for run in runs:
+        run.releaseAll()
+
+
+def writeLock(path, owner, expires):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'owner': owner, 'acquired': 0,
+                                'expires': expires}))
+
+
+def test_lock_is_exclusive(locks, tmp_path):
+    (first, second) = locks
+    lock = str(tmp_path / '.locks' / '001.lock')
+
+    assert first.acquire(lock)
+    assert first.isHeld(lock)
+    assert not second.acquire(lock)
+
+    first.release(lock)
+    assert second.acquire(lock)
+    assert not first.isHeld(lock)
+
+
+def test_lease_is_renewed(locks, tmp_path):
+    (first, second) = locks
+    lock = tmp_path / '.locks' / '001.lock'
+
+    assert first.acquire(str(lock))
+    acquired = json.loads(lock.read_text())
+    time.sleep(1.0)
+    renewed = json.loads(lock.read_text())
+    assert renewed['expires'] > acquired['expires']
+    assert renewed['acquired'] == acquired['acquired']
+    assert first.isHeld(str(lock))
+
+
+def test_expired_lock_is_broken(locks, tmp_path):
+    (first, second) = locks
+    lock = tmp_path / '.locks' / '001.lock'
+
+    # left by a run which died longer than the grace period ago
+    writeLock(lock, 'dead.1', time.time() - LOCK_GRACE - 1)
+    assert first.acquire(str(lock))
+    assert json.loads(lock.read_text())['owner'] == 'run1'
+
+
+def test_lock_within_grace_is_not_broken(locks, tmp_path):
+    (first, second) = locks
+    lock = tmp_path / '.locks' / '001.lock'
+
+    # expired, but maybe only because of the clock of the other host
+    writeLock(lock, 'other.1', time.time() - 1)
+    assert not first.acquire(str(lock))
+    assert json.loads(lock.read_text())['owner'] == 'other.1'
+
+
+def test_unreadable_lock_expires_by_its_age(locks, tmp_path, monkeypatch):
+    (first, second) = locks
+    lock = tmp_path / '.locks' / '001.lock'
+
+    # a run which died while creating the lock
+    lock.parent.mkdir()
+    lock.write_text('{"own')
+    assert not first.acquire(str(lock))
+
+    monkeypatch.setattr(laads_lock, 'LOCK_GRACE', 0)
+    time.sleep(0.4)
+    assert first.acquire(str(lock))
+
+
+def test_stolen_lock_is_lost(locks, tmp_path, monkeypatch):
+    (first, second) = locks
+    lock = str(tmp_path / '.locks' / '001.lock')
+
+    # the first run stalls long enough for its lease to be broken
+    monkeypatch.setattr(laads_lock, 'LOCK_GRACE', 0)
+    assert first.acquire(lock)
+    first._stop.set()
+    time.sleep(0.5)
+    assert second.acquire(lock)
+
+    assert not first.isHeld(lock)
+    assert second.isHeld(lock)
+    # releasing a lost lock leaves the new owner's lock alone
+    first.release(lock)
+    assert second.isHeld(lock)
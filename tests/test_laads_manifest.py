@@ -0,0 +1,189 @@
+############################################################################
+# Description: Tests of the manifest of processed LAADS granules and of the
+# working copies runs merge back into the shared manifest.
+############################################################################
+
+import os
+
+import pytest
+
+from laads_lock import LOCKS, LeaseLocks
+from laads_manifest import GranuleManifest, fileChecksum, openWorkingCopy, \
+    mergeWorkingCopy, getSnapshotPath, getManifestLockPath, lockManifest, \
+    DOWNLOADED, GAPFILLED, PUBLISHED
+
+NAME = 'VJ104ANC.A2023001.002.2023002123456.h5'
+URL = 'https://example.com/archive/VJ104ANC/2023/001/' + NAME
+MODIFIED = '2023-01-02 12:34'
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = GranuleManifest(str(tmp_path / 'laads_manifest.db'))
+    yield manifest
+    manifest.close()
+
+
+@pytest.fixture
+def published(manifest, tmp_path):
+    """
+    Description: a granule recorded as downloaded, gap-filled and
+    published, and the path of its published file.
+    """
+    path = tmp_path / 'VJ104ANC.A2023001.h5'
+    path.write_bytes(b'gap-filled')
+    manifest.recordDownload(NAME, URL, 1000, MODIFIED, '"abc"')
+    manifest.setStatus(NAME, GAPFILLED)
+    manifest.recordPublished(NAME, str(path), fileChecksum(str(path)))
+    return path
+
+
+def test_granule_lifecycle(manifest):
+    assert manifest.get(NAME) is None
+
+    manifest.recordDownload(NAME, URL, 1000, MODIFIED, '"abc"')
+    entry = manifest.get(NAME)
+    assert entry['status'] == DOWNLOADED
+    assert (entry['product'], entry['year'], entry['doy']) == \
+        ('VJ104ANC', 2023, 1)
+    assert entry['prodtime'] == '2023002123456'
+    assert (entry['source_url'], entry['size']) == (URL, 1000)
+
+    manifest.setStatus(NAME, GAPFILLED)
+    entry = manifest.get(NAME)
+    assert entry['status'] == GAPFILLED
+    # the download details are kept
+    assert entry['etag'] == '"abc"'
+
+
+def test_published_granule_is_current(manifest, published):
+    entry = manifest.get(NAME)
+    assert entry['status'] == PUBLISHED
+    assert entry['checksum'] == fileChecksum(str(published))
+
+    assert manifest.isCurrent(NAME)
+    assert manifest.isCurrent(NAME, size='1000', last_modified=MODIFIED,
+                              etag='"abc"')
+    # a granule changed on LAADS isn't
+    assert not manifest.isCurrent(NAME, size=1001)
+    assert not manifest.isCurrent(NAME, last_modified='2023-02-01 00:00')
+    assert not manifest.isCurrent(NAME, etag='"def"')
+    # nor is one whose published file is gone
+    published.unlink()
+    assert not manifest.isCurrent(NAME)
+
+
+def test_unpublished_granule_is_not_current(manifest):
+    assert not manifest.isCurrent(NAME)
+    manifest.recordDownload(NAME, URL, 1000)
+    assert not manifest.isCurrent(NAME)
+
+
+def test_adopt_published(manifest, tmp_path):
+    path = tmp_path / 'VJ104ANC.A2023001.h5'
+    path.write_bytes(b'gap-filled')
+    manifest.adoptPublished(NAME, URL, 1000, MODIFIED, str(path))
+
+    entry = manifest.get(NAME)
+    assert entry['status'] == PUBLISHED
+    assert entry['checksum'] is None
+    assert manifest.isCurrent(NAME, size=1000, last_modified=MODIFIED)
+
+
+def test_select(manifest):
+    names = ['VJ104ANC.A2023001.002.2023002123456.h5',
+             'VJ104ANC.A2023002.002.2023003123456.h5',
+             'VNP04ANC.A2024001.002.2024002123456.h5']
+    for name in names:
+        manifest.recordDownload(name, URL, 1000)
+    manifest.setStatus(names[1], GAPFILLED)
+
+    assert [e['name'] for e in manifest.select()] == names
+    assert [e['name'] for e in manifest.select(year=2023)] == names[:2]
+    assert [e['name'] for e in manifest.select(year=2023, doy=2)] == \
+        names[1:2]
+    assert [e['name'] for e in manifest.select(status=DOWNLOADED)] == \
+        [names[0], names[2]]
+
+
+def test_manifest_is_persistent(tmp_path):
+    path = str(tmp_path / 'laads_manifest.db')
+    manifest = GranuleManifest(path)
+    manifest.recordDownload(NAME, URL, 1000)
+    manifest.close()
+
+    manifest = GranuleManifest(path)
+    assert manifest.get(NAME)['size'] == 1000
+    manifest.close()
+
+
+def granuleNames(doys):
+    return ['VJ104ANC.A2023{:03d}.002.2023{:03d}123456.h5'.format(doy, doy+1)
+            for doy in doys]
+
+
+def test_runs_merge_their_working_copies(tmp_path):
+    path = str(tmp_path / 'LADS' / 'laads_manifest.db')
+    os.makedirs(os.path.dirname(path))
+
+    # two overlapping runs, e.g. two shards, record different days
+    first = openWorkingCopy(path, localdir=str(tmp_path))
+    second = openWorkingCopy(path, localdir=str(tmp_path))
+    assert not os.path.exists(path)
+    for name in granuleNames([1, 3]):
+        first.recordDownload(name, URL, 1000)
+    for name in granuleNames([2]):
+        second.recordDownload(name, URL, 2000)
+
+    snapshot = mergeWorkingCopy(first, path)
+    assert snapshot == getSnapshotPath(path)
+    assert not os.path.exists(first.path)
+    mergeWorkingCopy(second, path)
+    assert not os.path.exists(second.path)
+    # the lock is released after each merge
+    assert not os.path.exists(getManifestLockPath(path))
+
+    for db in (path, snapshot):
+        manifest = GranuleManifest(db, readonly=True)
+        assert [e['name'] for e in manifest.select()] == \
+            granuleNames([1, 2, 3])
+        manifest.close()
+
+    # a later run starts from the merged manifest and replaces an entry
+    third = openWorkingCopy(path, localdir=str(tmp_path))
+    assert third.changed() == []
+    assert third.get(granuleNames([2])[0])['size'] == 2000
+    third.setStatus(granuleNames([2])[0], GAPFILLED)
+    mergeWorkingCopy(third, path)
+
+    manifest = GranuleManifest(path, readonly=True)
+    assert manifest.get(granuleNames([2])[0])['status'] == GAPFILLED
+    assert manifest.get(granuleNames([1])[0])['status'] == DOWNLOADED
+    manifest.close()
+
+
+def test_manifest_starts_from_the_snapshot(tmp_path):
+    path = str(tmp_path / 'laads_manifest.db')
+    snapshot = GranuleManifest(getSnapshotPath(path))
+    snapshot.recordDownload(NAME, URL, 1000)
+    snapshot.close()
+
+    working = openWorkingCopy(path, localdir=str(tmp_path))
+    assert os.path.exists(path)
+    assert working.get(NAME)['size'] == 1000
+    working.close()
+    os.remove(working.path)
+
+
+def test_manifest_lock_is_waited_for(tmp_path):
+    path = str(tmp_path / 'laads_manifest.db')
+    other = LeaseLocks(lease=60, owner='other run')
+    assert other.acquire(getManifestLockPath(path))
+    try:
+        with pytest.raises(IOError):
+            lockManifest(path, wait=1)
+    finally:
+        other.releaseAll()
+
+    lock = lockManifest(path, wait=0)
+    LOCKS.release(lock)
@@ -0,0 +1,125 @@
+############################################################################
+# Description: Tests of the publish lists and the incremental S3 publish.
+############################################################################
+
+import os
+import sys
+
+import pytest
+
+import laads_publish
+from laads_publish import PublishList, getPublishDir, getPublishListPath, \
+    readPublishList, s3Key, uploadFiles
+
+
+def test_publish_lists_are_on_the_aux_directory(monkeypatch, tmp_path):
+    monkeypatch.delenv('LAADS_PUBLISH_DIR', raising=False)
+    auxdir = str(tmp_path)
+    assert getPublishDir(auxdir) == os.path.join(auxdir, '.publish')
+
+    # each run has its own list
+    path = getPublishListPath('updatelads', auxdir)
+    assert os.path.dirname(path) == os.path.join(auxdir, '.publish')
+    assert os.path.basename(path).startswith('updatelads.')
+    assert path.endswith('.{}.txt'.format(os.getpid()))
+
+    monkeypatch.setenv('LAADS_PUBLISH_DIR', str(tmp_path / 'lists'))
+    assert getPublishDir(auxdir) == str(tmp_path / 'lists')
+
+
+def test_publish_list_keeps_the_first_write_order(monkeypatch, tmp_path):
+    monkeypatch.delenv('LAADS_PUBLISH_DIR', raising=False)
+    published = PublishList()
+    published.record(str(tmp_path / 'b'))
+    published.extend([str(tmp_path / 'a'), str(tmp_path / 'b')])
+    assert published.paths() == [str(tmp_path / 'b'), str(tmp_path / 'a')]
+
+    path = published.write('updatelads', str(tmp_path))
+    assert readPublishList(path) == published.paths()
+
+    # a later write adds to the list
+    published.reset()
+    published.record(str(tmp_path / 'c'))
+    published.write('updatelads', str(tmp_path))
+    assert readPublishList(path) == \
+        [str(tmp_path / name) for name in ('b', 'a', 'c')]
+
+    assert readPublishList(str(tmp_path / 'missing.txt')) == []
+
+
+def test_s3_key():
+    auxdir = '/var/lasrc_aux'
+    assert s3Key('/var/lasrc_aux/LADS/2023/VJ104ANC.A2023001.h5', auxdir,
+                 'lasrc_aux') == 'lasrc_aux/LADS/2023/VJ104ANC.A2023001.h5'
+    assert s3Key('/var/lasrc_aux/metrics/updatelads.prom', auxdir,
+                 '/backup/lasrc_aux/') == \
+        'backup/lasrc_aux/metrics/updatelads.prom'
+    assert s3Key('/tmp/lads/VJ104ANC.A2023001.h5', auxdir, 'lasrc_aux') \
+        is None
+
+
+@pytest.fixture
+def aws(monkeypatch, tmp_path):
+    """
+    Description: replaces the aws cli with a script which copies the file
+    into a local bucket directory (and fails for files named fail*), and
+    uploads with the cli rather than boto3.
+    """
+    bucket = tmp_path / 'bucket'
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    script = bindir / 'aws'
+    script.write_text(
+        '#!{}\n'
+        'import os, shutil, sys\n'
+        '(src, dest) = sys.argv[4:6]\n'
+        'if os.path.basename(src).startswith("fail"):\n'
+        '    sys.exit("upload failed")\n'
+        'dest = os.path.join({!r}, dest[len("s3://"):])\n'
+        'os.makedirs(os.path.dirname(dest), exist_ok=True)\n'
+        'shutil.copyfile(src, dest)\n'.format(sys.executable, str(bucket)))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(bindir, os.pathsep,
+                                               os.environ['PATH']))
+    monkeypatch.setattr(laads_publish, 'boto3', None)
+    return bucket
+
+
+def test_upload_files(aws, tmp_path):
+    auxdir = tmp_path / 'aux'
+    (auxdir / 'LADS' / '2023').mkdir(parents=True)
+    granule = auxdir / 'LADS' / '2023' / 'VJ104ANC.A2023001.h5'
+    granule.write_bytes(b'gap-filled')
+
+    paths = [str(granule), str(auxdir / 'LADS' / 'replaced.h5'),
+             str(tmp_path / 'outside.h5')]
+    (status, uploaded) = uploadFiles(paths, str(auxdir), 'bucket',
+                                     endpoint_url=None)
+    assert (status, uploaded) == (laads_publish.SUCCESS, 1)
+    assert (aws / 'bucket' / 'lasrc_aux' / 'LADS' / '2023' /
+            'VJ104ANC.A2023001.h5').read_bytes() == b'gap-filled'
+
+
+def test_failed_upload_keeps_the_list(aws, monkeypatch, tmp_path):
+    auxdir = tmp_path / 'aux'
+    auxdir.mkdir()
+    (auxdir / 'ok.h5').write_bytes(b'ok')
+    (auxdir / 'fail.h5').write_bytes(b'fail')
+    monkeypatch.setenv('LASRC_AUX_DIR', str(auxdir))
+    monkeypatch.setattr(laads_publish, 'S3_ENDPOINT_URL', None)
+
+    published = PublishList()
+    published.extend([str(auxdir / 'ok.h5'), str(auxdir / 'fail.h5')])
+    path = published.write('updatelads', str(auxdir))
+
+    monkeypatch.setattr(sys, 'argv', ['laads_publish.py', '--bucket',
+                                      'bucket', path])
+    assert laads_publish.main() == laads_publish.ERROR
+    assert os.path.exists(path)
+
+    # the next run uploads the list again.  a file which no longer exists
+    # (e.g. replaced by a later run) is skipped.
+    (auxdir / 'fail.h5').unlink()
+    assert laads_publish.main() == laads_publish.SUCCESS
+    assert not os.path.exists(path)
+    assert (aws / 'bucket' / 'lasrc_aux' / 'ok.h5').read_bytes() == b'ok'
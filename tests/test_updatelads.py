@@ -0,0 +1,156 @@
+############################################################################
+# Description: Tests of the work plans and the sharding of updatelads.py.
+############################################################################
+
+import os
+import sys
+import datetime
+
+import pytest
+
+import updatelads
+from updatelads import planLadsWork, writePlan, readPlan, PLAN_PROCESS, \
+    PLAN_SKIP, parseShard, getShard, inShard, shardPlan, getJobName
+from laads_manifest import GranuleManifest, getSnapshotPath
+
+
+def planYear():
+    """
+    Description: a year with days which are all available from the
+    stand-in server.
+    """
+    return (datetime.date.today() - datetime.timedelta(days=60)).year
+
+
+@pytest.fixture
+def plan(laads, token, tmp_path):
+    laads()
+    (status, plan) = planLadsWork(str(tmp_path), [planYear()], False, token,
+                                  workers=4)
+    assert status == updatelads.SUCCESS
+    return plan
+
+
+def test_plan_json_round_trip(plan, tmp_path):
+    path = str(tmp_path / 'plan.json')
+    writePlan(plan, path)
+    assert readPlan(path) == plan
+
+    assert plan['today'] is False
+    assert plan['reconcile'] is False
+    assert plan['shard'] is None
+    summary = plan['summary']
+    assert summary[PLAN_PROCESS] == len(plan['days'])
+    assert summary[PLAN_SKIP] == 0
+    assert summary['download_bytes'] == sum(
+        int(day['listing']['entries'][0]['size']) for day in plan['days'])
+    for day in plan['days']:
+        assert day['action'] == PLAN_PROCESS
+        assert day['product'] == 'VJ104ANC'
+        assert day['listing']['entries'][0]['name'].startswith(
+            'VJ104ANC.A{}{:03d}.'.format(day['year'], day['doy']))
+
+
+def listFiles(directory):
+    """
+    Description: returns the files in a directory tree with their size and
+    modification time.
+    """
+    files = {}
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+@pytest.mark.parametrize('snapshot_only', [False, True])
+def test_dry_run_reads_the_manifest_in_place(laads, token, tmp_path,
+                                             monkeypatch, snapshot_only):
+    laads()
+    year = planYear()
+    auxdir = tmp_path / 'aux'
+    (auxdir / 'LADS').mkdir(parents=True)
+    manifest_path = str(auxdir / 'LADS' / 'laads_manifest.db')
+    manifest = GranuleManifest(manifest_path)
+    manifest.recordDownload('VJ104ANC.A{}001.002.{}002120000.h5'
+                            .format(year, year), 'url', 1000)
+    manifest.close()
+    if snapshot_only:
+        os.rename(manifest_path, getSnapshotPath(manifest_path))
+
+    def openWorkingCopy(*args, **kwargs):
+        raise AssertionError('a dry run copied the manifest')
+
+    monkeypatch.setattr(updatelads, 'openWorkingCopy', openWorkingCopy)
+    monkeypatch.setattr(updatelads, 'TOKEN', token)
+    monkeypatch.setenv('LASRC_AUX_DIR', str(auxdir))
+    monkeypatch.delenv('LAADS_MANIFEST', raising=False)
+    plan_path = str(tmp_path / 'plan.json')
+    monkeypatch.setattr(sys, 'argv', [
+        'updatelads.py', '-s', str(year), '-e', str(year), '--dry_run',
+        '--plan_output', plan_path])
+
+    before = listFiles(str(auxdir))
+    assert updatelads.main() == updatelads.SUCCESS
+    # nothing was written to the auxiliary directory, not even a lock
+    assert listFiles(str(auxdir)) == before
+    assert sorted(os.listdir(str(auxdir / 'LADS'))) == \
+        [os.path.basename(path) for path in before]
+    assert readPlan(plan_path)['summary'][PLAN_PROCESS] > 0
+
+
+def test_parse_shard():
+    assert parseShard('0/1') == (0, 1)
+    assert parseShard('2/3') == (2, 3)
+    for value in ('3/3', '-1/3', '1/0', '1', 'a/b'):
+        with pytest.raises(ValueError):
+            parseShard(value)
+
+
+def test_shard_from_the_array_job(monkeypatch):
+    monkeypatch.setattr(updatelads, 'SHARD_COUNT', 4)
+    monkeypatch.setenv('AWS_BATCH_JOB_ARRAY_INDEX', '3')
+    assert getShard() == (3, 4)
+    # --shard wins
+    assert getShard('1/2') == (1, 2)
+
+    monkeypatch.delenv('AWS_BATCH_JOB_ARRAY_INDEX')
+    assert getShard() is None
+
+
+def test_shards_divide_the_days_evenly():
+    count = 3
+    days = [(year, doy) for year in (2023, 2024)
+            for doy in range(1, 366 + (year == 2024))]
+    shards = [[day for day in days if inShard(day[0], day[1], (i, count))]
+              for i in range(count)]
+
+    # every day is in exactly one shard
+    assert sorted(sum(shards, [])) == sorted(days)
+    # and each shard gets an even share of each year
+    for year in (2023, 2024):
+        sizes = [len([day for day in shard if day[0] == year])
+                 for shard in shards]
+        assert max(sizes) - min(sizes) <= 1
+    assert all(inShard(year, doy, None) for (year, doy) in days)
+
+
+def test_shards_have_their_own_job_names():
+    assert getJobName(None) == 'updatelads'
+    assert getJobName((1, 3)) == 'updatelads_shard_1_of_3'
+
+
+def test_plan_shards(plan):
+    count = 3
+    shards = [shardPlan(plan, (i, count)) for i in range(count)]
+
+    days = sorted((day['year'], day['doy']) for shard in shards
+                  for day in shard['days'])
+    assert days == sorted((day['year'], day['doy']) for day in plan['days'])
+    for (i, shard) in enumerate(shards):
+        assert shard['shard'] == [i, count]
+        assert shard['summary'][PLAN_PROCESS] == len(shard['days'])
+        assert all(inShard(day['year'], day['doy'], (i, count))
+                   for day in shard['days'])
@@ -4,21 +4,33 @@ from __future__ import (division, print_function, absolute_import, unicode_liter
 import sys
 import os
 import shutil
-import fnmatch
 import datetime
 import calendar
 import subprocess
-import re
 import time
-import subprocess
+import concurrent.futures
+import collections
+import queue
+import json
+import socket
+import sqlite3
+import threading
 
 from optparse import OptionParser
-import requests
 import logging
 from config_utils import retrieve_cfg
 from api_interface import api_connect
-from download_lads import downloadLads
-from io import StringIO
+from laads_client import downloadLads, listLads, listingSize, geturl, \
+    getSession, closeSession, cancelDownloads, isResumable, DownloadError, \
+    LadsListing, RETRY_POLICY, UNCHANGED, VIIRS_PRODUCTS, PART_SUFFIX
+from laads_index import GranuleIndex
+from laads_metrics import METRICS, getMetricsDir
+from laads_publish import PUBLISHED
+from laads_lock import LOCKS, LOCK_DIR_NAME
+from laads_cache import getCache
+from laads_manifest import getManifestPath, getSnapshotPath, fileChecksum, \
+    openWorkingCopy, mergeWorkingCopy, GranuleManifest, GAPFILLED, \
+    GAPFILL_FAILED
 from pathlib import Path
 
 # Global static variables
@@ -34,7 +46,6 @@ JPSS1_START_YEAR = 2021 # quarterly processing will reprocess back to the
 ##the application token that is required for accessing the LAADS data
 ##https://ladsweb.modaps.eosdis.nasa.gov/tools-and-services/data-download-scripts/
 TOKEN = os.environ.get('LAADS_TOKEN', None)
-USERAGENT = 'espa.cr.usgs.gov/updatelads.py 1.4.1--' + sys.version.replace('\n','').replace('\r','')
 
 # leap day start/end of month
 ldaySOM = [ 1, 32, 61,  92, 122, 153, 183, 214, 245, 275, 306, 336]
@@ -44,253 +55,1110 @@ ldayEOM = [31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335, 366]
 rdaySOM = [ 1, 32, 60,  91, 121, 152, 182, 213, 244, 274, 305, 335]
 rdayEOM = [31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365]
 
+# number of days of LAADS data to download concurrently.  this can be
+# overridden with the --workers command-line option.
+DOWNLOAD_WORKERS = int(os.environ.get('LAADS_DOWNLOAD_WORKERS', 4))
+
+# number of gapfill_viirs_aux processes to run concurrently.  defaults to the
+# number of cores and can be overridden with --gapfill_workers.
+GAPFILL_WORKERS = int(os.environ.get('LAADS_GAPFILL_WORKERS',
+                                     os.cpu_count() or 1))
+
+# maximum number of files waiting between the pipeline stages
+STAGE_QUEUE_SIZE = int(os.environ.get('LAADS_STAGE_QUEUE_SIZE', 16))
+
+# number of gap-filled files published concurrently.  the files waiting to
+# be published are flushed in batches of up to this many.
+PUBLISH_WORKERS = int(os.environ.get('LAADS_PUBLISH_WORKERS', 4))
+
+# download and gap-fill in a hidden staging directory in the output
+# directory (on EFS) rather than in /tmp/lads, so publishing is a rename
+# instead of a copy.  can also be set with --stage_in_output.
+STAGE_IN_OUTPUT = bool(os.environ.get('LAADS_STAGE_IN_OUTPUT'))
+
+# hidden directory in the output directory of each year where files are
+# staged before they are renamed into place.  each run stages in its own
+# subdirectory, and those left by runs which died are removed once they are
+# older than STAGING_MAX_AGE seconds.
+STAGING_DIR_NAME = '.staging'
+STAGING_MAX_AGE = 24 * 60 * 60
+RUN_ID = os.environ.get('AWS_BATCH_JOB_ID',
+                        '{}.{}'.format(socket.gethostname(), os.getpid()))
+
+# number of shards of an AWS Batch array job.  each child job processes the
+# days of its AWS_BATCH_JOB_ARRAY_INDEX shard (see --shard).
+SHARD_COUNT = int(os.environ.get('LAADS_SHARD_COUNT', 0))
+
+# actions of the days of a plan (see planLadsWork)
+PLAN_PROCESS = 'process'    # download, gap-fill and publish the day
+PLAN_SKIP = 'skip'          # already published and unchanged
+PLAN_MISSING = 'missing'    # neither product is available on LAADS
+
+# a single day of LAADS data to be downloaded, gap-filled and published.
+# dloadIndex and outputIndex are the GranuleIndex objects for the download
+# and output directories (shared by all the days in the year).  listing is
+# the LadsListing for the day if it has already been retrieved.
+LadsWork = collections.namedtuple('LadsWork',
+                                  ['year', 'doy', 'dloaddir', 'outputDir',
+                                   'dloadIndex', 'outputIndex', 'listing'])
+
+
+def doyToMonthDay (year, doy):
+    """
+    Description: doyToMonthDay determines the month and day (both 1-based)
+    for the specified year/doy date.
+
+    Args:
+      year: year of the date (integer)
+      doy: day of year of the date (integer)
+
+    Returns:
+        (month, day) tuple
+    """
+    # indx will be 0-based for the array
+    if calendar.isleap(year):
+        for indx in range(0, len(ldayEOM)):
+            if doy <= ldayEOM[indx]:
+                break;
+        month = indx+1
+        day = doy - ldaySOM[indx] + 1
+    else:
+        for indx in range(0, len(rdayEOM)):
+            if doy <= rdayEOM[indx]:
+                break;
+        month = indx+1
+        day = doy - rdaySOM[indx] + 1
+
+    return (month, day)
+
+
+def findViirsAnc (dloadIndex, year, doy):
+    """
+    Description: findViirsAnc finds the downloaded VIIRS atmosphere file for
+    the specified year and DOY. The JPSS1 file is the priority, but if that
+    isn't found then the NPP file will be used.
+
+    Args:
+      dloadIndex: GranuleIndex of the directory containing the downloaded
+                  LAADS files
+      year: year of LAADS data (integer)
+      doy: day of year of LAADS data (integer)
+
+    Returns:
+        (ERROR, None): more than one file was found for the year/DOY
+        (SUCCESS, None): neither the JPSS1 nor NPP data is available
+        (SUCCESS, viirs_anc): full path of the VIIRS file to be processed
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    # get the JPSS1 file for the current DOY (should only be one)
+    fileList = dloadIndex.find('VJ104ANC', year, doy)
+
+    # make sure files were found or search for the NPP file
+    nfiles = len(fileList)
+    if nfiles == 0:
+        # get the NPP file for the current DOY (should only be one)
+        fileList = dloadIndex.find('VNP04ANC', year, doy)
+
+        # make sure files were found
+        nfiles = len(fileList)
+        if nfiles == 0:
+            return (SUCCESS, None)
+
+        # if only one file was found which matched our date, then that is
+        # the file we'll process.  if more than one was found, then we have
+        # a problem as only one file is expected.
+        if nfiles != 1:
+            msg = ('Multiple LAADS VNP04ANC files found for doy {} year {}'
+                   .format(doy, year))
+            logger.error(msg)
+            return (ERROR, None)
+
+    else:
+        # if only one file was found which matched our date, then that's
+        # the file we'll process.  if more than one was found, then we
+        # have a problem as only one file is expected.
+        if nfiles != 1:
+            msg = ('Multiple LAADS VJ104ANC files found for doy {} year {}'
+                   .format(doy, year))
+            logger.error(msg)
+            return (ERROR, None)
+
+    return (SUCCESS, dloadIndex.directory + '/' + fileList[0])
+
+
+def getDayLock (work):
+    """
+    Description: getDayLock returns the path of the lock of the day of work
+    (see laads_lock.py).  The lock is held from the download until the day
+    is published, so overlapping runs on the same auxiliary directory don't
+    process the same day.
+    """
+    return os.path.join(work.outputDir, LOCK_DIR_NAME,
+                        'A{}{:03d}.lock'.format(work.year, work.doy))
+
+
+def cleanDay (work):
+    """
+    Description: cleanDay removes the files of the day of work left in the
+    download directory by an earlier run, so they aren't mistaken for this
+    run's download.  Partial downloads (.part) are kept so they can be
+    resumed.  The day's lock must be held, since another run may share the
+    download directory.
+    """
+    for product in VIIRS_PRODUCTS:
+        for name in work.dloadIndex.find(product, work.year, work.doy):
+            try:
+                os.remove(os.path.join(work.dloaddir, name))
+            except FileNotFoundError:
+                pass
+            work.dloadIndex.remove(name)
+
 
-def geturl(url, token=None, out=None):
+def downloadDoy (work, token, manifest=None, force=False):
     """
-    Pulls the file specified by URL.  If there is a problem with the
-    connection, then retry up to 5 times.
+    Description: downloadDoy downloads the daily LAADS files for the specified
+    day of work and selects the VIIRS file to be gap-filled. This is run by
+    the download workers, so it only touches files for its own date.
 
     Args:
-      url: URL for the file to be downloaded
+      work: LadsWork for the year and DOY to be downloaded
       token: application token for the desired website
-      out: directory where the downloaded file will be written
+      manifest: GranuleManifest of the processed granules
+      force: if True, download the day even if the manifest shows its
+             granules have already been published unchanged
+
+    Returns:
+        (UNCHANGED, None): the day's granules have already been published
+        otherwise (status, viirs_anc) as returned by findViirsAnc
+    """
+    cleanDay (work)
+    status = downloadLads (work.year, work.doy, work.dloaddir, token,
+                           index=work.dloadIndex, manifest=manifest,
+                           skip_current=not force, listing=work.listing,
+                           cache=getCache())
+    if status == ERROR:
+        # warning message already printed
+        return (ERROR, None)
+    if status == UNCHANGED:
+        return (UNCHANGED, None)
+
+    return findViirsAnc (work.dloadIndex, work.year, work.doy)
+
+
+def gapfillViirsAnc (viirs_anc, year, doy):
+    """
+    Description: gapfillViirsAnc runs gapfill_viirs_aux on the downloaded
+    VIIRS file (works the same for either VJ104ANC or VNP04ANC).
+
+    Args:
+      viirs_anc: full path of the VIIRS file to be gap-filled
+      year: year of LAADS data (integer)
+      doy: day of year of LAADS data (integer)
+
+    Returns:
+        ERROR: error occurred while gap-filling
+        SUCCESS: gap-filling completed successfully
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    # generate the command-line arguments and executable for gap-filling
+    # the VIIRS product
+    (month, day) = doyToMonthDay (year, doy)
+    cmdstr = ('gapfill_viirs_aux --viirs_aux {} --month {} --day {} '
+              '--year {}'.format(viirs_anc, month, day, year))
+    msg = 'Executing {}'.format(cmdstr)
+    logger.info(msg)
+    (status, output) = subprocess.getstatusoutput (cmdstr)
+    logger.info(output)
+    exit_code = status >> 8
+    if exit_code != 0:
+        msg = ('Error running gap_fill for year {}, DOY {}: {}'
+               .format(year, doy, cmdstr))
+        logger.error(msg)
+        return ERROR
+
+    return SUCCESS
+
+
+def getStagingDir (outputDir):
+    """
+    Description: getStagingDir returns this run's hidden staging directory
+    in the output directory.  Files in it are on the same filesystem as the
+    output directory, so they can be published with an atomic rename.
+
+    Args:
+      outputDir: output directory of the year
+
+    Returns:
+        full path of the staging directory
+    """
+    return os.path.join(outputDir, STAGING_DIR_NAME, RUN_ID)
 
-    Returns: None
+
+def cleanStagingDirs (outputDir):
+    """
+    Description: cleanStagingDirs removes the staging directories left in
+    the output directory by runs which died more than STAGING_MAX_AGE
+    seconds ago.  The staging directories of runs still in progress are
+    left alone.
+
+    Args:
+      outputDir: output directory of the year
     """
     # get the logger
     logger = logging.getLogger(__name__)
 
-    # get the headers for the application data download
-    headers = {'user-agent' : USERAGENT}
-    if not token is None:
-        headers['Authorization'] = 'Bearer ' + token
+    stagingRoot = os.path.join(outputDir, STAGING_DIR_NAME)
+    if not os.path.isdir(stagingRoot):
+        return
+
+    for entry in os.scandir(stagingRoot):
+        if entry.name == RUN_ID or not entry.is_dir():
+            continue
+        if time.time() - entry.stat().st_mtime > STAGING_MAX_AGE:
+            msg = 'Removing stale staging directory: {}'.format(entry.path)
+            logger.info(msg)
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def removeStagingDir (outputDir):
+    """
+    Description: removeStagingDir removes this run's staging directory from
+    the output directory once it's empty (and the hidden staging directory
+    if no other runs are staging there).
+
+    Args:
+      outputDir: output directory of the year
+    """
+    stagingDir = getStagingDir(outputDir)
+    for directory in (stagingDir, os.path.dirname(stagingDir)):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # doesn't exist or still in use
+            return
+
+
+def syncPath (path):
+    """
+    Description: syncPath flushes a file, or the entries of a directory, to
+    disk.  Filesystems which can't sync directories are ignored.
 
-    # Use CURL to download the file
-    import subprocess
+    Args:
+      path: file or directory to be flushed
+    """
     try:
-        # Setup CURL command using silent mode and change location if reported
-        args = ['curl', '--fail', '-sS', '-L', '--retry', '5',
-                '--retry-delay', '60', '--get', url]
-        for (k,v) in list(headers.items()):
-            args.extend(['-H', ': '.join([k, v])])
-        if out is None:
-            # python3's subprocess.check_output returns stdout as a
-            # byte string
-            result = subprocess.check_output(args)
-            return result.decode('utf-8') if isinstance(result, bytes) else result
-        else:
-            # download of the actual LAADS data product
-            retval = subprocess.call(args, stdout=out)
-
-            # make sure the download was successful or retry up to 5 more times
-            # and sleep in between
-            if retval:
-                retry_count = 1
-                while ((retry_count <= 5) and (retval)):
-                    time.sleep(60)
-                    logger.info('Retry {} of download for {}'
-                                .format(retry_count, url))
-                    retval = subprocess.call(args, stdout=out)
-                    retry_count += 1
-
-                if retval:
-                    logger.warn('Unsuccessful download of {} (retried 5 times)'
-                                .format(url))
-
-    except subprocess.CalledProcessError as e:
-        msg = ('curl GET error for URL (). {}:{}'
-               .format(url, e.message, e.output))
-        logger.error(msg)
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def publishGranule (viirs_anc, outputDir):
+    """
+    Description: publishGranule publishes a gap-filled file into the output
+    directory with an atomic rename, so readers of the output directory
+    never see a partial file.  A file staged on the same filesystem as the
+    output directory (--stage_in_output) is renamed into place.  Otherwise
+    it's first copied into the hidden staging directory of the output
+    directory and renamed from there.  The file is flushed before the
+    rename; the caller flushes the output directory afterwards.
+
+    Args:
+      viirs_anc: full path of the gap-filled file
+      outputDir: output directory of the year
+
+    Returns:
+        full path of the published file
+    """
+    viirs_name = Path(viirs_anc).name
+    published = os.path.join(outputDir, viirs_name)
+
+    staged = viirs_anc
+    if os.stat(viirs_anc).st_dev != os.stat(outputDir).st_dev:
+        stagingDir = getStagingDir(outputDir)
+        os.makedirs(stagingDir, 0o777, exist_ok=True)
+        staged = os.path.join(stagingDir, viirs_name)
+        shutil.copyfile(viirs_anc, staged)
+
+    syncPath(staged)
+    os.replace(staged, published)
+    if staged != viirs_anc:
+        os.remove(viirs_anc)
+
+    return published
+
+
+def parseShard (value):
+    """
+    Description: parseShard parses a shard specification.
+
+    Args:
+      value: shard as i/N, where i is 0-based and less than N
+
+    Returns:
+        (index, count) tuple
+
+    Raises:
+      ValueError: the shard isn't valid
+    """
+    (index, count) = [int(x) for x in value.split('/')]
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('shard {} is not i/N with 0 <= i < N'.format(value))
+
+    return (index, count)
+
+
+def getShard (value=None):
+    """
+    Description: getShard returns the shard of the work to be processed by
+    this run: the --shard value if it was specified, else the
+    AWS_BATCH_JOB_ARRAY_INDEX shard of LAADS_SHARD_COUNT for a child of an
+    AWS Batch array job.
+
+    Args:
+      value: --shard value (i/N), or None
+
+    Returns:
+        (index, count) tuple, or None to process all the work
+    """
+    if value is not None:
+        return parseShard(value)
+
+    index = os.environ.get('AWS_BATCH_JOB_ARRAY_INDEX')
+    if index is not None and SHARD_COUNT > 0:
+        return parseShard('{}/{}'.format(index, SHARD_COUNT))
 
     return None
 
 
-def getLadsData (auxdir, year, today, token):
+def inShard (year, doy, shard):
+    """
+    Description: inShard determines if a day belongs to a shard.  The days
+    are dealt out to the shards in date order, so every shard gets an even
+    share of each year, and the assignment doesn't depend on which days the
+    other shards plan to process.
+
+    Args:
+      year: year of LAADS data (integer)
+      doy: day of year of LAADS data (integer)
+      shard: (index, count) tuple, or None for all the days
+
+    Returns:
+        True if the day is in the shard
+    """
+    if shard is None:
+        return True
+
+    (index, count) = shard
+    ordinal = datetime.date(year, 1, 1).toordinal() + doy - 1
+    return ordinal % count == index
+
+
+def getJobName (shard=None):
+    """
+    Description: getJobName returns the name of the run used for its
+    metrics and publish list, so shards don't overwrite each other's.
+    """
+    if shard is None:
+        return 'updatelads'
+
+    return 'updatelads_shard_{}_of_{}'.format(*shard)
+
+
+def getOutputDir (auxdir, year):
+    """
+    Description: getOutputDir returns the directory of the gap-filled LAADS
+    files for the year.
+    """
+    return '{}/LADS/{}'.format(auxdir, year)
+
+
+def getPlanDays (year, now):
+    """
+    Description: getPlanDays determines the days of the year which can be
+    processed.  If the specified year is the current year, only process up
+    through today (actually 2 days earlier due to the LAADS data lag)
+    otherwise process through all the days in the year.  The days are in
+    reverse order so that if we are handling data for "today", then the
+    most recent days are downloaded first.
+
+    Args:
+      year: year of LAADS data (integer)
+      now: datetime of the run
+
+    Returns:
+        list of the DOYs to be considered, most recent first
+    """
+    if year == now.year:
+        # start processing LAADS data with a 2-day time lag. if the 2-day lag
+        # puts us into last year, then we are done with the current year.
+        day_of_year = now.timetuple().tm_yday - 2
+        if day_of_year <= 0:
+            return []
+    else:
+        if calendar.isleap(year):
+            day_of_year = 366
+        else:
+            day_of_year = 365
+
+    return list(range(day_of_year, 0, -1))
+
+
+def checkDay (year, doy, outputDir, outputIndex, listing, token, manifest,
+              reconcile=False, adopt=True):
     """
-    Description: getLadsData downloads the daily VIIRS atmosphere data files
-    for the desired year.
+    Description: checkDay compares the LAADS listing for the day against the
+    manifest and the published files to determine whether the day needs to
+    be reprocessed.  A granule has changed if its production time (part of
+    the name), size or modification time differ from the published granule,
+    which is the same check the downloads make.  With reconcile the ETags
+    are compared as well, and published granules which aren't in the
+    manifest yet are treated as current since the matching name means the
+    production time is unchanged.
+
+    Args:
+      year: year of LAADS data (integer)
+      doy: day of year of LAADS data (integer)
+      outputDir: output directory of the year
+      outputIndex: GranuleIndex of the output directory
+      listing: LadsListing of the day
+      token: application token for the desired website
+      manifest: GranuleManifest of the processed granules
+      reconcile: if True, also compare the ETags and the published files
+      adopt: if True, add the published granules which aren't in the
+             manifest yet to it (False for a dry run)
+
+    Returns:
+        ERROR: error occurred while getting an ETag
+        UNCHANGED: the published granules are current
+        SUCCESS: the day has changed and needs to be processed
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    published = outputIndex.find(listing.product, year, doy)
+    for entry in listing.entries:
+        name = entry['name']
+        url = listing.url + '/' + name
+        size = listingSize(entry)
+        last_modified = entry.get('last_modified')
+
+        recorded = manifest.get(name)
+        if reconcile and recorded is None and name in published:
+            if not adopt:
+                continue
+            manifest.adoptPublished(name, url, size, last_modified,
+                                    os.path.join(outputDir, name))
+            recorded = manifest.get(name)
+
+        # the listing doesn't include the ETag, so only ask for it if there
+        # is one to compare against
+        etag = None
+        if reconcile and recorded is not None and recorded['etag']:
+            info = {}
+            try:
+                geturl(url, token, info=info, method='HEAD')
+            except DownloadError as e:
+                logger.error('Unable to get the ETag of {}. {}'.format(url, e))
+                return ERROR
+            etag = info.get('etag')
+
+        if not manifest.isCurrent(name, size, last_modified, etag):
+            return SUCCESS
+
+    return UNCHANGED
+
+
+def planLadsWork (auxdir, years, today, token, manifest=None, force=False,
+                  reconcile=False, workers=DOWNLOAD_WORKERS, adopt=True,
+                  shard=None):
+    """
+    Description: planLadsWork works out everything a run will do for the
+    desired years before anything is downloaded or written: which days need
+    to be downloaded and gap-filled, which are skipped and why, and which
+    product each day will use (the NPP product is the fallback when the
+    JPSS1 product isn't available).  Only the output directories and the
+    LAADS listings are read.  The listings are fetched concurrently and kept
+    in the plan so the run doesn't fetch them again.
 
     Args:
       auxdir: name of the base LASRC_SR auxiliary directory which contains the
               LAADS directory
-      year: year of LAADS data to be downloaded and processed (integer)
+      years: list of years of LAADS data to be processed (integers)
       today: specifies if we are just bringing the LAADS data up to date vs.
              reprocessing the data
       token: application token for the desired website
+      manifest: GranuleManifest of the processed granules.  Days whose
+                granules are already published unchanged are skipped.
+      force: if True, process days even if the manifest shows they are
+             unchanged
+      reconcile: if True, also compare the ETags against the manifest (see
+                 checkDay)
+      workers: number of listings to fetch concurrently
+      adopt: if True, add published granules missing from the manifest to
+             it while reconciling (False for a dry run)
+      shard: (index, count) tuple to only plan the days of that shard (see
+             inShard), or None to plan all the days
 
     Returns:
-        ERROR: error occurred while processing
-        SUCCESS: processing completed successfully
+        (ERROR, None): error occurred while getting the listings
+        (SUCCESS, plan): dict of the plan (see the PLAN_* actions), which
+                         can be written as JSON with writePlan
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    now = datetime.datetime.now()
+    days = []
+    candidates = []
+    for year in years:
+        # the output directory is only read, so it may not exist yet
+        outputDir = getOutputDir(auxdir, year)
+        outputIndex = GranuleIndex(outputDir)
+        for doy in getPlanDays(year, now):
+            if not inShard(year, doy, shard):
+                continue
+            day = {'year': year, 'doy': doy, 'action': PLAN_PROCESS,
+                   'reason': 'new', 'product': None, 'listing': None}
+            days.append(day)
+
+            # if the JPSS1 data for the current year and doy exists already,
+            # then we are going to skip that file if processing for the
+            # --today.  For --quarterly, we will completely reprocess.  If
+            # the backup NPP product exists without the JPSS1, then we will
+            # still reprocess in hopes that the JPSS1 product becomes
+            # available.
+            if outputIndex.find('VJ104ANC', year, doy):
+                if today:
+                    msg = ('JPSS1 product for VJ104ANC.A{}{:03d} already '
+                           'exists. Skip.'.format(year, doy))
+                    logger.info(msg)
+                    day['action'] = PLAN_SKIP
+                    day['reason'] = 'published'
+                    continue
+                day['reason'] = 'reprocess'
+            elif outputIndex.find('VNP04ANC', year, doy):
+                day['reason'] = 'npp_published'
+            candidates.append((day, outputDir, outputIndex))
+
+    def planDay (candidate):
+        # list the day on LAADS to pick the product, then check the
+        # listing against the manifest
+        (day, outputDir, outputIndex) = candidate
+        (status, listing) = listLads (day['year'], day['doy'], token)
+        if status == ERROR:
+            return ERROR
+        if listing is None:
+            msg = ('Neither the JPSS1 nor NPP data is available for doy {} '
+                   'year {}. Skipping this date.'
+                   .format(day['doy'], day['year']))
+            logger.warning(msg)
+            day['action'] = PLAN_MISSING
+            day['reason'] = 'not_available'
+            return SUCCESS
+
+        day['product'] = listing.product
+        day['listing'] = listing._asdict()
+        if manifest is not None and not force:
+            status = checkDay (day['year'], day['doy'], outputDir,
+                               outputIndex, listing, token, manifest,
+                               reconcile, adopt)
+            if status == ERROR:
+                return ERROR
+            if status == UNCHANGED:
+                day['action'] = PLAN_SKIP
+                day['reason'] = 'unchanged'
+            elif day['reason'] == 'reprocess':
+                day['reason'] = 'changed'
+        return SUCCESS
+
+    with METRICS.timer('plan'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) \
+                as executor:
+            statuses = list(executor.map(planDay, candidates))
+    if ERROR in statuses:
+        return (ERROR, None)
+
+    summary = summarizePlan(days)
+    msg = ('Planned {} days: {} to process ({} from NPP), {} skipped, {} '
+           'not available'.format(len(days), summary[PLAN_PROCESS],
+                                  summary['npp_fallback'], summary[PLAN_SKIP],
+                                  summary[PLAN_MISSING]))
+    logger.info(msg)
+    METRICS.count('days_planned', len(days))
+    METRICS.count('days_skipped', summary[PLAN_SKIP])
+    METRICS.count('days_missing', summary[PLAN_MISSING])
+
+    plan = {
+        'created': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'auxdir': auxdir,
+        'years': list(years),
+        'today': today,
+        'force': force,
+        'reconcile': reconcile,
+        'shard': list(shard) if shard is not None else None,
+        'summary': summary,
+        'days': days,
+    }
+    return (SUCCESS, plan)
+
+
+def summarizePlan (days):
+    """
+    Description: summarizePlan counts the days of a plan by action, and the
+    NPP fallbacks and bytes to download of the days to be processed, for
+    sizing the run.
+
+    Args:
+      days: list of the days of the plan
+
+    Returns:
+        dict of the counts
+    """
+    process = [day for day in days if day['action'] == PLAN_PROCESS]
+    summary = collections.Counter(day['action'] for day in days)
+    summary['npp_fallback'] = len([day for day in process
+                                   if day['product'] == 'VNP04ANC'])
+    summary['download_bytes'] = sum(listingSize(entry) or 0
+                                    for day in process if day['listing']
+                                    for entry in day['listing']['entries'])
+    for action in (PLAN_PROCESS, PLAN_SKIP, PLAN_MISSING):
+        summary.setdefault(action, 0)
+
+    return dict(summary)
+
+
+def shardPlan (plan, shard):
+    """
+    Description: shardPlan returns the part of a plan (e.g. a saved plan of
+    a full reprocess) with the days of a shard.
+
+    Args:
+      plan: dict of the plan from planLadsWork or readPlan
+      shard: (index, count) tuple
+
+    Returns:
+        dict of the plan of the shard
+    """
+    days = [day for day in plan['days']
+            if inShard(day['year'], day['doy'], shard)]
+    sharded = dict(plan)
+    sharded.update({'shard': list(shard), 'summary': summarizePlan(days),
+                    'days': days})
+    return sharded
+
+
+def writePlan (plan, path):
+    """
+    Description: writePlan writes the plan as JSON.  The file is written to
+    a temporary name and renamed so a reader never sees a partial plan.
+
+    Args:
+      plan: dict of the plan from planLadsWork
+      path: file to write, or - for stdout
+    """
+    text = json.dumps(plan, indent=2) + '\n'
+    if path == '-':
+        sys.stdout.write(text)
+        return
+
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as fh:
+        fh.write(text)
+    os.rename(tmp, path)
+
+
+def readPlan (path):
+    """
+    Description: readPlan reads a plan written by writePlan.
+
+    Returns:
+        dict of the plan
+    """
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def prepareYear (auxdir, year, stage_in_output=STAGE_IN_OUTPUT, shard=None):
+    """
+    Description: prepareYear creates the output and download directories for
+    the year (and cleans the download directory) before its days are
+    processed.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory which contains the
+              LAADS directory
+      year: year of LAADS data to be processed (integer)
+      stage_in_output: if True, download into this run's staging directory
+                       in the output directory rather than /tmp/lads
+      shard: (index, count) tuple of the shard being processed.  each shard
+             downloads into its own directory in /tmp/lads.
+
+    Returns:
+        (dloaddir, outputDir, dloadIndex, outputIndex)
     """
     # get the logger
     logger = logging.getLogger(__name__)
 
     # determine the directory for the output auxiliary data files to be
     # processed.  create the directory if it doesn't exist.
-    outputDir = '{}/LADS/{}'.format(auxdir, year)
+    outputDir = getOutputDir(auxdir, year)
     if not os.path.exists(outputDir):
         msg = '{} does not exist... creating'.format(outputDir)
         logger.info(msg)
-        os.makedirs(outputDir, 0o777)
+        os.makedirs(outputDir, 0o777, exist_ok=True)
 
-    # if the specified year is the current year, only process up through
-    # today (actually 2 days earlier due to the LAADS data lag) otherwise
-    # process through all the days in the year
-    now = datetime.datetime.now()
-    if year == now.year:
-        # start processing LAADS data with a 2-day time lag. if the 2-day lag
-        # puts us into last year, then we are done with the current year.
-        day_of_year = now.timetuple().tm_yday - 2
-        if day_of_year <= 0:
-            return SUCCESS
+    # set the download directory in /tmp/lads, or in the staging directory
+    # on the output filesystem so the files are published with a rename
+    cleanStagingDirs(outputDir)
+    if stage_in_output:
+        dloaddir = getStagingDir(outputDir)
+    elif shard is not None:
+        dloaddir = '/tmp/lads/shard_{}_of_{}/{}'.format(shard[0], shard[1],
+                                                        year)
     else:
-        if calendar.isleap(year):
-            day_of_year = 366   
-        else:
-            day_of_year = 365
-
-    # set the download directory in /tmp/lads
-    dloaddir = '/tmp/lads/{}'.format(year)
+        dloaddir = '/tmp/lads/{}'.format(year)
 
     # make sure the download directory exists or create it and all necessary
-    # parent directories
+    # parent directories.  it may be shared with another run, so the old
+    # files of each day are cleaned up once the day is locked (see cleanDay)
     if not os.path.exists(dloaddir):
         msg = '{} does not exist... creating'.format(dloaddir)
         logger.info(msg)
-        os.makedirs(dloaddir, 0o777)
+        os.makedirs(dloaddir, 0o777, exist_ok=True)
     else:
-        # directory already exists and possibly has files in it.  any old
-        # files need to be cleaned up
-        msg = 'Cleaning download directory: {}'.format(dloaddir)
-        logger.info(msg)
+        # remove the partial downloads which are too old to be resumed
         for myfile in os.listdir(dloaddir):
             name = os.path.join(dloaddir, myfile)
-            if not os.path.isdir(name):
-                os.remove(name)
-
-    # loop through each day in the year and process the LAADS data.  process
-    # in the reverse order so that if we are handling data for "today", then
-    # we can stop as soon as we find the current DOY has been processed.
-    for doy in range(day_of_year, 0, -1):
-        # get the year + DOY string
-        datestr = '{}{:03d}'.format(year, doy)
-
-        # if the JPSS1 data for the current year and doy exists already, then
-        # we are going to skip that file if processing for the --today.  For
-        # --quarterly, we will completely reprocess.  If the backup NPP
-        # product exists without the JPSS1, then we will still reprocess in
-        # hopes that the JPSS1 product becomes available.
-        skip_date = False
-        for myfile in os.listdir(outputDir):
-            if fnmatch.fnmatch (myfile, 'VJ104ANC.A{}*.h5'.format(datestr)) \
-                    and today:
-                msg = ('JPSS1 product for VJ104ANC.A{} already exists. Skip.'
-                       .format(datestr))
-                logger.info(msg)
-                skip_date = True
-                break
+            try:
+                if name.endswith(PART_SUFFIX) and not isResumable(name):
+                    os.remove(name)
+            except FileNotFoundError:
+                # removed by another run
+                pass
 
-        if skip_date:
+    # index the files in the output and download directories once rather
+    # than listing the directories for every day
+    return (dloaddir, outputDir, GranuleIndex(dloaddir),
+            GranuleIndex(outputDir))
+
+
+def getLadsWork (auxdir, plan, stage_in_output=STAGE_IN_OUTPUT):
+    """
+    Description: getLadsWork returns the work for the days of the plan which
+    need to be processed.  The directories of each year are prepared as part
+    of this.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory which contains the
+              LAADS directory
+      plan: dict of the plan from planLadsWork or readPlan
+      stage_in_output: if True, download into this run's staging directory
+                       in the output directory rather than /tmp/lads
+
+    Returns:
+        list of LadsWork items, one per day to be processed
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    shard = plan.get('shard')
+    if shard is not None:
+        shard = tuple(shard)
+
+    workList = []
+    years = {}
+    for day in plan['days']:
+        if day['action'] != PLAN_PROCESS:
             continue
 
-        # download the daily LAADS files for the specified year and DOY. The
-        # JPSS1 file is the priority, but if that isn't found then the NPP
-        # file will be downloaded.
-        found_vj104anc = False
-        found_vnp04anc = False
-        status = downloadLads (year, doy, dloaddir, token)
-        if status == ERROR:
-            # warning message already printed
-            return ERROR
+        year = day['year']
+        if year not in years:
+            msg = 'Processing year: {}'.format(year)
+            logger.info(msg)
+            years[year] = prepareYear (auxdir, year, stage_in_output,
+                                       shard)
+        (dloaddir, outputDir, dloadIndex, outputIndex) = years[year]
 
-        # get the JPSS1 file for the current DOY (should only be one)
-        fileList = []    # create empty list to store files matching date
-        for myfile in os.listdir(dloaddir):
-            if fnmatch.fnmatch (myfile, 'VJ104ANC.A{}*.h5'.format(datestr)):
-                fileList.append (myfile)
+        listing = None
+        if day['listing'] is not None:
+            listing = LadsListing(**day['listing'])
+        workList.append(LadsWork(year, day['doy'], dloaddir, outputDir,
+                                 dloadIndex, outputIndex, listing))
 
-        # make sure files were found or search for the NPP file
-        nfiles = len(fileList)
-        if nfiles == 0:
-            # get the NPP file for the current DOY (should only be one)
-            for myfile in os.listdir(dloaddir):
-                if fnmatch.fnmatch (myfile, 'VNP04ANC.A{}*.h5'
-                                    .format(datestr)):
-                    fileList.append (myfile)
-
-            # make sure files were found
-            nfiles = len(fileList)
-            if nfiles != 0:
-                # if only one file was found which matched our date, then that
-                # is the file we'll process.  if more than one was found, then
-                # we have a problem as only one file is expected.
-                if nfiles == 1:
-                    found_vnp04anc = True
-                    viirs_anc = dloaddir + '/' + fileList[0]
-                else:
-                    msg = ('Multiple LAADS VNP04ANC files found for doy {} '
-                           'year {}'.format(doy, year))
-                    logger.error(msg)
-                    return ERROR
+    return workList
 
-        else:
-            # if only one file was found which matched our date, then that's
-            # the file we'll process.  if more than one was found, then we
-            # have a problem as only one file is expected.
-            if nfiles == 1:
-                found_vj104anc = True
-                viirs_anc = dloaddir + '/' + fileList[0]
-            else:
-                msg = ('Multiple LAADS VJ104ANC files found for doy {} year {}'
-                       .format(doy, year))
-                logger.error(msg)
-                return ERROR
+
+def putStage (stageQueue, item, abort):
+    """
+    Description: putStage hands an item to the next stage of the pipeline,
+    waiting while the stage's queue is full.  Gives up if the pipeline has
+    been aborted so a failed stage can't leave its producers blocked.
+
+    Args:
+      stageQueue: bounded queue feeding the next stage
+      item: item to be queued
+      abort: threading.Event which is set when the pipeline has failed
+
+    Returns:
+        True: item was queued
+        False: pipeline was aborted before the item could be queued
+    """
+    while not abort.is_set():
+        try:
+            stageQueue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def getLadsData (auxdir, plan, token, workers=DOWNLOAD_WORKERS,
+                 gapfill_workers=GAPFILL_WORKERS, manifest=None, force=False,
+                 publish_workers=PUBLISH_WORKERS,
+                 stage_in_output=STAGE_IN_OUTPUT):
+    """
+    Description: getLadsData executes a plan from planLadsWork, downloading
+    the daily VIIRS atmosphere data files for the days to be processed.  The
+    days are run through a staged pipeline with bounded queues between the
+    stages:
+      1. a pool of download workers pulls the daily files from LAADS,
+      2. a pool of gap-fill workers (one per core by default) runs
+         gapfill_viirs_aux on each file as soon as it lands,
+      3. a publisher flushes the gap-filled files into LADS/<year> in
+         batches, renaming several files into place at a time.
+    Running every year through one pipeline keeps all the stages busy for
+    multi-year reprocessing.
+
+    Args:
+      auxdir: name of the base LASRC_SR auxiliary directory which contains the
+              LAADS directory
+      plan: dict of the plan from planLadsWork or readPlan
+      token: application token for the desired website
+      workers: number of days to download concurrently
+      gapfill_workers: number of gapfill_viirs_aux processes to run
+                       concurrently
+      manifest: GranuleManifest where the processed granules are recorded.
+                Days whose granules are already published unchanged are
+                skipped.
+      force: if True, reprocess days even if the manifest shows they are
+             unchanged
+      publish_workers: number of files to publish concurrently
+      stage_in_output: if True, download and gap-fill in a staging
+                       directory on the output filesystem (see
+                       publishGranule)
+
+    Returns:
+        ERROR: error occurred while processing
+        SUCCESS: processing completed successfully
+    """
+    # get the logger
+    logger = logging.getLogger(__name__)
+
+    # the days of the plan to be processed
+    workList = getLadsWork (auxdir, plan, stage_in_output)
+    METRICS.count('days_queued', len(workList))
+
+    # queues between the pipeline stages.  these are bounded so downloads
+    # can't run too far ahead of gap-filling and fill up /tmp.
+    gapfillQueue = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+    publishQueue = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+    abort = threading.Event()
+
+    def download (work):
+        # download stage: pull the daily LAADS files for this date.  skip
+        # the day if another run is processing it.
+        if abort.is_set():
+            return
+        lock = getDayLock(work)
+        if not LOCKS.acquire(lock):
+            msg = ('Doy {} year {} is being processed by another run. Skip.'
+                   .format(work.doy, work.year))
+            logger.info(msg)
+            METRICS.count('days_locked')
+            return
+
+        # the lock is held until the day is published, unless it doesn't
+        # make it to the gap-fill stage
+        queued = False
+        try:
+            queued = downloadDay (work, lock)
+        finally:
+            if not queued:
+                LOCKS.release(lock)
+
+    def downloadDay (work, lock):
+        # the download of a day whose lock is held.  returns True if the
+        # day was handed to the gap-fill stage.
+        try:
+            with METRICS.timer('download'):
+                (status, viirs_anc) = downloadDoy (work, token, manifest,
+                                                   force)
+        except Exception:
+            logger.exception('Download failed for doy {} year {}'
+                             .format(work.doy, work.year))
+            status = ERROR
+        if status == ERROR:
+            # error message already printed
+            abort.set()
+            cancelDownloads()
+            return False
+        if status == UNCHANGED:
+            METRICS.count('days_unchanged')
+            return False
 
         # make sure at least one of the JPSS1 or NPP files is present
-        if not found_vj104anc and not found_vnp04anc:
+        if viirs_anc is None:
             msg = ('Neither the JPSS1 nor NPP data is available for doy {} '
-                   'year {}. Skipping this date.'.format(doy, year))
+                   'year {}. Skipping this date.'.format(work.doy, work.year))
             logger.warning(msg)
-            continue
+            METRICS.count('days_missing')
+            return False
 
-        # determine the month and day (both 1-based) for this year/doy date
-        # indx will be 0-based for the array
-        if calendar.isleap(year):
-            for indx in range(0, len(ldayEOM)):
-                if doy <= ldayEOM[indx]:
-                    break;
-            month = indx+1
-            day = doy - ldaySOM[indx] + 1
-        else:
-            for indx in range(0, len(rdayEOM)):
-                if doy <= rdayEOM[indx]:
-                    break;
-            month = indx+1
-            day = doy - rdaySOM[indx] + 1
-
-        # generate the command-line arguments and executable for gap-filling
-        # the VIIRS product (works the same for either VJ104ANC or VNP04ANC)
-        cmdstr = ('gapfill_viirs_aux --viirs_aux {} --month {} --day {} '
-                  '--year {}'.format(viirs_anc, month, day, year))
-        msg = 'Executing {}'.format(cmdstr)
-        logger.info(msg)
-        (status, output) = subprocess.getstatusoutput (cmdstr)
-        logger.info(output)
-        exit_code = status >> 8
-        if exit_code != 0:
-            msg = ('Error running gap_fill for year {}, DOY {}: {}'
-                   .format(year, doy, cmdstr))
-            logger.error(msg)
-            return ERROR
+        return putStage (gapfillQueue, (work, viirs_anc), abort)
+
+    def gapfill ():
+        # gap-fill stage: consume until the sentinel is received.  keep
+        # draining the queue after an abort so producers never block.
+        while True:
+            item = gapfillQueue.get()
+            if item is None:
+                break
+            if abort.is_set():
+                continue
+
+            (work, viirs_anc) = item
+            viirs_name = Path(viirs_anc).name
+            checksum = None
+            try:
+                with METRICS.timer('gapfill'):
+                    status = gapfillViirsAnc (viirs_anc, work.year, work.doy)
+                if status == SUCCESS and manifest is not None:
+                    # checksum the local copy rather than rereading it
+                    # from the output directory once it's published
+                    with METRICS.timer('checksum'):
+                        checksum = fileChecksum(viirs_anc)
+            except Exception:
+                logger.exception('Gap-filling failed for {}'.format(viirs_anc))
+                status = ERROR
+            if status == ERROR:
+                METRICS.count('gapfill_failures')
+                if manifest is not None:
+                    manifest.setStatus(viirs_name, GAPFILL_FAILED)
+                abort.set()
+                cancelDownloads()
+                continue
+
+            METRICS.count('files_gapfilled')
+            if manifest is not None:
+                manifest.setStatus(viirs_name, GAPFILLED)
+            putStage (publishQueue, (work, viirs_anc, checksum), abort)
 
-        # move the gap-filled file to the output directory
-        msg = ('Moving downloaded file {} to {}'
-               .format(viirs_anc, outputDir))
+    def publishOne (item):
+        # rename one gap-filled file into the output directory
+        if abort.is_set():
+            return
+        (work, viirs_anc, checksum) = item
+        msg = ('Publishing downloaded file {} to {}'
+               .format(viirs_anc, work.outputDir))
         logger.debug(msg)
         viirs_name = Path(viirs_anc).name
-        shutil.move(viirs_anc, os.path.join(outputDir, viirs_name))
+        lock = getDayLock(work)
+        if not LOCKS.isHeld(lock):
+            # the lease ran out and another run took the day over
+            msg = ('Lost the lock of doy {} year {} to another run. Not '
+                   'publishing {}'.format(work.doy, work.year, viirs_name))
+            logger.warning(msg)
+            return
+        try:
+            with METRICS.timer('publish'):
+                published = publishGranule (viirs_anc, work.outputDir)
+            work.dloadIndex.remove(viirs_name)
+            work.outputIndex.add(viirs_name)
+            if manifest is not None:
+                manifest.recordPublished(viirs_name, published, checksum)
+            PUBLISHED.record(published)
+            METRICS.count('files_published')
+        except Exception:
+            logger.exception('Failed to publish {} to {}'
+                             .format(viirs_anc, work.outputDir))
+            abort.set()
+            cancelDownloads()
+        finally:
+            LOCKS.release(lock)
+
+    def publish ():
+        # publish stage: flush whatever has been gap-filled (up to
+        # publish_workers files) as one batch, renaming the files
+        # concurrently, then flush the output directories once per batch so
+        # the renames are durable
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=publish_workers) as executor:
+            done = False
+            while not done:
+                batch = []
+                item = publishQueue.get()
+                while True:
+                    if item is None:
+                        done = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= publish_workers:
+                        break
+                    try:
+                        item = publishQueue.get_nowait()
+                    except queue.Empty:
+                        break
+                if not batch or abort.is_set():
+                    continue
+
+                with METRICS.timer('publish_batch'):
+                    list(executor.map(publishOne, batch))
+                    for outputDir in set(work.outputDir
+                                         for (work, _, _) in batch):
+                        syncPath(outputDir)
+                METRICS.count('publish_batches')
+
+    # start the consumers before the downloads begin
+    gapfillThreads = [threading.Thread(target=gapfill)
+                      for i in range(gapfill_workers)]
+    publishThread = threading.Thread(target=publish)
+    for thread in gapfillThreads:
+        thread.start()
+    publishThread.start()
+
+    # run the downloads, then shut the downstream stages down in order so
+    # everything already downloaded is gap-filled and published
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) \
+            as executor:
+        list(executor.map(download, workList))
 
-    # end for doy
+    for thread in gapfillThreads:
+        gapfillQueue.put(None)
+    for thread in gapfillThreads:
+        thread.join()
+    publishQueue.put(None)
+    publishThread.join()
+
+    # release the locks of the days which didn't make it through the
+    # pipeline (e.g. after an abort)
+    LOCKS.releaseAll()
+    for outputDir in set(work.outputDir for work in workList):
+        removeStagingDir(outputDir)
+
+    if abort.is_set():
+        return ERROR
 
     return SUCCESS
 
@@ -318,10 +1186,21 @@ def getLadsData (auxdir, year, today, token):
 #    reprocessed.
 # 3. --quarterly will process the data for today all the way back to the
 #    earliest year so that any updated LAADS files are picked up and
-#    processed.  Thus this option is used for quarterly updates.
+#    processed.  Thus this option is used for quarterly updates.  The LAADS
+#    listings are reconciled against the manifest first (--reconcile), so
+#    only the days with new or updated granules are downloaded and
+#    gap-filled.  Use --force for a full rebuild.
 # 4. Existing LAADS HDF files are removed before processing data for that
 #    year and DOY, but only if the downloaded auxiliary data exists for that
 #    date.
+# 5. Every published granule is recorded in the manifest (LADS/
+#    laads_manifest.db, see laads_manifest.py) through a local working copy
+#    which is merged back at the end of the run.  Days whose granules on LAADS
+#    have the same name (production time) and size as the published ones are
+#    skipped, unless --force is specified.
+# 6. The work is planned before anything is downloaded (see planLadsWork).
+#    --dry_run writes the plan as JSON without downloading or writing any
+#    data, and --plan runs a plan written earlier.
 ############################################################################
 def main ():
     logger = logging.getLogger(__name__)  # Get logger for the module.
@@ -335,25 +1214,87 @@ def main ():
     parser.add_option ('--today', dest='today', default=False,
         action='store_true',
         help='process LAADS data up through the most recent year and DOY')
+    parser.add_option ('--reconcile', dest='reconcile', default=False,
+        action='store_true',
+        help='compare the LAADS listings against the manifest up front and '
+             'only process the days which have changed (always done for '
+             '--quarterly)')
+    parser.add_option ('--force', dest='force', default=False,
+        action='store_true',
+        help='reprocess LAADS data even if the manifest shows it has already '
+             'been published and is unchanged')
+    parser.add_option ('--workers', type='int', dest='workers',
+        default=DOWNLOAD_WORKERS,
+        help='number of days of LAADS data to download concurrently '
+             '(default is {})'.format(DOWNLOAD_WORKERS))
+    parser.add_option ('--gapfill_workers', type='int',
+        dest='gapfill_workers', default=GAPFILL_WORKERS,
+        help='number of gapfill_viirs_aux processes to run concurrently '
+             '(default is {})'.format(GAPFILL_WORKERS))
+    parser.add_option ('--publish_workers', type='int',
+        dest='publish_workers', default=PUBLISH_WORKERS,
+        help='number of gap-filled files to publish concurrently '
+             '(default is {})'.format(PUBLISH_WORKERS))
+    parser.add_option ('--stage_in_output', dest='stage_in_output',
+        default=STAGE_IN_OUTPUT, action='store_true',
+        help='download and gap-fill in a hidden staging directory in the '
+             'output directory rather than /tmp/lads, so the files are '
+             'published with a rename rather than a copy')
     msg = ('process or reprocess all LAADS data from today back to {}'
            .format(JPSS1_START_YEAR))
     parser.add_option ('--quarterly', dest='quarterly', default=False,
         action='store_true', help=msg)
+    parser.add_option ('--dry_run', dest='dry_run', default=False,
+        action='store_true',
+        help='plan the work (the days to process or skip and the product '
+             'of each day) and write the plan as JSON without downloading '
+             'or writing any data')
+    parser.add_option ('--plan_output', dest='plan_output', default=None,
+        help='file to write the plan to (default is stdout for --dry_run)')
+    parser.add_option ('--plan', dest='plan_file', default=None,
+        help='run the plan in this JSON file (from --dry_run) rather than '
+             'planning the work')
+    parser.add_option ('--shard', dest='shard', default=None,
+        help='only process shard i/N of the days (0 <= i < N), e.g. for the '
+             'children of an AWS Batch array job.  Defaults to '
+             'AWS_BATCH_JOB_ARRAY_INDEX/LAADS_SHARD_COUNT if both are set.')
 
     (options, args) = parser.parse_args()
     syear = options.syear           # starting year
     eyear = options.eyear           # ending year
     today = options.today           # process most recent year of data
     quarterly = options.quarterly   # process today back to START_YEAR
+    workers = options.workers       # number of concurrent downloads
+    gapfill_workers = options.gapfill_workers  # number of gap-fill processes
+    force = options.force           # ignore the manifest of processed data
+    reconcile = options.reconcile   # only process days changed on LAADS
+    publish_workers = options.publish_workers  # number of concurrent renames
+    stage_in_output = options.stage_in_output  # stage on the output fs
+    dry_run = options.dry_run       # only plan the work
+    plan_output = options.plan_output  # where to write the plan
+    if dry_run and plan_output is None:
+        plan_output = '-'
+    try:
+        shard = getShard(options.shard)  # part of the days to process
+    except ValueError as e:
+        msg = 'Invalid --shard or LAADS_SHARD_COUNT: {}'.format(e)
+        logger.error(msg)
+        return ERROR
 
     # check the arguments
-    if (today == False) and (quarterly == False) and \
-       (syear == 0 or eyear == 0):
+    if options.plan_file is None and (today == False) and \
+       (quarterly == False) and (syear == 0 or eyear == 0):
         msg = ('Invalid command line argument combination.  Type --help '
               'for more information.')
         logger.error(msg)
         return ERROR
 
+    if workers < 1 or gapfill_workers < 1 or publish_workers < 1:
+        msg = ('--workers, --gapfill_workers and --publish_workers must be '
+               'at least 1.')
+        logger.error(msg)
+        return ERROR
+
     # determine the auxiliary directory to store the data
     auxdir = os.environ.get('LASRC_AUX_DIR')
     if auxdir is None:
@@ -385,11 +1326,26 @@ def main ():
             'https://ladsweb.modaps.eosdis.nasa.gov/tools-and-services/data-download-scripts/')
         return ERROR
 
+    # a saved plan has the years and the days to be processed
+    plan = None
+    if options.plan_file is not None:
+        plan = readPlan(options.plan_file)
+        (syear, eyear) = (min(plan['years']), max(plan['years']))
+        force = force or plan['force']
+        today = plan['today']
+        reconcile = plan['reconcile']
+        if shard is not None:
+            plan = shardPlan(plan, shard)
+        msg = ('Running the plan in {} ({} days to process)'
+               .format(options.plan_file, plan['summary'].get(PLAN_PROCESS,
+                                                               0)))
+        logger.info(msg)
+
     # if processing today then process the current year.  if the current
     # DOY is within the first month, then process the previous year as well
     # to make sure we have all the recently available data processed.
     now = datetime.datetime.now()
-    if today:
+    if plan is None and today:
         msg = 'Processing LAADS data up to the most recent year and DOY.'
         logger.info(msg)        
         day_of_year = now.timetuple().tm_yday
@@ -399,23 +1355,97 @@ def main ():
         else:
             syear = eyear
 
-    elif quarterly:
+    elif plan is None and quarterly:
         msg = 'Processing LAADS data back to {}'.format(JPSS1_START_YEAR)
         logger.info(msg)
         eyear = now.year
         syear = JPSS1_START_YEAR
+        reconcile = True
 
     msg = 'Processing LAADS data for {} - {}'.format(syear, eyear)
     logger.info(msg)
-    for yr in range(eyear, syear-1, -1):
-        msg = 'Processing year: {}'.format(yr)
+    if shard is not None:
+        msg = 'Processing shard {} of {} of the days'.format(*shard)
         logger.info(msg)
-        status = getLadsData(auxdir, yr, today, token)
-        if status == ERROR:
-            msg = ('Problems occurred while processing LAADS data for year {}'
-                   .format(yr))
-            logger.error(msg)
-            return ERROR
+
+    # all the downloads share one keep-alive session with a connection for
+    # each download worker
+    getSession(pool_size=workers)
+
+    # the manifest records every granule published so reruns can skip the
+    # granules which haven't changed on LAADS.  the run works on a local
+    # copy which is merged back at the end (see laads_manifest.py).  a dry
+    # run opens the shared manifest (or its snapshot) read-only in place,
+    # without the lock or a copy, if there is one.
+    manifestPath = getManifestPath(auxdir)
+    manifest = None
+    try:
+        if not dry_run:
+            if not os.path.exists(os.path.dirname(manifestPath)):
+                os.makedirs(os.path.dirname(manifestPath), 0o777,
+                            exist_ok=True)
+            manifest = openWorkingCopy(manifestPath)
+        elif os.path.exists(manifestPath):
+            manifest = GranuleManifest(manifestPath, readonly=True)
+        elif os.path.exists(getSnapshotPath(manifestPath)):
+            manifest = GranuleManifest(getSnapshotPath(manifestPath),
+                                       readonly=True)
+    except (IOError, OSError, sqlite3.Error) as e:
+        msg = 'Unable to open the manifest {}: {}'.format(manifestPath, e)
+        logger.error(msg)
+        closeSession()
+        return ERROR
+
+    # work out what to do before anything is downloaded
+    status = SUCCESS
+    if plan is None:
+        (status, plan) = planLadsWork(auxdir, range(eyear, syear-1, -1),
+                                      today, token, manifest, force,
+                                      reconcile, workers, adopt=not dry_run,
+                                      shard=shard)
+    if status == SUCCESS and plan_output is not None:
+        writePlan(plan, plan_output)
+
+    if dry_run:
+        if manifest is not None:
+            manifest.close()
+        closeSession()
+        return status
+
+    if status == SUCCESS:
+        status = getLadsData(auxdir, plan, token, workers, gapfill_workers,
+                             manifest, force, publish_workers,
+                             stage_in_output)
+    closeSession()
+
+    # merge the granules of this run into the shared manifest.  if that
+    # fails, the next run adopts the published granules missing from it,
+    # and the metrics and publish list below are still written.
+    try:
+        PUBLISHED.record(mergeWorkingCopy(manifest, manifestPath))
+    except Exception:
+        msg = ('Unable to merge {} into the manifest {}'
+               .format(manifest.path, manifestPath))
+        logger.exception(msg)
+        status = ERROR
+    logger.info('LAADS download retries: {}'.format(RETRY_POLICY.summary()))
+
+    # write the run metrics so they're shipped along with the data
+    try:
+        PUBLISHED.extend(METRICS.write(getMetricsDir(auxdir),
+                                       getJobName(shard), status))
+    except (IOError, OSError) as e:
+        logger.warning('Unable to write the run metrics: {}'.format(e))
+
+    # list the files written by this run (including the manifest snapshot)
+    # so only they are uploaded to S3
+    publishList = PUBLISHED.write(getJobName(shard), auxdir)
+    logger.info('Files to publish are listed in {}'.format(publishList))
+    if status == ERROR:
+        msg = ('Problems occurred while processing LAADS data for {} - {}'
+               .format(syear, eyear))
+        logger.error(msg)
+        return ERROR
 
     msg = 'LAADS processing complete.'
     logger.info(msg)